@@ -0,0 +1,229 @@
+"""Benchmarks of the overhead that Flammable adds on top of plain PyTorch.
+
+Models and datasets are synthetic and tiny, so that the cost of the framework
+dominates the measurements. Everything happens in a temporary folder: no real
+experiments of the library are touched. Results are emitted as JSON (to stdout
+or to the file given with --output), so that they can be compared over time.
+
+Usage:
+  python benchmarks/bench_overhead.py [--output FILE] [--quick]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import flammable
+from flammable import Experiment, Logger
+from flammable.snapshot import DummySnapshot, Snapshot
+
+TASK_SCRIPT = """\
+import torch
+from flammable import Task
+
+class BenchTask(Task):
+  pass
+
+task = BenchTask(torch.nn.Linear(16, 4))
+task.main()
+"""
+
+def measure(function, repeat, number=1):
+  """Time "number" calls of function, "repeat" times. Stats are per single call."""
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    for _ in range(number):
+      function()
+    times.append((time.perf_counter() - start) / number)
+  return {
+    'mean': statistics.mean(times),
+    'median': statistics.median(times),
+    'min': min(times),
+    'repeat': repeat,
+    'number': number,
+  }
+
+
+class TinyTask(flammable.Task):
+  def __init__(self, loader):
+    super(TinyTask, self).__init__(torch.nn.Sequential(
+      torch.nn.Linear(16, 16), torch.nn.ReLU(), torch.nn.Linear(16, 4)
+    ))
+    self.loader = loader
+    self.device = 'cpu'
+    self.epochs = 1
+
+  def get_training_data(self):
+    return self.loader
+
+  def get_criterion(self):
+    return torch.nn.CrossEntropyLoss()
+
+  def get_optimizer(self):
+    return torch.optim.SGD(self.model.parameters(), lr=0.01)
+
+
+def make_loader(samples, batch_size=4):
+  dataset = torch.utils.data.TensorDataset(torch.randn(samples, 16), torch.randint(0, 4, (samples,)))
+  return torch.utils.data.DataLoader(dataset, batch_size=batch_size)
+
+def bench_training(scale):
+  """Task.iteration and Task.epoch against an equivalent hand-written loop."""
+  loader = make_loader(64 * scale)
+  batches = list(loader)
+  task = TinyTask(loader)
+  task.snapshot = DummySnapshot()
+  task.criterion = task.get_criterion()
+  task.optimizer = task.get_optimizer()
+  task.epoch_i = 0
+  model, criterion, optimizer = task.model, task.criterion, task.optimizer
+  def raw_iteration(sample):
+    data, label = sample
+    model.train()
+    optimizer.zero_grad()
+    loss = criterion(model(data), label)
+    loss.backward()
+    optimizer.step()
+    return loss.item()
+  def raw_epoch():
+    losses = []
+    for sample in loader:
+      losses.append(raw_iteration(sample))
+    return sum(losses) / len(losses)
+  sample = batches[0]
+  results = {
+    'raw_iteration': measure(lambda: raw_iteration(sample), 20, 50),
+    'task_iteration': measure(lambda: task.iteration(sample), 20, 50),
+    'raw_epoch': measure(raw_epoch, 10),
+    'task_epoch': measure(lambda: task.epoch(loader), 10),
+  }
+  results['iteration_overhead'] = results['task_iteration']['median'] / results['raw_iteration']['median']
+  results['epoch_overhead'] = results['task_epoch']['median'] / results['raw_epoch']['median']
+  return results
+
+def bench_logging(temp_dir, scale):
+  """Logger.log throughput, and Logger.store_train into a real Snapshot."""
+  values = {'loss': 0.5, 'accuracy': 0.9, 'f1': 0.7}
+  logger = Logger()
+  path = os.path.join(temp_dir, 'logging')
+  os.mkdir(path)
+  snapshot = Snapshot.create(path, 'bench', None, None, None, None)
+  logger.log(values)
+  log = measure(lambda: logger.log(values), 10, 1000 * scale)
+  store = measure(lambda: logger.store_train(snapshot, epoch_i=0), 10, 10)
+  return {
+    'log': log,
+    'log_per_second': 1 / log['median'],
+    'store_train': store,
+  }
+
+def bench_serialize(temp_dir, sizes):
+  """Snapshot.serialize with histories of growing length."""
+  results = {}
+  for size in sizes:
+    path = os.path.join(temp_dir, 'serialize-{}'.format(size))
+    os.mkdir(path)
+    snapshot = Snapshot.create(path, 'bench', None, None, None, None)
+    snapshot.train_data = {
+      'loss': [0.5] * size,
+      'accuracy': [0.9] * size,
+      'epoch_i': list(range(size)),
+    }
+    results[str(size)] = measure(snapshot.serialize, 10)
+  return results
+
+def make_experiment(temp_dir, name, files):
+  """Create an Experiment linked to a local repository of "files" scripts."""
+  experiment = Experiment.new(os.path.join(temp_dir, name))
+  local_path = os.path.join(temp_dir, name + '-local')
+  os.mkdir(local_path)
+  script_path = os.path.join(local_path, 'task.py')
+  with open(script_path, 'w') as file:
+    file.write(TASK_SCRIPT)
+  for i in range(files - 1):
+    with open(os.path.join(local_path, 'module{}.py'.format(i)), 'w') as file:
+      file.write('VALUE = {}\n'.format(i))
+  experiment.link_local_repo(script_path)
+  return experiment, local_path
+
+def bench_repository(temp_dir, file_counts):
+  """check_changes and make_snapshot on synthetic repositories, and import_snapshot."""
+  results = {}
+  for files in file_counts:
+    experiment, local_path = make_experiment(temp_dir, 'repo-{}'.format(files), files)
+    experiment.make_snapshot('initial')
+    counter = [0]
+    def modify():
+      counter[0] += 1
+      with open(os.path.join(local_path, 'task.py'), 'a') as file:
+        file.write('# change {}\n'.format(counter[0]))
+    def snapshot():
+      modify()
+      experiment.check_changes()
+      experiment.make_snapshot('change')
+    results[str(files)] = {
+      'check_changes_clean': measure(experiment.check_changes, 10),
+      'check_changes_modified': measure(lambda: (modify(), experiment.check_changes()), 10),
+      'make_snapshot': measure(snapshot, 5),
+    }
+    target = experiment.get_last_snapshot()
+    results[str(files)]['import_snapshot'] = measure(lambda: experiment.import_snapshot(target), 5)
+  return results
+
+def bench_library(temp_dir, counts):
+  """Library startup (loading all the experiments) with many experiments."""
+  results = {}
+  library_class = type(flammable.library)
+  for count in counts:
+    storage_path = os.path.join(temp_dir, 'library-{}'.format(count))
+    os.mkdir(storage_path)
+    for i in range(count):
+      Experiment.new(os.path.join(storage_path, 'experiment{}'.format(i)))
+    # Bypass the configuration, point a fresh Library at the synthetic storage
+    library = library_class.__new__(library_class)
+    library.storage_path = storage_path
+    results[str(count)] = measure(library.load_experiments, 5)
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description="Measure the overhead of Flammable.")
+  parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+  parser.add_argument('--quick', action='store_true', help="Smaller sizes, for a quick check.")
+  args = parser.parse_args()
+  torch.manual_seed(0)
+  torch.set_num_threads(1)
+  scale = 1 if args.quick else 4
+  results = {
+    'meta': {
+      'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'python': platform.python_version(),
+      'torch': torch.__version__,
+      'platform': platform.platform(),
+      'quick': args.quick,
+    },
+  }
+  with tempfile.TemporaryDirectory(prefix='flmbench') as temp_dir:
+    results['training'] = bench_training(scale)
+    results['logging'] = bench_logging(temp_dir, scale)
+    results['serialize'] = bench_serialize(temp_dir, [10, 100, 1000] + ([] if args.quick else [10000, 100000]))
+    results['repository'] = bench_repository(temp_dir, [10, 100] + ([] if args.quick else [1000]))
+    results['library'] = bench_library(temp_dir, [10] + ([] if args.quick else [100]))
+  output = json.dumps(results, indent=2)
+  if args.output:
+    with open(args.output, 'w') as file:
+      file.write(output)
+  else:
+    print(output)
+
+
+if __name__ == '__main__':
+  main()
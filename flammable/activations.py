@@ -0,0 +1,151 @@
+import time
+
+import torch
+import torch.utils.checkpoint
+
+class ActivationCheckpointing():
+  """Applies activation checkpointing to chosen submodules of a model.
+
+  Checkpointed submodules do not keep their intermediate activations for the
+  backward pass - they are recomputed when needed instead. This trades extra
+  compute for (often substantially) lower memory usage during training.
+
+  Submodules are given by their names ("modules", as in model.named_modules).
+  Alternatively the model, if it is a Sequential, can be split into segments
+  of N layers ("every"), each checkpointed as a whole - only the activations
+  at every N-th layer are then kept.
+  Checkpointing only kicks in while training with gradients enabled; in other
+  cases modules run normally. The time spent recomputing is accumulated in
+  "recompute_time".
+
+  Model structure and parameter names stay untouched: only the "forward" of
+  each chosen submodule is wrapped, which "disable" reverts.
+
+  The memory saved can be measured with "probe", which runs a step function
+  with and without checkpointing, counting the activations kept for backward.
+  """
+  def __init__(self, model, modules=None, every=None):
+    self.model = model
+    self.targets = [model.get_submodule(name) for name in modules or []]
+    if every and not isinstance(model, torch.nn.Sequential):
+      raise TypeError("Checkpointing every N-th layer requires a Sequential model!")
+    self.every = every
+    self.recompute_time = 0.0
+    self.depth = 0  # how many checkpointed forwards are currently running
+
+  def enable(self):
+    for module in self.targets:
+      module.forward = self.wrap(module, module.forward)
+    if self.every:
+      segments = [
+        self.wrap(self.model, self.segment(start))
+        for start in range(0, len(self.model), self.every)
+      ]
+      def forward(input):
+        for segment in segments:
+          input = segment(input)
+        return input
+      self.model.forward = forward
+
+  def disable(self):
+    for module in self.targets + [self.model]:
+      if 'forward' in module.__dict__:
+        del module.forward
+
+  def segment(self, start):
+    """Return a function running "every" layers of the model from "start"."""
+    layers = list(self.model)[start:start + self.every]
+    def run(input):
+      for layer in layers:
+        input = layer(input)
+      return input
+    return run
+
+  def reset_time(self):
+    """Return the recompute time accumulated so far, and zero the counter."""
+    recompute_time, self.recompute_time = self.recompute_time, 0.0
+    return recompute_time
+
+  def probe(self, step):
+    """Measure activation memory and step time with and without checkpointing.
+
+    "step" should do a full forward and backward pass. Checkpointing is left
+    enabled afterwards. Returns a dict with both measurements, in bytes and
+    seconds respectively, and the differences between them.
+
+    Buffers of the model (e.g. running statistics of batch normalization) are
+    restored after each step, so that probing leaves no trace in the model.
+    """
+    buffers = [(buffer, buffer.detach().clone()) for buffer in self.model.buffers()]
+    results = {}
+    for enabled in (False, True):
+      self.disable()
+      if enabled:
+        self.enable()
+      start = time.perf_counter()
+      try:
+        with SavedActivations(self.model.parameters()) as saved:
+          step()
+        elapsed = time.perf_counter() - start
+      finally:
+        with torch.no_grad():
+          for buffer, value in buffers:
+            buffer.copy_(value)
+      mode = 'with' if enabled else 'without'
+      results['activation_memory_' + mode] = saved.total
+      results['step_time_' + mode] = elapsed
+    results['memory_saved'] = results['activation_memory_without'] - results['activation_memory_with']
+    results['extra_compute'] = results['step_time_with'] - results['step_time_without']
+    self.reset_time()
+    return results
+
+  def wrap(self, module, forward):
+    def recomputable(*args, **kwargs):
+      # Called once during the forward pass, and again during the backward
+      # pass - time only the latter
+      # (recomputation may also be stopped early, by an exception)
+      start = time.perf_counter()
+      try:
+        return forward(*args, **kwargs)
+      finally:
+        if self.depth == 0:
+          self.recompute_time += time.perf_counter() - start
+    def checkpointed(*args, **kwargs):
+      if not (module.training and torch.is_grad_enabled()):
+        return forward(*args, **kwargs)
+      self.depth += 1
+      try:
+        return torch.utils.checkpoint.checkpoint(recomputable, *args, use_reentrant=False, **kwargs)
+      finally:
+        self.depth -= 1
+    return checkpointed
+
+
+class SavedActivations():
+  """Context manager counting the memory of tensors saved for the backward pass.
+
+  Tensors sharing memory with the given parameters (e.g. transposed weights)
+  are not counted, and each storage is counted only once. The result, in bytes,
+  is available as "total".
+  """
+  def __init__(self, parameters=()):
+    self.total = 0
+    self.storages = {param.untyped_storage().data_ptr() for param in parameters}
+    self.hooks = torch.autograd.graph.saved_tensors_hooks(self.pack, self.unpack)
+
+  def pack(self, tensor):
+    storage = tensor.untyped_storage()
+    if storage.data_ptr() not in self.storages:
+      self.storages.add(storage.data_ptr())
+      self.total += storage.nbytes()
+    return tensor
+
+  def unpack(self, tensor):
+    return tensor
+
+  def __enter__(self):
+    self.hooks.__enter__()
+    return self
+
+  def __exit__(self, *args):
+    self.hooks.__exit__(*args)
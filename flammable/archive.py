@@ -0,0 +1,230 @@
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+
+from .blobstore import BlobStore, manifest_store, read_manifest
+from .locking import write_atomic
+
+# Compressions supported by the archives (tarfile stream modes)
+COMPRESSIONS = [None, 'gz', 'bz2', 'xz']
+META_FILE = 'pack.json'
+BUNDLE_FILE = 'repo.bundle'
+# Snapshot contents that are derived, local data, not worth moving around
+SKIPPED = {'results'}
+
+def snapshot_files(snapshot):
+  """List the files of a Snapshot folder to archive, as paths relative to it."""
+  files = []
+  for root, dirs, names in os.walk(snapshot.root_path):
+    if root == snapshot.root_path:
+      dirs[:] = [name for name in dirs if name not in SKIPPED]
+    dirs.sort()
+    for name in sorted(names):
+      if not name.endswith(('.tmp', '.lock')):
+        files.append(os.path.relpath(os.path.join(root, name), snapshot.root_path))
+  return files
+
+def check_meta(meta):
+  """Raise RuntimeError unless the metadata from an archive is safe to use.
+
+  Everything in it comes from outside: names must not point outside of their
+  folders (absolute paths, ".."), and whatever goes to git must be a plain ID.
+  """
+  def check(valid, what):
+    if not valid:
+      raise RuntimeError("Unsafe {} in the archive!".format(what))
+  check(isinstance(meta.get('uid'), str) and re.fullmatch(r'[A-Za-z0-9][A-Za-z0-9_-]*', meta['uid']), 'Snapshot ID')
+  check(isinstance(meta.get('commit_sha'), str) and re.fullmatch(r'[0-9a-f]{40,64}', meta['commit_sha']), 'commit')
+  check(meta.get('ref') == 'refs/heads/flammable-pack-' + meta['uid'], 'ref')
+  name = meta.get('snapshot')
+  check(isinstance(name, str) and name not in ('', '.', '..') and os.path.basename(name) == name and '/' not in name and '\\' not in name, 'Snapshot name')
+  check(isinstance(meta.get('files'), list) and all(is_safe_path(path) for path in meta['files']), 'file path')
+  check(isinstance(meta.get('blobs'), list) and all(isinstance(key, str) and re.fullmatch(r'[0-9a-f]{64}', key) for key in meta['blobs']), 'blob')
+
+def is_safe_path(path):
+  """Check that a relative path stays inside of the folder it is joined with."""
+  if not isinstance(path, str) or not path or os.path.isabs(path) or '\\' in path:
+    return False
+  normalized = os.path.normpath(path)
+  return normalized != '..' and not normalized.startswith('..' + os.sep) and normalized != '.'
+
+def pack_snapshot(experiment, snapshot, path, compression=None):
+  """Write a Snapshot, with its code, to a single archive.
+
+  The archive is a tar stream of:
+    * pack.json: what it contains (see below),
+    * repo.bundle: git bundle with the commit of the Snapshot (and its history),
+    * snapshot/...: all the files of the Snapshot folder (metadata, journal,
+      model files, artifacts), except the result cache and the lock,
+    * blobs/...: blobs of all model files in the "blobs" format.
+  "compression" is one of COMPRESSIONS. Files are streamed into the archive in
+  chunks, so the memory used does not depend on their sizes.
+  """
+  if compression not in COMPRESSIONS:
+    raise KeyError("Unknown archive compression: \"{}\"!".format(compression))
+  files = snapshot_files(snapshot)
+  blobs = {}  # key -> path, each blob once
+  for filename in files:
+    file_path = os.path.join(snapshot.root_path, filename)
+    manifest = read_manifest(file_path)
+    if manifest is not None:
+      store = manifest_store(file_path, manifest)
+      for entry in manifest['tensors'].values():
+        blobs[entry['blob']] = store.blob_path(entry['blob'])
+  # Bundling requires a ref - point a temporary branch at the commit
+  branch = 'flammable-pack-{}'.format(snapshot.uid)
+  meta = {
+    'snapshot': os.path.basename(os.path.abspath(snapshot.root_path)),
+    'uid': snapshot.uid,
+    'commit_sha': snapshot.commit_sha,
+    'ref': 'refs/heads/' + branch,
+    'files': files,
+    'blobs': sorted(blobs.keys()),
+  }
+  with tempfile.TemporaryDirectory() as temp_dir:
+    bundle_path = os.path.join(temp_dir, BUNDLE_FILE)
+    head = experiment.repo.create_head(branch, snapshot.commit_sha)
+    try:
+      experiment.repo.git.bundle('create', bundle_path, branch)
+    finally:
+      experiment.repo.delete_head(head, force=True)
+    meta_path = os.path.join(temp_dir, META_FILE)
+    with open(meta_path, 'w') as file:
+      json.dump(meta, file)
+    try:
+      with tarfile.open(path, 'w|' + (compression or '')) as tar:
+        tar.add(meta_path, arcname=META_FILE)
+        tar.add(bundle_path, arcname=BUNDLE_FILE)
+        for filename in files:
+          tar.add(os.path.join(snapshot.root_path, filename), arcname='snapshot/' + filename)
+        for key in meta['blobs']:
+          tar.add(blobs[key], arcname='blobs/' + key)
+    except BaseException:
+      if os.path.exists(path):
+        os.remove(path)
+      raise
+  return meta
+
+def unpack_snapshot(experiment, path):
+  """Restore a Snapshot from an archive written by pack_snapshot.
+
+  The commit is fetched from the bundle into the global repository, under the
+  "refs/snapshots/<uid>" ref (which keeps it reachable; if the repository is
+  empty, its master branch starts there as well), blobs are added to the
+  Experiment's BlobStore and the Snapshot folder is recreated under its original
+  name. The archive is read as a stream, one file at a time, in chunks. Returns
+  the new Snapshot instance.
+
+  Archives are untrusted: members and paths that would end up outside of their
+  destination folders are rejected (RuntimeError), and so are links and special
+  files (tarfile's "data" filter, where available). So are model manifests that
+  refer to anything but the blobs of the archive (see adopt_manifests). If the
+  unpacking fails, the blobs and the ref it has added are removed again.
+  """
+  temp_path = tempfile.mkdtemp(prefix='unpack-', dir=experiment.path)
+  unpacked_path = os.path.join(temp_path, 'snapshot')
+  store = BlobStore(os.path.join(experiment.path, 'blobs'))
+  meta = None
+  fetched = False
+  imported = []  # blobs written by this call, to remove if it fails
+  keys = None  # blobs referenced by the model files, once acquired
+  try:
+    with tarfile.open(path, 'r|*') as tar:
+      for member in tar:
+        if hasattr(tarfile, 'data_filter'):
+          try:
+            member = tarfile.data_filter(member, temp_path)
+          except tarfile.FilterError as error:
+            raise RuntimeError("Unsafe member of the archive: {}".format(error))
+        if not member.isfile():
+          continue
+        source = tar.extractfile(member)
+        if member.name == META_FILE:
+          meta = json.load(source)
+          check_meta(meta)
+          if meta['uid'] in experiment.snapshot_ids:
+            raise RuntimeError("Snapshot {} already exists in the Experiment!".format(meta['uid']))
+          continue
+        if meta is None:
+          raise RuntimeError("Not a snapshot archive: {} is missing!".format(META_FILE))
+        if member.name == BUNDLE_FILE:
+          bundle_path = os.path.join(temp_path, BUNDLE_FILE)
+          with open(bundle_path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+          experiment.repo.git.fetch(
+            bundle_path, '{}:refs/snapshots/{}'.format(meta['ref'], meta['uid'])
+          )
+          fetched = True
+          if not experiment.repo.heads:
+            # Empty repository (new Experiment) - start its history there
+            experiment.repo.create_head('master', meta['commit_sha'])
+            experiment.repo.head.reset(index=True, working_tree=True)
+        elif member.name.startswith('snapshot/'):
+          filename = member.name[len('snapshot/'):]
+          if filename not in meta['files']:
+            raise RuntimeError("Unexpected file in the archive: {}".format(member.name))
+          target_path = os.path.join(unpacked_path, filename)
+          os.makedirs(os.path.dirname(target_path), exist_ok=True)
+          with open(target_path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        elif member.name.startswith('blobs/'):
+          key = member.name[len('blobs/'):]
+          if key not in meta['blobs']:
+            raise RuntimeError("Unexpected file in the archive: {}".format(member.name))
+          if store.import_blob(key, source):
+            imported.append(key)
+    if meta is None:
+      raise RuntimeError("Not a snapshot archive: {} is missing!".format(META_FILE))
+    snapshot_path = os.path.join(experiment.snap_path, meta['snapshot'])
+    keys = adopt_manifests(meta, unpacked_path, snapshot_path, store)
+    store.acquire(keys)
+    os.rename(unpacked_path, snapshot_path)
+  except BaseException:
+    if keys is not None:
+      store.release(keys)
+    store.discard(imported)
+    if fetched:
+      experiment.repo.git.update_ref('-d', 'refs/snapshots/{}'.format(meta['uid']))
+    raise
+  finally:
+    shutil.rmtree(temp_path, ignore_errors=True)
+  experiment.snapshot_names.append(meta['snapshot'])
+  experiment.snapshot_names.sort()
+  experiment.snapshot_ids.add(meta['uid'])
+  return experiment.get_snapshot(meta['snapshot'])
+
+def adopt_manifests(meta, unpacked_path, snapshot_path, store):
+  """Point the model files in the "blobs" format at the store of this Experiment.
+
+  Manifests come from the archive, so what they say is not trusted: the "store"
+  of each is rewritten (relative to where the file is going to be), and every
+  blob it lists must be one of the archive's, and present in the store. Raises
+  RuntimeError otherwise. Returns the keys of all the listed blobs, once for each
+  reference.
+  """
+  keys = []
+  for filename in meta['files']:
+    file_path = os.path.join(unpacked_path, filename)
+    if not os.path.isfile(file_path):
+      raise RuntimeError("File missing from the archive: {}".format(filename))
+    try:
+      manifest = read_manifest(file_path)
+    except ValueError:
+      raise RuntimeError("Invalid model file in the archive: {}".format(filename))
+    if manifest is None:
+      continue
+    tensors = manifest.get('tensors')
+    if not isinstance(tensors, dict):
+      raise RuntimeError("Invalid model file in the archive: {}".format(filename))
+    for entry in tensors.values():
+      key = entry.get('blob') if isinstance(entry, dict) else None
+      if key not in meta['blobs'] or not os.path.isfile(store.blob_path(key)):
+        raise RuntimeError("Model file {} refers to a blob not in the archive!".format(filename))
+      keys.append(key)
+    target_dir = os.path.dirname(os.path.join(snapshot_path, filename))
+    manifest['store'] = os.path.relpath(store.path, target_dir)
+    write_atomic(file_path, json.dumps(manifest))
+  return keys
@@ -1,9 +1,29 @@
+import concurrent.futures
+import copy
+import hashlib
+import io
+import json
 import os
 
 import torch
 
-from .logger import Logger
+from .activations import ActivationCheckpointing
+from .budget import Budget
+from .cache import SampleCache, fingerprint_file, fingerprint_loader
+from .checkpoint import benchmark_encodings, load_state, remap_state, save_state
+from .ensemble import EnsembleModule
+from .experiment import Experiment
+from .export import export_model, load_exported, save_exported
+from .logger import Logger, Throttle
+from .pipeline import batched, bounded_map, find_inputs
+from .pool import model_file_memory, model_memory
+from .resultcache import ResultCache
+from .retention import RetentionPolicy
+from .server import InferenceServer
+from .snapshot import Snapshot
 from .task import BaseTask
+from .timing import StageStats
+from .tuning import autotune_loader, probe_batch_sizes, rebuild_loader
 
 class PytorchTrainable():
   """Mixin for training-related abstractions.
@@ -100,29 +120,207 @@ class PytorchTrainable():
   def epoch(self, dataset):
     """Default meaning of an 'epoch' (single iteration over the dataset).
 
-    Additionally does some basic book-keeping using Logger.
+    Additionally does some basic book-keeping using Logger. If "flush_every" or
+    "flush_interval" is set, metrics aggregated so far are also flushed to the
+    Snapshot's iter_data every that many iterations or seconds, respectively.
+    With activation checkpointing, the time spent recomputing activations and
+    the activation memory saved (see "checkpoint_activations") are also stored.
+
+    When training within a Budget, the epoch ends early as soon as any of its
+    limits is reached, setting "stop_reason".
     """
     logger = Logger('average')
+    throttle = Throttle(self.flush_every, self.flush_interval)
     for self.iter_i, sample in enumerate(dataset):
       losses = self.iteration(sample)
       logger.log(losses)
-    logger.store_train(self.snapshot, epoch_i=self.epoch_i)
+      if throttle.ready():
+        logger.store_progress(self.snapshot, epoch_i=self.epoch_i, iter_i=self.iter_i)
+      if self.budget:
+        self.budget.count(sample)
+        self.stop_reason = self.budget.exceeded()
+        if self.stop_reason:
+          break
+    custom = {}
+    if self.checkpointing:
+      custom['recompute_time'] = self.checkpointing.reset_time()
+      custom['activation_memory_saved'] = self.snapshot.custom_data['checkpointing']['memory_saved']
+    logger.store_train(self.snapshot, epoch_i=self.epoch_i, **custom)
 
   def train(self):
-    """Default training meta-algorithm."""
+    """Default training meta-algorithm.
+
+    If "warm_start" is set, the model is first initialized from the weights of
+    another Snapshot (see "warm_start_from"). Then it is trained for "epochs"
+    epochs, unless stopped early: by reaching a limit of the
+    compute budget ("max_time", "max_iterations", "max_samples", see budget.
+    Budget), or by the EarlyStopping set as "early_stopping" (checked after
+    each epoch, against the validations made so far). Either way the final model
+    is saved, and the reason and the moment of stopping are recorded in the
+    Snapshot's custom_data, under "stop".
+    """
+    self.budget = Budget(self.max_time, self.max_iterations, self.max_samples)
+    self.stop_reason = None
+    if self.early_stopping:
+      self.early_stopping.reset()
     self.model.to(self.device)
+    # Optionally, start from the weights of another Snapshot
+    if self.warm_start:
+      self.warm_start_from(**self.warm_start)
     # Initialize required components (user-defined)
     data = self.get_training_data()
     self.criterion = self.get_criterion()
     self.optimizer = self.get_optimizer()
+    # Optional speedups
+    if self.autotune:
+      data = self.tune_data(data)
+    if self.cache_training_data:
+      data = self.cache_data(data)
+    # Optional memory savings
+    if self.checkpoint_modules or self.checkpoint_every:
+      self.checkpoint_activations(data)
     # Run the outer loop
-    for self.epoch_i in range(self.epochs):
-      self.epoch(data)
+    try:
+      for self.epoch_i in range(self.epochs):
+        self.epoch(data)
+        if not self.stop_reason and self.early_stopping:
+          if self.early_stopping.update(self.snapshot.val_data):
+            self.stop_reason = 'early_stopping'
+        if self.stop_reason:
+          break
+    finally:
+      if self.checkpointing:
+        self.checkpointing.disable()
+        self.checkpointing = None
+    self.record_stop()
     # Store the final model
     self.save_model('final.pt')
 
   # Utilities
 
+  def warm_start_from(self, snapshot, filename=None, prefix=None, prefixes=None, patterns=None, strict=True):
+    """Initialize the model with the weights of another Snapshot's model file.
+
+    "snapshot" is a Snapshot, or a name or ID of one in the same Experiment. The
+    model file is the given one, or the last one of that Snapshot. Only entries
+    starting with "prefix" are loaded, if given; they can be renamed to fit this
+    model (see checkpoint.remap_state for "prefixes" and "patterns"). With
+    "strict", all the model's entries must be loaded, and nothing else.
+
+    The source (Snapshot, model file and its hash) and the loading settings are
+    recorded in the Snapshot's custom_data, under "warm_start" (see also
+    Experiment.lineage), and returned.
+    """
+    if not isinstance(snapshot, Snapshot):
+      experiment_path = self.snapshot.experiment_path()
+      if experiment_path is None:
+        raise RuntimeError("Only Snapshots of an Experiment can be warm-started by name!")
+      source = Experiment(experiment_path).get_snapshot(snapshot)
+      if source is None:
+        raise KeyError(snapshot)
+    else:
+      source = snapshot
+    if filename:
+      path = source.make_path(filename)
+      if not os.path.isfile(path):
+        raise RuntimeError("There is no such model file in the source Snapshot folder!")
+    else:
+      path = source.fetch_last_model_file()
+      if not path:
+        raise RuntimeError("The source Snapshot has no saved model files!")
+    state_dict = remap_state(load_state(path, prefix), prefixes, patterns)
+    missing, unexpected = self.model.load_state_dict(state_dict, strict=strict)
+    provenance = {
+      'snapshot': os.path.basename(os.path.abspath(source.root_path)),
+      'uid': source.uid,
+      'commit_sha': source.commit_sha,
+      'model_file': os.path.basename(path),
+      'model_hash': fingerprint_file(path),
+      'prefix': prefix,
+      'prefixes': prefixes,
+      'patterns': patterns,
+      'strict': strict,
+      'loaded_keys': len(state_dict) - len(unexpected),
+      'missing_keys': missing,
+      'unexpected_keys': unexpected,
+    }
+    with self.snapshot.custom_storage() as transaction:
+      transaction.store('warm_start', provenance)
+    return provenance
+
+  def record_stop(self):
+    """Store why and when the training has stopped in the Snapshot.
+
+    The reason is "completed" if all the epochs have run, otherwise the name of
+    the budget limit reached, or "early_stopping" (along with the best value of
+    the metric, and the epoch it was reached at).
+    """
+    stop = dict(
+      reason=self.stop_reason or 'completed',
+      epoch_i=self.epoch_i,
+      iter_i=self.iter_i,
+      **self.budget.summary()
+    )
+    if self.early_stopping:
+      stop['early_stopping'] = self.early_stopping.summary(self.snapshot.val_data)
+    with self.snapshot.custom_storage() as transaction:
+      transaction.store('stop', stop)
+    if self.stop_reason:
+      print("Training stopped ({}) at epoch {}, iteration {}.".format(
+        self.stop_reason, self.epoch_i, self.iter_i
+      ))
+
+  def checkpoint_activations(self, loader):
+    """Enable activation checkpointing of the model, as configured.
+
+    Submodules listed by name in "checkpoint_modules" and/or every N-th layer
+    of a Sequential model ("checkpoint_every") will have their activations
+    recomputed during backward instead of kept in memory. One training step
+    on the first batch is made with and without checkpointing, to measure the
+    memory saved and the compute added (see activations.ActivationCheckpoint-
+    ing.probe) - the results are stored in the Snapshot's custom_data, under
+    "checkpointing", and returned.
+    """
+    self.checkpointing = ActivationCheckpointing(
+      self.model, self.checkpoint_modules, self.checkpoint_every
+    )
+    sample = next(iter(loader))
+    def step():
+      self.model.train()
+      prepared = self.prepare_train(sample)
+      output = self.forward_train(prepared)
+      self.backward(output, prepared)
+    results = self.checkpointing.probe(step)
+    # Do not let the probe affect the first real update
+    self.optimizer.zero_grad()
+    with self.snapshot.custom_storage() as transaction:
+      transaction.store('checkpointing', results)
+    return results
+
+  def tune_data(self, loader):
+    """Apply the fastest loader and threading settings, finding them if needed.
+
+    Settings found for the same commit earlier (by any Snapshot) are reused,
+    otherwise they are searched for (see tuning.autotune_loader). Either way
+    they are recorded in the Snapshot's custom_data, under "autotune". Returns
+    the loader rebuilt with these settings.
+    """
+    if rebuild_loader(loader) is None:
+      return loader  # not a DataLoader, nothing to tune
+    config = self.snapshot.find_sibling_data('autotune')
+    if config is None:
+      config, results = autotune_loader(self, loader)
+      print("Autotuned data loading:", config)
+    else:
+      config = config['config']
+      results = None
+    with self.snapshot.custom_storage() as transaction:
+      transaction.store('autotune', {'config': config, 'results': results})
+    torch.set_num_threads(config['threads'])
+    return rebuild_loader(
+      loader, config['num_workers'], config['prefetch_factor'], config['pin_memory']
+    )
+
   def every_n_epochs(self, n, function, skip_zero=True):
     """Execute "function" but only every "n" epochs.
 
@@ -263,14 +461,138 @@ class PytorchTestable():
     else:
       return logger.return_final()
 
-  def test(self):
-    """Master algorithm for testing, as executed by the CLI."""
-    self.load_model()
-    self.model.to(self.device)
+  def test(self, retest=False):
+    """Master algorithm for testing, as executed by the CLI.
+
+    Results are stored along with a fingerprint of the code, the model file and
+    the test data (see "test_fingerprint"). If the Snapshot already holds the
+    results for the same fingerprint, testing is skipped, unless "retest". If
+    the test data cannot be fingerprinted, testing is never skipped.
+    """
     # Spawn data now, but the metric callable later
     data = self.get_testing_data()
+    path = self.snapshot.fetch_last_model_file()
+    fingerprint = self.test_fingerprint(path, data) if path else None
+    if not retest and fingerprint and self.snapshot.test_data.get('fingerprint') == fingerprint:
+      print("Test results are up to date. If you wish to test anyway, run with --retest.")
+      return
+    self.load_model(assign=True)
+    self.model.to(self.device)
     # Run the test logic (automatically stores results)
     self.test_on(data, self.snapshot)
+    with self.snapshot.test_storage() as transaction:
+      transaction.store('fingerprint', fingerprint)
+
+  def test_fingerprint(self, model_path, loader):
+    """Return a string identifying the outcome of a test.
+
+    Combines the commit of the Snapshot, the hash of the contents of the model
+    file and the fingerprint of the test data (see "fingerprint_data"). Returns
+    None if the data has no fingerprint.
+    """
+    data_fingerprint = self.fingerprint_data(loader)
+    if data_fingerprint is None:
+      return None
+    digest = hashlib.sha256()
+    digest.update(str(self.snapshot.commit_sha).encode())
+    digest.update(fingerprint_file(model_path).encode())
+    digest.update(data_fingerprint.encode())
+    return digest.hexdigest()
+
+  # Multi-model testing
+
+  def test_many(self, models, memory_budget=None):
+    """Test many models in a single pass over the test data.
+
+    "models" is a list of Tasks (each tested with the last model file of its
+    Snapshot), (Task, filename) pairs, e.g. to compare the model files of a
+    single Snapshot, and/or Snapshots of this Task's Experiment. The test data
+    comes from this Task: each batch is loaded and prepared ("prepare_test")
+    once, and then forwarded through all models, each using its own Task's
+    "forward_test", "evaluate_metrics" and metric.
+
+    If the models do not fit in "memory_budget" (bytes of parameters and buffers,
+    see pool.model_memory) all at once, as many passes are made as needed. Given
+    Snapshots are only imported for the pass that tests them (their sizes are
+    estimated from the model files, see pool.model_file_memory), and dropped
+    right after it, so at most the budget of them is resident at a time.
+
+    Results are stored in the Snapshot of each model, in test_data, under the
+    "model_files" entry (by file name). Results of the last model file of a
+    Snapshot are also stored as they would be by "test". Returns the list of
+    results, one for each model.
+    """
+    models = [model if isinstance(model, (tuple, Snapshot)) else (model, None) for model in models]
+    sizes = [
+      model_file_memory(model) if isinstance(model, Snapshot) else model_memory(model[0].model)
+      for model in models
+    ]
+    groups = [[]]
+    group_size = 0
+    for index, size in enumerate(sizes):
+      if groups[-1] and memory_budget is not None and group_size + size > memory_budget:
+        groups.append([])
+        group_size = 0
+      groups[-1].append(index)
+      group_size += size
+    data = self.get_testing_data()
+    results = [None] * len(models)
+    for group_i, group in enumerate(groups):
+      print("Pass {}/{}: testing {} models".format(group_i + 1, len(groups), len(group)))
+      members = [self.make_test_member(models[index]) for index in group]
+      loggers = [Logger() for _ in group]
+      for sample in data:
+        sample = self.prepare_test(sample)
+        with torch.no_grad():
+          for member, logger in zip(members, loggers):
+            output = member.forward_test(sample)
+            logger.log(member.evaluate_metrics(output, sample))
+      for index, member, logger in zip(group, members, loggers):
+        results[index] = logger.return_final()
+        member.store_test_member(logger)
+      del members
+    return results
+
+  def make_test_member(self, model):
+    """Prepare a member for "test_many" from one of its "models" entries."""
+    if isinstance(model, Snapshot):
+      # Nothing else refers to a freshly imported Task - no need to copy it
+      return self.load_test_member(self.experiment.import_snapshot(model), copy_task=False)
+    return self.load_test_member(*model)
+
+  def load_test_member(self, task, filename=None, copy_task=True):
+    """Prepare a copy of a Task, with its own model, for use in "test_many".
+
+    Without "copy_task", the Task itself is prepared instead.
+    """
+    if copy_task:
+      member = copy.copy(task)
+      member.model = copy.deepcopy(task.float_model or task.model)
+    else:
+      member = task
+      member.model = task.float_model or task.model
+    member.float_model = None
+    member.load_model(filename, assign=True)
+    member.model_filename = os.path.basename(filename or member.snapshot.fetch_last_model_file())
+    member.device = self.device
+    member.model.to(self.device)
+    member.model.eval()
+    member.metric = member.get_metric()
+    return member
+
+  def store_test_member(self, logger):
+    """Store results of a model tested by "test_many" in its Snapshot.
+
+    Results of the last model file replace those of "test", but they come from
+    the data of another Task, so the fingerprint of that test is cleared along
+    with them (and "test" runs again).
+    """
+    with self.snapshot.test_storage() as transaction:
+      if self.model_filename == self.snapshot.model_files[-1]:
+        logger.write_test(transaction, fingerprint=None)
+      by_file = dict(transaction.data.get('model_files', {}))
+      by_file[self.model_filename] = logger.return_final()
+      transaction.store('model_files', by_file)
 
   # Validation interface
 
@@ -329,6 +651,26 @@ class PytorchEvaluable():
   "eval_path" is a complete interface, including loading input data and storing
   the outputs, while "eval" only performs evaluation.
 
+  Several Tasks sharing the model architecture can be evaluated as one, with a
+  single vectorized forward pass (see "ensemble").
+
+  Many inputs can be processed at once with "eval_many", which loads the model
+  only once and overlaps the stages: samples are loaded and results stored on
+  thread pools, while the model processes them in batches (see "eval_batch").
+  The same batched evaluation backs the inference server ("server"), where the
+  samples are decoded from requests rather than loaded from files, and the
+  streaming interface ("eval_stream"), where they come from any iterable.
+
+  Results can also be cached persistently, keyed by the input contents and the
+  model file, so that repeated inputs skip evaluation (see "result_cache_size").
+
+  For faster evaluation on CPU, the model can be exported ("export"): quantized
+  and/or traced into TorchScript. With "use_export", all of the above use the
+  exported version in place of the original model whenever it is available and
+  up to date (see "load_eval_model"). This is off by default: a traced model only
+  accepts inputs shaped like the example it was traced with, and a quantized one
+  gives slightly different results, so it has to be chosen knowingly.
+
   When deriving from PytorchEvaluable (or rather PytorchTask) one still needs
   to implement some of the functions - see "User code" area.
 
@@ -345,6 +687,19 @@ class PytorchEvaluable():
   def store_result(self, result, path):
     raise NotImplementedError
 
+  def decode_request(self, payload):
+    """Default conversion of a server request body (bytes) into a sample.
+
+    Expects JSON with a (nested) list of numbers, which always become a tensor of
+    the default floating point dtype (even if they all happen to be integers).
+    Override to accept something else, e.g. encoded images or token IDs.
+    """
+    return torch.tensor(json.loads(payload), dtype=torch.get_default_dtype())
+
+  def encode_response(self, result):
+    """Default conversion of a single result into a server response body."""
+    return json.dumps(result.tolist()).encode()
+
   # Meta-algorithm
 
   def prepare_eval(self, data):
@@ -377,13 +732,286 @@ class PytorchEvaluable():
   def eval_path(self, input_path, output_path):
     """Master algorithm for full evaluation, as executed by the CLI."""
     # Get ready...
-    self.load_model()
+    self.load_eval_model()
     self.model.to(self.device)
-    # ...and run
-    sample = self.load_sample(input_path)
-    result = self.eval(sample)
+    # ...and run (unless the result is cached)
+    key, result = self.fetch_cached_result(input_path)
+    if result is None:
+      sample = self.load_sample(input_path)
+      result = self.eval(sample)
+      self.cache_result(key, result)
     self.store_result(result, output_path)
 
+  # Result caching
+
+  def enable_result_cache(self, model_path):
+    """Set up the result cache for the given model file (see "result_cache_size").
+
+    The cache lives in the Snapshot folder, under "results". A DummySnapshot has
+    no folder, so there is no caching then.
+    """
+    self.result_cache = None
+    if self.result_cache_size and self.snapshot.experiment_path() is not None:
+      self.result_cache = ResultCache(
+        self.snapshot.make_path('results'),
+        fingerprint_file(model_path),
+        self.result_cache_size,
+      )
+
+  def fetch_cached_result(self, input_path):
+    """Look up the result for an input file in the cache.
+
+    Returns the cache key and the result (None on a miss). The key is None if
+    caching is disabled.
+    """
+    if self.result_cache is None:
+      return None, None
+    with open(input_path, 'rb') as file:
+      key = self.result_cache.key(file.read(), 'file')
+    value = self.result_cache.get(key)
+    if value is None:
+      return key, None
+    return key, torch.load(io.BytesIO(value), weights_only=False)
+
+  def cache_result(self, key, result):
+    """Store a result in the cache, under a key from "fetch_cached_result"."""
+    if key is not None:
+      buffer = io.BytesIO()
+      torch.save(result, buffer)
+      self.result_cache.put(key, buffer.getvalue())
+
+  # Batch evaluation
+
+  def collate_eval(self, samples):
+    """Default way of combining loaded samples into a single batch."""
+    return torch.stack(samples)
+
+  def split_eval(self, output):
+    """Default way of splitting a batched output into per-sample outputs."""
+    return list(output)
+
+  def eval_batch(self, samples):
+    """Batched evaluation meta-algorithm: a list of samples to a list of results.
+
+    Equivalent to calling "eval" on each sample, except that the model runs only
+    once for the entire collated batch.
+    """
+    batch = self.collate_eval(samples)
+    batch = self.prepare_eval(batch)
+    with torch.no_grad():
+      output = self.forward_eval(batch)
+    return [self.postprocess(result) for result in self.split_eval(output)]
+
+  def eval_stream(self, samples, batch_size=None, workers=None, max_latency=None):
+    """Evaluate an iterable of samples, yielding the results in order.
+
+    Meant for embedding the Task in a larger in-process pipeline. Works like
+    calling "eval" on each sample, except that the samples are prepared and the
+    results postprocessed on a pool of "workers" threads, and the model runs on
+    batches of "batch_size" prepared samples. The input is read on a separate
+    thread, at most a batch ahead, so it is not consumed (much) faster than the
+    results are, and memory stays bounded.
+
+    A batch runs once it is full, or once "max_latency" seconds (by default
+    "stream_max_latency") have passed since its first sample arrived, with no
+    more samples coming - so a slow input (e.g. one waiting for the results)
+    never holds back the samples it has given already (see pipeline.batched).
+
+    As with "eval", the model should be loaded already (e.g. "load_eval_model").
+    """
+    batch_size = batch_size or self.eval_batch_size
+    workers = workers or self.io_workers
+    if max_latency is None:
+      max_latency = self.stream_max_latency
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+      # Samples are prepared as soon as they arrive, also while the model runs
+      prepared = (pool.submit(self.prepare_eval, sample) for sample in samples)
+      for batch in batched(prepared, batch_size, timeout=max_latency):
+        batch = self.collate_eval([future.result() for future in batch])
+        with torch.no_grad():
+          outputs = self.split_eval(self.forward_eval(batch))
+        yield from pool.map(self.postprocess, outputs)
+
+  def eval_many(self, input_spec, output_dir, batch_size=None, workers=None):
+    """Master algorithm for batch evaluation, as executed by the CLI.
+
+    Inputs are given by a directory, a manifest file or a glob pattern (see
+    pipeline.find_inputs for details), results land in the "output_dir". Stages
+    are connected with bounded queues, so that only a limited number of samples
+    and results is held in memory at any time. Inputs with a cached result (see
+    "result_cache_size") skip the model. Returns timing statistics of all the
+    stages, having also printed them.
+    """
+    if not output_dir:
+      raise ValueError("Batch evaluation requires an output directory!")
+    batch_size = batch_size or self.eval_batch_size
+    workers = workers or self.io_workers
+    pairs = find_inputs(input_spec, output_dir)
+    for output_folder in sorted({os.path.dirname(output_path) for _, output_path in pairs} | {output_dir}):
+      os.makedirs(output_folder, exist_ok=True)
+    # Get ready...
+    self.load_eval_model()
+    self.model.to(self.device)
+    self.model.eval()
+    stats = StageStats()
+    # ...and run
+    def load(pair):
+      input_path, output_path = pair
+      key, result = self.fetch_cached_result(input_path)
+      sample = self.load_sample(input_path) if result is None else None
+      return sample, key, result, output_path
+    def evaluate(batch):
+      # Only the samples with no cached result need the model
+      misses = [item for item in batch if item[2] is None]
+      results = self.eval_batch([sample for sample, _, _, _ in misses]) if misses else []
+      for (_, key, _, _), result in zip(misses, results):
+        self.cache_result(key, result)
+      hits = [(result, output_path) for _, _, result, output_path in batch if result is not None]
+      return list(zip(results, [output_path for _, _, _, output_path in misses])) + hits
+    def store(pair):
+      result, output_path = pair
+      self.store_result(result, output_path)
+    load = stats.timed('load', load)
+    evaluate = stats.timed('eval', evaluate)
+    store = stats.timed('store', store)
+    samples = bounded_map(load, pairs, workers)
+    results = (pair for batch in batched(samples, batch_size) for pair in evaluate(batch))
+    for _ in bounded_map(store, results, workers):
+      stats.count()
+    print(stats.report())
+    if self.result_cache is not None:
+      print("Result cache:", self.result_cache.stats())
+    return stats.summary()
+
+  # Exporting
+
+  def export(self, filename='export.pt', quantize=True, trace=True):
+    """Build an optimized CPU inference artifact from the last model file.
+
+    The model is dynamically quantized to int8 (if "quantize") and traced into
+    TorchScript (if "trace", using the first test sample as an example input),
+    then saved in the Snapshot folder and registered as its "export" artifact.
+    Both the original and the exported model are tested on the test set, and
+    the metrics, along with the drift between them, are stored in the artifact
+    metadata, along with the name and hash of the model file it was built from.
+    Returns that metadata.
+    """
+    source_path = self.snapshot.fetch_last_model_file()
+    self.load_model(os.path.basename(source_path) if source_path else None)
+    original_model, original_device = self.model, self.device
+    data = self.get_testing_data()
+    example = None
+    if trace:
+      example, _ = next(iter(data))
+    exported = export_model(self.model, quantize=quantize, example=example)
+    path = self.snapshot.make_path(filename)
+    save_exported(exported, path)
+    # Measure the accuracy drift, everything on CPU for a fair comparison
+    self.device = 'cpu'
+    try:
+      self.model = original_model.cpu()
+      float_metrics = self.test_on(data)
+      self.model = exported
+      export_metrics = self.test_on(data)
+    finally:
+      self.model, self.device = original_model, original_device
+    drift = {
+      key: export_metrics[key] - float_metrics[key]
+      for key in float_metrics.keys()
+      if isinstance(float_metrics[key], (int, float))
+    }
+    self.snapshot.register_artifact(
+      'export',
+      filename,
+      source=os.path.basename(source_path),
+      source_hash=fingerprint_file(source_path),
+      quantized=quantize,
+      traced=trace,
+      float_metrics=float_metrics,
+      export_metrics=export_metrics,
+      drift=drift,
+    )
+    print("Exported to {}, metric drift: {}".format(filename, drift))
+    return self.snapshot.artifacts['export']
+
+  def load_eval_model(self):
+    """Load the model for evaluation: the exported one if possible.
+
+    The exported artifact is used only when "use_export" is set, the task runs
+    on CPU and the artifact is up to date (see "export_is_current") - otherwise
+    this is the same as "load_model". Also sets up the result cache for the
+    loaded model file, if enabled.
+    """
+    if isinstance(self.model, EnsembleModule):
+      return  # members have been loaded when the ensemble was made
+    artifact = self.snapshot.fetch_artifact('export')
+    on_cpu = self.device is None or torch.device(self.device).type == 'cpu'
+    if artifact and self.use_export and on_cpu and not self.export_is_current(artifact):
+      print("The export is out of date (the model has been saved since), using the model file.")
+      artifact = None
+    if artifact and self.use_export and on_cpu:
+      # Keep the original around, load_model will bring it back
+      if self.float_model is None:
+        self.float_model = self.model
+      self.model = load_exported(artifact['path'], artifact['traced'])
+      self.enable_result_cache(artifact['path'])
+    else:
+      self.load_model(assign=True)
+      self.enable_result_cache(self.snapshot.fetch_last_model_file())
+
+  def export_is_current(self, artifact):
+    """Check whether an export artifact was built from the last model file.
+
+    Both the name and the contents (hash) of the file must match.
+    """
+    path = self.snapshot.fetch_last_model_file()
+    if path is None or artifact.get('source') != os.path.basename(path):
+      return False
+    return artifact.get('source_hash') == fingerprint_file(path)
+
+  # Ensembles
+
+  def ensemble(self, tasks, reduction='mean'):
+    """Return a copy of this Task that evaluates an ensemble of other Tasks.
+
+    The last model files of the given Tasks (e.g. imported Snapshots of the same
+    architecture) are loaded and combined into a single, vectorized model (see
+    ensemble.EnsembleModule for the "reduction" options). Data preparation and
+    postprocessing are this Task's, so "eval", "eval_batch", "eval_many" and
+    "server" of the returned copy all work as usual, only with the ensemble in
+    place of the model.
+    """
+    models = []
+    for task in tasks:
+      task.load_model(assign=True)
+      models.append(task.model.to(self.device or 'cpu').eval())
+    ensemble = copy.copy(self)
+    ensemble.model = EnsembleModule(models, reduction).to(self.device or 'cpu')
+    ensemble.float_model = None
+    ensemble.result_cache = None
+    return ensemble
+
+  # Serving
+
+  def server(self, host='127.0.0.1', port=8000, max_batch=None, max_latency=None):
+    """Run a local inference server, until interrupted.
+
+    The model is loaded once, then requests arriving within "max_latency"
+    seconds of each other are grouped (up to "max_batch" of them) into a single
+    "eval_batch" call. See server.InferenceServer for the endpoints.
+    """
+    self.load_eval_model()
+    self.model.to(self.device)
+    self.model.eval()
+    server = InferenceServer(
+      route=lambda name: self if name == '' else None,
+      host=host,
+      port=port,
+      max_batch=max_batch or self.server_max_batch,
+      max_latency=max_latency or self.server_max_latency,
+    )
+    server.serve_forever()
+
 
 class PytorchTask(PytorchEvaluable, PytorchTestable, PytorchTrainable, BaseTask):
   """Basic, abstract skeleton of a PyTorch-based ML model.
@@ -409,6 +1037,7 @@ class PytorchTask(PytorchEvaluable, PytorchTestable, PytorchTrainable, BaseTask)
     super(PytorchTask, self).__init__()
     # Constituent objects
     self.model = model
+    self.float_model = None  # original model, while an export is loaded instead
     # Training-time objects
     self.criterion = None
     self.optimizer = None
@@ -419,6 +1048,46 @@ class PytorchTask(PytorchEvaluable, PytorchTestable, PytorchTrainable, BaseTask)
     # Hyperparameters
     self.device = None
     self.epochs = None
+    # Format of the saved model files (see checkpoint.FORMATS)
+    self.model_format = None  # None: "torch", or "mmap" if encoded/compressed
+    self.model_encoding = None     # reduced precision: "fp16", "bf16", "int8"
+    self.model_compression = None  # "zlib"
+    # Which model files to keep (retention.RetentionPolicy, None: keep all)
+    self.retention = None
+    # Find the fastest data loader and thread settings before training
+    self.autotune = False
+    # Record the training data on the first pass and replay it later
+    self.cache_training_data = False
+    # Activation checkpointing (names of submodules and/or every N-th layer)
+    self.checkpoint_modules = None
+    self.checkpoint_every = None
+    self.checkpointing = None
+    # Compute budget (seconds, iterations, samples - None: unlimited)
+    self.max_time = None
+    self.max_iterations = None
+    self.max_samples = None
+    self.budget = None
+    self.stop_reason = None
+    # Stop when a validation metric plateaus (budget.EarlyStopping)
+    self.early_stopping = None
+    # Initialize from another Snapshot (kwargs of "warm_start_from", or None)
+    self.warm_start = None
+    # Intra-epoch metric flushing (iterations and/or seconds, None to disable)
+    self.flush_every = None
+    self.flush_interval = None
+    # Batch evaluation (model batch size and number of I/O threads)
+    self.eval_batch_size = 1
+    self.io_workers = 4
+    # Inference server (largest batch and longest wait for it, in seconds)
+    self.server_max_batch = 16
+    self.server_max_latency = 0.005
+    # Streaming evaluation (longest wait for a batch to fill, in seconds)
+    self.stream_max_latency = 0.005
+    # Whether to evaluate using the exported model, when there is one (opt-in)
+    self.use_export = False
+    # Persistent cache of evaluation results (size in bytes, None to disable)
+    self.result_cache_size = None
+    self.result_cache = None
 
   # General model abstractions
 
@@ -428,30 +1097,178 @@ class PytorchTask(PytorchEvaluable, PytorchTestable, PytorchTrainable, BaseTask)
 
   # General utilities
 
-  def save_model(self, filename):
+  def fingerprint_data(self, loader):
+    """Return a string identifying the data a given loader produces.
+
+    By default a cheap fingerprint of the dataset files is computed (see
+    cache.fingerprint_loader). Override if your data is not identified by the
+    files pointed at by the dataset's attributes. None means that the data
+    cannot be identified, which disables skipping tests and caching samples.
+    """
+    return fingerprint_loader(loader)
+
+  def find_batch_size(self, mode='train', memory_limit=None, objective='throughput',
+                      max_size=4096, synthetic=False, force=False):
+    """Find the best batch size for training or testing the model.
+
+    Probes powers of two up to "max_size", replicating the first sample of the
+    training (or testing) data, using "iteration" (or "single_test") as the
+    step (see tuning.probe_batch_sizes). The best one is the largest that fits
+    under the "memory_limit" (objective "largest"), or the fastest one in terms
+    of samples per second (objective "throughput").
+
+    The result is stored in the Snapshot's custom_data (under "batch_size", by
+    mode), and reused next time - also by other Snapshots of the same commit -
+    unless "force" is given. Returns the best batch size.
+    """
+    stored = self.snapshot.custom_data.get('batch_size') or self.snapshot.find_sibling_data('batch_size')
+    if stored and mode in stored.keys() and not force:
+      return stored[mode]['best']
+    self.model.to(self.device)
+    model_state = copy.deepcopy(self.model.state_dict())
+    if mode == 'train':
+      loader = self.get_training_data()
+      self.criterion = self.criterion or self.get_criterion()
+      self.optimizer = self.optimizer or self.get_optimizer()
+      optimizer_state = copy.deepcopy(self.optimizer.state_dict())
+      step = self.iteration
+    elif mode == 'test':
+      loader = self.get_testing_data()
+      self.metric = self.get_metric()
+      self.model.eval()
+      step = self.single_test
+    else:
+      raise ValueError("Mode must be either \"train\" or \"test\"!")
+    sizes = [2 ** i for i in range(max_size.bit_length()) if 2 ** i <= max_size]
+    try:
+      results = probe_batch_sizes(
+        step, next(iter(loader)), sizes, self.device, memory_limit, synthetic=synthetic
+      )
+    finally:
+      # Training steps have altered the model, revert
+      self.model.load_state_dict(model_state)
+      if mode == 'train':
+        self.optimizer.load_state_dict(optimizer_state)
+    if not results:
+      raise RuntimeError("Not even a single sample fits in the memory limit!")
+    if objective == 'largest':
+      best = results[-1]['batch_size']
+    else:
+      best = max(results, key=lambda r: r['samples_per_second'])['batch_size']
+    stored = dict(self.snapshot.custom_data.get('batch_size', {}))
+    stored[mode] = {'best': best, 'objective': objective, 'results': results}
+    with self.snapshot.custom_storage() as transaction:
+      transaction.store('batch_size', stored)
+    return best
+
+  def cache_data(self, loader):
+    """Wrap a loader in a SampleCache, to record it once and replay later.
+
+    The cache lives in the Experiment folder and is keyed by the commit of the
+    Snapshot and the fingerprint of the data, so that later Snapshots of the
+    same code can reuse it. Returns the loader intact if there is no Experiment
+    to keep the cache in, or if the data has no fingerprint (a cache recorded
+    from other data could then be replayed).
+
+    Each cache takes as much disk space as the (uncompressed) training samples,
+    and one is recorded for every commit trained with caching - none of them is
+    ever deleted automatically. Any of them (folders under "cache" in the
+    Experiment folder) can be deleted while no training runs; it will simply be
+    recorded again when needed.
+    """
+    experiment_path = self.snapshot.experiment_path()
+    if experiment_path is None:
+      return loader
+    fingerprint = self.fingerprint_data(loader)
+    if fingerprint is None:
+      print("Training data has no fingerprint (see fingerprint_data), not caching it.")
+      return loader
+    key = '{}-{}'.format(self.snapshot.commit_sha[:12], fingerprint[:16])
+    return SampleCache(loader, os.path.join(experiment_path, 'cache', key))
+
+  def save_model(self, filename, fmt=None, encoding=None, compression=None):
     """Save the current state of the model under a given file.
 
     This is not just a convenience wrapper around the usual torch.save(). Most
     importantly, it registers this model file in the Snapshot's storage, which
     allows loading it by name later (and causes the physical file to be located
     in the corresponding Snapshot's folder).
+
+    "fmt" selects the file format (see checkpoint.save_state), by default the
+    one set in "model_format" is used. The "mmap" format is much faster to load
+    from, especially partially. The "blobs" format deduplicates tensors across
+    all the model files of the Experiment.
+
+    Weights can also be stored in a reduced precision ("encoding": "fp16",
+    "bf16" or "int8") and/or compressed ("compression": "zlib"), by default as
+    set in "model_encoding" and "model_compression". Only the "mmap" format
+    supports that (it is the default then), any other one raises ValueError.
+    Encoded weights are transparently upcast on load, and the encoding used is
+    recorded with the file. To choose an encoding, see "benchmark_model_files".
+
+    After saving, old model files are deleted according to the RetentionPolicy
+    set as "retention", or the one set for the Experiment, if any.
     """
+    encoding = encoding or self.model_encoding
+    compression = compression or self.model_compression
+    fmt = fmt or self.model_format or ('mmap' if encoding or compression else 'torch')
+    if (encoding or compression) and fmt != 'mmap':
+      raise ValueError("Encoding and compression require the \"mmap\" format, not \"{}\"!".format(fmt))
     path = self.snapshot.make_path(filename)
-    with open(path, 'wb') as file:
-      torch.save(self.model.state_dict(), file)
-    self.snapshot.register_model_file(filename)
-
-  def load_model(self, filename=None):
-    """Load the model state from a given file, or load the last available one."""
+    store = self.snapshot.blob_store() if fmt == 'blobs' else None
+    save_state(self.model.state_dict(), path, fmt, store, encoding, compression)
+    self.snapshot.register_model_file(
+      filename,
+      epoch_i=self.epoch_i,
+      format=fmt,
+      encoding=encoding,
+      compression=compression,
+    )
+    # Enforce the retention policy of this task, or of the whole experiment
+    policy = self.retention or RetentionPolicy.load(self.snapshot.experiment_path())
+    if policy:
+      self.snapshot.apply_retention(policy)
+
+  def benchmark_model_files(self):
+    """Measure model file size and save/load speed in each available encoding.
+
+    Writes a temporary copy of the current model per encoding, so it is never
+    done implicitly - call it explicitly, or use the "benchmark" command (which
+    loads the last model file first). Results are stored in the Snapshot's
+    custom_data, under "model_file_benchmark" (see checkpoint.benchmark_
+    encodings for details), and returned.
+    """
+    results = benchmark_encodings(self.model.state_dict())
+    with self.snapshot.custom_storage() as transaction:
+      transaction.store('model_file_benchmark', results)
+    return results
+
+  def load_model(self, filename=None, prefix=None, assign=False):
+    """Load the model state from a given file, or load the last available one.
+
+    Format of the file is detected automatically. If "prefix" is given, only
+    the parameters whose names start with it are loaded, leaving all the other
+    ones intact.
+
+    By default the loaded values are copied into the existing parameters, which
+    reads the whole file. With "assign" (and a full load of a model on CPU) the
+    loaded tensors replace the parameters instead: for the "mmap" and "blobs"
+    formats these are backed by the mapped file, so the data is only read as it
+    is used, and never copied. Parameters keep their "requires_grad", but are
+    new objects - so only use it when no optimizer refers to the old ones (e.g.
+    for evaluation and testing).
+    """
     if filename:
       path = self.snapshot.make_path(filename)
-      if os.path.isfile(path):
-        self.model.load_state_dict(torch.load(path))
-      else:
+      if not os.path.isfile(path):
         raise RuntimeError("There is no such model file in the Snapshot folder!")
     else:
       path = self.snapshot.fetch_last_model_file()
-      if path:
-        self.model.load_state_dict(torch.load(path))
-      else:
+      if not path:
         raise RuntimeError("This Snapshot has no saved model files!")
+    if self.float_model is not None:
+      # Replace the exported model (see load_eval_model) with the original one
+      self.model, self.float_model = self.float_model, None
+    state_dict = load_state(path, prefix)
+    on_cpu = all(tensor.device.type == 'cpu' for tensor in self.model.state_dict().values())
+    self.model.load_state_dict(state_dict, strict=not prefix, assign=assign and not prefix and on_cpu)
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+
+from .locking import file_lock, write_atomic
+
+class BlobStore():
+  """Content-addressed storage of binary data, shared by many Snapshots.
+
+  Each blob is stored once under the SHA-256 of its contents, no matter how many
+  times it was put in. Blobs are reference-counted: every "put" adds one ref,
+  every "release" removes one, and a blob is deleted as soon as it has none.
+  Layout of the store folder:
+    blobs/
+      objects/
+        3f/
+          3f9c...  # blob data
+      refs.json    # blob hash -> number of references
+      lock         # inter-process lock guarding refs.json
+
+  Model files saved in the "blobs" format (see checkpoint.py) are manifests that
+  list the blob of each tensor. Since parameters often stay exactly the same
+  between checkpoints (e.g. runs of the same commit, frozen layers when fine-
+  tuning), storing them this way saves both the disk space and the write time.
+  """
+  REFS_FILE = 'refs.json'
+  LOCK_FILE = 'lock'
+
+  def __init__(self, path):
+    self.path = path
+    self.objects_path = os.path.join(path, 'objects')
+    os.makedirs(self.objects_path, exist_ok=True)
+
+  def blob_path(self, key):
+    """Return the path to the file holding the blob of a given hash."""
+    return os.path.join(self.objects_path, key[:2], key)
+
+  def put(self, data):
+    """Store the data (any bytes-like object) and return its hash.
+
+    Only writes the data if an identical blob is not stored already.
+    """
+    return self.put_many([data])[0]
+
+  def put_many(self, buffers):
+    """Store many bytes-like objects at once and return the list of their hashes.
+
+    Everything is hashed before taking the lock, and the references are then
+    updated together, with a single write of the refs file.
+    """
+    keys = [hashlib.sha256(data).hexdigest() for data in buffers]
+    with file_lock(os.path.join(self.path, self.LOCK_FILE)):
+      refs = self.load_refs()
+      for key, data in zip(keys, buffers):
+        path = self.blob_path(key)
+        if key not in refs and not os.path.isfile(path):
+          os.makedirs(os.path.dirname(path), exist_ok=True)
+          write_atomic(path, data, mode='wb')
+        refs[key] = refs.get(key, 0) + 1
+      self.save_refs(refs)
+    return keys
+
+  def import_blob(self, key, file, chunk_size=2 ** 20):
+    """Store a blob of a known hash, read from a file object in chunks.
+
+    Does not add a reference (see "acquire"). The data is verified against the
+    hash, raising ValueError on a mismatch. Does nothing if the blob is already
+    stored (the file is not read then). Returns whether the blob was written.
+    """
+    path = self.blob_path(key)
+    if os.path.isfile(path):
+      return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    digest = hashlib.sha256()
+    try:
+      with open(temp_path, 'wb') as target:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+          digest.update(chunk)
+          target.write(chunk)
+      if digest.hexdigest() != key:
+        raise ValueError("Blob data does not match its hash {}!".format(key))
+      os.replace(temp_path, path)
+    finally:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+    return True
+
+  def discard(self, keys):
+    """Delete those of the given blobs that nothing refers to (e.g. imported but
+    never acquired)."""
+    with file_lock(os.path.join(self.path, self.LOCK_FILE)):
+      refs = self.load_refs()
+      for key in keys:
+        if key not in refs:
+          try:
+            os.remove(self.blob_path(key))
+          except FileNotFoundError:
+            pass
+
+  def acquire(self, keys):
+    """Add a reference to each of the given (already stored) blobs."""
+    with file_lock(os.path.join(self.path, self.LOCK_FILE)):
+      refs = self.load_refs()
+      for key in keys:
+        refs[key] = refs.get(key, 0) + 1
+      self.save_refs(refs)
+
+  def release(self, keys):
+    """Remove a reference from each of the given blobs, deleting unused ones."""
+    with file_lock(os.path.join(self.path, self.LOCK_FILE)):
+      refs = self.load_refs()
+      for key in keys:
+        count = refs.get(key, 0) - 1
+        if count > 0:
+          refs[key] = count
+          continue
+        refs.pop(key, None)
+        try:
+          os.remove(self.blob_path(key))
+        except FileNotFoundError:
+          pass
+      self.save_refs(refs)
+
+  def load_refs(self):
+    try:
+      with open(os.path.join(self.path, self.REFS_FILE), 'r') as file:
+        return json.load(file)
+    except FileNotFoundError:
+      return {}
+
+  def save_refs(self, refs):
+    write_atomic(os.path.join(self.path, self.REFS_FILE), json.dumps(refs))
+
+  def disk_usage(self):
+    """Total size of all the stored blobs, in bytes."""
+    total = 0
+    for root, _, files in os.walk(self.objects_path):
+      total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+MANIFEST_HEAD = b'{"format": "blobs"'
+
+def read_manifest(path):
+  """Return the contents of a blob manifest file, or None if it isn't one."""
+  with open(path, 'rb') as file:
+    if file.read(len(MANIFEST_HEAD)) != MANIFEST_HEAD:
+      return None
+    file.seek(0)
+    return json.load(file)
+
+def manifest_store(path, manifest):
+  """Return the BlobStore that the given manifest refers to."""
+  return BlobStore(os.path.join(os.path.dirname(path), manifest['store']))
+
+def release_manifest(path, manifest=None):
+  """Release all the blobs referenced by a manifest file, if it is one.
+
+  Should be called before deleting any model file, so that the blobs no longer
+  needed can be deleted as well. If the file has been overwritten already, pass
+  its previous "manifest" (as returned by read_manifest) to release that one.
+  """
+  if manifest is None:
+    if not os.path.isfile(path):
+      return
+    manifest = read_manifest(path)
+    if manifest is None:
+      return
+  keys = [entry['blob'] for entry in manifest['tensors'].values()]
+  manifest_store(path, manifest).release(keys)
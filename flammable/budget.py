@@ -0,0 +1,101 @@
+import time
+
+from .tuning import batch_length
+
+class Budget():
+  """Tracks the progress of training against limits on the compute spent.
+
+  Available limits:
+    * "max_time": wall time, in seconds since "start",
+    * "max_iterations": number of training iterations,
+    * "max_samples": number of training samples (the length of each batch).
+  Any of them can be None (unlimited).
+  """
+  def __init__(self, max_time=None, max_iterations=None, max_samples=None):
+    self.max_time = max_time
+    self.max_iterations = max_iterations
+    self.max_samples = max_samples
+    self.start()
+
+  def start(self):
+    self.start_time = time.perf_counter()
+    self.iterations = 0
+    self.samples = 0
+
+  def count(self, batch):
+    """Account for a single iteration over the given batch."""
+    self.iterations += 1
+    if self.max_samples is not None:
+      self.samples += batch_length(batch)
+
+  def elapsed(self):
+    return time.perf_counter() - self.start_time
+
+  def exceeded(self):
+    """Return the name of the limit that has been reached, or None."""
+    if self.max_time is not None and self.elapsed() >= self.max_time:
+      return 'max_time'
+    if self.max_iterations is not None and self.iterations >= self.max_iterations:
+      return 'max_iterations'
+    if self.max_samples is not None and self.samples >= self.max_samples:
+      return 'max_samples'
+    return None
+
+  def summary(self):
+    return {
+      'time': self.elapsed(),
+      'iterations': self.iterations,
+      'samples': self.samples if self.max_samples is not None else None,
+    }
+
+
+class EarlyStopping():
+  """Decides to stop training once a validation metric stops improving.
+
+  The metric is looked up by name in the Snapshot's val_data. A value counts as
+  an improvement if it is better than the best one so far by more than
+  "min_delta" (lower for mode "min", higher for "max"). Training should stop
+  after "patience" validations in a row without improvement.
+  """
+  def __init__(self, metric, patience=5, min_delta=0.0, mode='min'):
+    if mode not in ('min', 'max'):
+      raise ValueError("Mode must be either \"min\" or \"max\"!")
+    self.metric = metric
+    self.patience = patience
+    self.min_delta = min_delta
+    self.mode = mode
+    self.reset()
+
+  def reset(self):
+    self.seen = 0
+    self.best = None
+    self.best_index = None
+    self.wait = 0
+
+  def update(self, val_data):
+    """Take in new validation results, return whether to stop training."""
+    values = val_data.get(self.metric, [])
+    for index in range(self.seen, len(values)):
+      value = values[index]
+      if self.best is None:
+        improved = True
+      elif self.mode == 'min':
+        improved = value < self.best - self.min_delta
+      else:
+        improved = value > self.best + self.min_delta
+      if improved:
+        self.best = value
+        self.best_index = index
+        self.wait = 0
+      else:
+        self.wait += 1
+    self.seen = len(values)
+    return self.wait >= self.patience
+
+  def summary(self, val_data):
+    """Best value of the metric so far, and the epoch it was reached at."""
+    epochs = val_data.get('epoch_i', [])
+    best_epoch = None
+    if self.best_index is not None and self.best_index < len(epochs):
+      best_epoch = epochs[self.best_index]
+    return {'metric': self.metric, 'best': self.best, 'best_epoch_i': best_epoch}
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+
+import torch
+
+from .checkpoint import tensor_buffer
+from .locking import write_atomic
+
+class SampleCache():
+  """Wraps a data loader, recording its batches on the first pass to replay later.
+
+  The first time the cache is iterated over, batches come from the original
+  loader, but each of them is also appended to the cache folder: every field of
+  the batch (e.g. data and label) goes to a separate flat file. Once the pass
+  completes, the cache is sealed with a metadata file, and from then on every
+  iteration replays the samples from these files, memory-mapped, reshuffled and
+  re-batched - skipping all the file reading and decoding the loader would do.
+
+  This only works if batches are tensors or tuples/lists of tensors whose shapes
+  only differ in the first (batch) dimension. Otherwise the cache gives up and
+  keeps passing the original batches through. Note that any random augmentation
+  done by the loader will be "frozen" in the cached samples.
+
+  Replayed batches are as big as the loader's (also with a batch sampler), and
+  the last, smaller one is dropped if the loader drops it. With "drop_last" and
+  shuffling, samples the loader dropped on the first pass are never replayed.
+
+  An incomplete pass (e.g. interrupted) never leaves a cache behind. Multiple
+  processes can record into the same path at once - the first to complete wins.
+  A cache takes as much disk space as its samples do as tensors (uncompressed),
+  and it is never deleted automatically.
+  """
+  META_FILE = 'meta.json'
+
+  def __init__(self, loader, path, shuffle=None):
+    """Wrap a loader, caching under the given folder.
+
+    If "shuffle" is not given, replays are shuffled when the loader shuffles
+    (or when it cannot be told whether it does).
+    """
+    self.loader = loader
+    self.path = path
+    batch_sampler = getattr(loader, 'batch_sampler', None)
+    self.batch_size = getattr(loader, 'batch_size', None) or getattr(batch_sampler, 'batch_size', None)
+    self.drop_last = bool(getattr(loader, 'drop_last', False) or getattr(batch_sampler, 'drop_last', False))
+    if shuffle is None:
+      sampler = getattr(loader, 'sampler', None)
+      shuffle = sampler is None or isinstance(sampler, torch.utils.data.RandomSampler)
+    self.shuffle = shuffle
+    self.disabled = False
+
+  def is_complete(self):
+    return os.path.isfile(os.path.join(self.path, self.META_FILE))
+
+  def __iter__(self):
+    if self.is_complete():
+      return self.replay()
+    if self.disabled:
+      return iter(self.loader)
+    return self.record()
+
+  def __len__(self):
+    return len(self.loader)
+
+  def record(self):
+    """Pass the original batches through, appending them to the cache."""
+    temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+    os.makedirs(temp_path, exist_ok=True)
+    files = None
+    fields = None
+    count = 0
+    batch_size = self.batch_size
+    try:
+      for batch in self.loader:
+        if not self.disabled:
+          tensors = batch if isinstance(batch, (tuple, list)) else [batch]
+          if files is None:
+            fields = describe_fields(tensors)
+            batch_size = batch_size or len(tensors[0])
+            if fields is None:
+              self.disabled = True
+            else:
+              files = [
+                open(os.path.join(temp_path, 'field{}.bin'.format(i)), 'wb')
+                for i in range(len(fields))
+              ]
+          if files is not None and describe_fields(tensors) == fields:
+            for file, tensor in zip(files, tensors):
+              file.write(tensor_buffer(tensor.detach().cpu().contiguous()))
+            count += len(tensors[0])
+          else:
+            self.disabled = True
+        yield batch
+      if files is not None and not self.disabled:
+        for file in files:
+          file.close()
+        files = None
+        meta = {
+          'fields': fields,
+          'count': count,
+          'batch_size': batch_size,
+          'drop_last': self.drop_last,
+          'is_tuple': isinstance(batch, (tuple, list)),
+        }
+        write_atomic(os.path.join(temp_path, self.META_FILE), json.dumps(meta))
+        try:
+          os.rename(temp_path, self.path)
+        except OSError:
+          pass  # someone else has completed the cache first
+    finally:
+      if files is not None:
+        for file in files:
+          file.close()
+      shutil.rmtree(temp_path, ignore_errors=True)
+
+  def replay(self):
+    """Yield batches from the cache files, reshuffled if requested."""
+    with open(os.path.join(self.path, self.META_FILE), 'r') as file:
+      meta = json.load(file)
+    count = meta['count']
+    fields = []
+    for i, field in enumerate(meta['fields']):
+      dtype = getattr(torch, field['dtype'])
+      with open(os.path.join(self.path, 'field{}.bin'.format(i)), 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+      fields.append(torch.frombuffer(buffer, dtype=dtype).view([count] + field['shape']))
+    order = torch.randperm(count) if self.shuffle else torch.arange(count)
+    batch_size = meta['batch_size']
+    for start in range(0, count, batch_size):
+      indices = order[start:start + batch_size]
+      if meta.get('drop_last') and len(indices) < batch_size:
+        break
+      batch = [field[indices] for field in fields]
+      yield batch if meta['is_tuple'] else batch[0]
+
+
+def describe_fields(tensors):
+  """Return dtypes and per-sample shapes of batch fields, None if not cacheable."""
+  fields = []
+  for tensor in tensors:
+    if not isinstance(tensor, torch.Tensor) or tensor.dim() == 0 or tensor.numel() == 0:
+      return None
+    if len(tensor) != len(tensors[0]):
+      return None
+    fields.append({
+      'dtype': str(tensor.dtype).replace('torch.', ''),
+      'shape': list(tensor.shape[1:]),
+    })
+  return fields
+
+def fingerprint_loader(loader):
+  """Compute a cheap fingerprint of the data a loader is going to produce.
+
+  Accounts for the dataset type and length, the batch size, simple (numeric,
+  string) attributes of the dataset and - for each attribute that is a path (or
+  a list of paths) to an existing file or folder - the names, sizes and
+  modification times of all the files there. Wrapped datasets (e.g. Subset's
+  "dataset", ConcatDataset's "datasets") are fingerprinted recursively. File
+  contents are never read, so this stays cheap even for big datasets.
+
+  Returns None if no files have been found: the data cannot be told apart from
+  different data of the same shape then, so the fingerprint would be useless.
+  """
+  digest = hashlib.sha256()
+  digest.update(str(getattr(loader, 'batch_size', None)).encode())
+  found = fingerprint_dataset(getattr(loader, 'dataset', loader), digest)
+  return digest.hexdigest() if found else None
+
+def fingerprint_dataset(dataset, digest, depth=0):
+  """Update the digest with a dataset, return whether any files were found."""
+  digest.update(type(dataset).__qualname__.encode())
+  try:
+    digest.update(str(len(dataset)).encode())
+  except TypeError:
+    pass
+  found = False
+  for name, value in sorted(getattr(dataset, '__dict__', {}).items()):
+    if name == 'dataset' and depth < 8:
+      digest.update(name.encode())
+      found = fingerprint_dataset(value, digest, depth + 1) or found
+    elif name == 'datasets' and isinstance(value, (list, tuple)) and depth < 8:
+      digest.update(name.encode())
+      for item in value:
+        found = fingerprint_dataset(item, digest, depth + 1) or found
+    elif isinstance(value, (bool, int, float, type(None), range)):
+      digest.update('{}={!r}'.format(name, value).encode())
+    elif is_path(value) and os.path.exists(value):
+      digest.update(name.encode())
+      fingerprint_files(value, digest)
+      found = True
+    elif isinstance(value, str):
+      digest.update('{}={!r}'.format(name, value).encode())
+    elif isinstance(value, (list, tuple)) and value and all(is_path(item) for item in value):
+      digest.update(name.encode())
+      for item in value:
+        if os.path.exists(item):
+          fingerprint_files(item, digest)
+          found = True
+        else:
+          digest.update(repr(os.fspath(item)).encode())
+    elif isinstance(value, (list, tuple)) and all(isinstance(item, int) for item in value):
+      # e.g. indices of a Subset
+      digest.update('{}={!r}'.format(name, value).encode())
+  return found
+
+def is_path(value):
+  return isinstance(value, (str, os.PathLike))
+
+def fingerprint_files(path, digest):
+  """Update the digest with names, sizes and modification times of the files."""
+  path = os.fspath(path)
+  for root, dirs, files in os.walk(path) if os.path.isdir(path) else [('', [], [path])]:
+    dirs.sort()
+    for filename in sorted(files):
+      stat = os.stat(os.path.join(root, filename))
+      digest.update('{}:{}:{}'.format(filename, stat.st_size, stat.st_mtime_ns).encode())
+
+def fingerprint_file(path, chunk_size=2 ** 20):
+  """Compute the SHA-256 of a file's contents, reading it in chunks."""
+  digest = hashlib.sha256()
+  with open(path, 'rb') as file:
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
@@ -0,0 +1,326 @@
+import ctypes
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+import zlib
+
+import torch
+
+from .blobstore import manifest_store, read_manifest, release_manifest
+from .locking import atomic_file, write_atomic
+
+# Layout of the memory-mappable tensor file:
+#   MAGIC (8 bytes) | header length (8 bytes, little endian) | JSON header |
+#   padding | tensor data
+# The header maps each tensor name to its dtype, shape and the offset of its
+# data (counted from the beginning of the data area). Data of each tensor is
+# aligned to ALIGNMENT bytes.
+MAGIC = b'FLMTENS1'
+ALIGNMENT = 64
+FORMATS = ['torch', 'mmap', 'blobs']
+ENCODINGS = [None, 'fp16', 'bf16', 'int8']
+COMPRESSIONS = [None, 'zlib']
+
+def save_state(state_dict, path, fmt='torch', store=None, encoding=None, compression=None):
+  """Save a state dict under the given path, in the requested format.
+
+  Supported formats:
+    * "torch": the usual torch.save (pickle),
+    * "mmap": flat tensor file that can be memory-mapped on load, without any
+      unpickling or copying (see write_tensors),
+    * "blobs": manifest referring to deduplicated tensors in a BlobStore, which
+      has to be given as "store" (see write_manifest).
+  Reduced precision "encoding" and "compression" are only supported by "mmap".
+  """
+  if (encoding or compression) and fmt != 'mmap':
+    raise ValueError("Encoding and compression require the \"mmap\" format!")
+  if fmt == 'blobs':
+    if store is None:
+      raise RuntimeError("Saving in the \"blobs\" format requires a BlobStore!")
+    write_manifest(state_dict, path, store)
+    return
+  if fmt not in FORMATS:
+    raise KeyError("Unknown model file format: \"{}\"!".format(fmt))
+  # Overwriting a manifest in another format - its blobs are no longer needed
+  previous = read_manifest(path) if os.path.isfile(path) else None
+  if fmt == 'torch':
+    with atomic_file(path) as file:
+      torch.save(state_dict, file)
+  else:
+    write_tensors(state_dict, path, encoding, compression)
+  if previous is not None:
+    release_manifest(path, previous)
+
+def load_state(path, prefix=None):
+  """Load a state dict saved by save_state, detecting the format on its own.
+
+  If "prefix" is given, only the entries whose names start with it are loaded.
+  For the "mmap" and "blobs" formats this means the remaining tensors are never
+  even read.
+  """
+  if is_tensor_file(path):
+    return read_tensors(path, prefix)
+  manifest = read_manifest(path)
+  if manifest is not None:
+    return read_manifest_tensors(path, manifest, prefix)
+  state_dict = torch.load(path)
+  if prefix:
+    state_dict = {name: val for name, val in state_dict.items() if name.startswith(prefix)}
+  return state_dict
+
+def remap_state(state_dict, prefixes=None, patterns=None):
+  """Rename the entries of a state dict, e.g. to load it into another model.
+
+  "prefixes" maps old name prefixes to new ones (the first matching one is
+  replaced). "patterns" is a list of (regex, replacement) pairs, applied in turn
+  to every name with re.sub, after the prefixes.
+  """
+  remapped = {}
+  for name, value in state_dict.items():
+    for old, new in (prefixes or {}).items():
+      if name.startswith(old):
+        name = new + name[len(old):]
+        break
+    for pattern, replacement in patterns or []:
+      name = re.sub(pattern, replacement, name)
+    remapped[name] = value
+  return remapped
+
+def is_tensor_file(path):
+  """Check whether the given file is in the memory-mappable format."""
+  with open(path, 'rb') as file:
+    return file.read(len(MAGIC)) == MAGIC
+
+def write_tensors(state_dict, path, encoding=None, compression=None):
+  """Write tensors into a flat, memory-mappable file with a header index.
+
+  Floating point tensors can optionally be stored in a reduced precision (see
+  encode_tensor for the available "encoding"s), and the data of all tensors can
+  be compressed ("zlib" is the only supported "compression"). Such tensors are
+  stored as one or more "parts" (e.g. quantized values and their scales), each
+  part taking a separate region of the data area. Encoded or compressed tensors
+  can no longer be mapped, but are decoded back to their original dtype on load.
+  """
+  if compression not in COMPRESSIONS:
+    raise KeyError("Unknown compression: \"{}\"!".format(compression))
+  chunks = []
+  index = {}
+  offset = 0
+  for name, tensor in state_dict.items():
+    tensor = tensor.detach().cpu().contiguous()
+    entry = {
+      'dtype': str(tensor.dtype).replace('torch.', ''),
+      'shape': list(tensor.shape),
+    }
+    parts = encode_tensor(tensor, encoding)
+    if parts is None and compression is None:
+      # Plain tensor - store as is, to allow mapping it directly
+      entry['offset'] = offset
+      data = tensor_buffer(tensor)
+      chunks.append((data, tensor))
+      offset = align(offset + len(data))
+    else:
+      if parts is None:
+        parts = {'data': tensor}
+      else:
+        entry['encoding'] = encoding
+      entry['parts'] = {}
+      for key, part in parts.items():
+        part = part.contiguous()
+        data = tensor_buffer(part)
+        if compression == 'zlib':
+          data = zlib.compress(data, 1)
+        entry['parts'][key] = {
+          'dtype': str(part.dtype).replace('torch.', ''),
+          'shape': list(part.shape),
+          'offset': offset,
+          'nbytes': len(data),
+          'compression': compression,
+        }
+        chunks.append((data, part))
+        offset = align(offset + len(data))
+    index[name] = entry
+  header = json.dumps(index).encode()
+  data_start = align(len(MAGIC) + 8 + len(header))
+  # Never rewrite the file in place - it might be mapped by a reader
+  with atomic_file(path) as file:
+    file.write(MAGIC)
+    file.write(struct.pack('<Q', len(header)))
+    file.write(header)
+    file.write(b'\0' * (data_start - file.tell()))
+    # Tensors go along with the buffers, to keep the memory alive until written
+    for data, _ in chunks:
+      file.write(data)
+      file.write(b'\0' * (align(file.tell()) - file.tell()))
+
+def read_tensors(path, prefix=None):
+  """Map tensors from a file written by write_tensors.
+
+  Returned plain tensors are backed directly by the (copy-on-write) memory map,
+  so nothing is read from the disk until the data is actually accessed. Encoded
+  or compressed ones are decoded to their original dtype right away.
+  """
+  with open(path, 'rb') as file:
+    file.seek(len(MAGIC))
+    length, = struct.unpack('<Q', file.read(8))
+    index = json.loads(file.read(length))
+    data_start = align(len(MAGIC) + 8 + length)
+    buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+  state_dict = {}
+  for name, entry in index.items():
+    if prefix and not name.startswith(prefix):
+      continue
+    if 'parts' in entry:
+      parts = {
+        key: read_region(buffer, data_start, region)
+        for key, region in entry['parts'].items()
+      }
+      state_dict[name] = decode_tensor(parts, entry)
+    else:
+      region = dict(entry, nbytes=None, compression=None)
+      state_dict[name] = read_region(buffer, data_start, region)
+  return state_dict
+
+def read_region(buffer, data_start, region):
+  """Create a tensor from a region of the data area described in the header."""
+  dtype = getattr(torch, region['dtype'])
+  numel = 1
+  for dim in region['shape']:
+    numel *= dim
+  if numel == 0:
+    return torch.empty(region['shape'], dtype=dtype)
+  offset = data_start + region['offset']
+  if region['compression'] == 'zlib':
+    data = bytearray(zlib.decompress(buffer[offset:offset + region['nbytes']]))
+    tensor = torch.frombuffer(data, dtype=dtype)
+  else:
+    tensor = torch.frombuffer(buffer, dtype=dtype, count=numel, offset=offset)
+  return tensor.view(region['shape'])
+
+def encode_tensor(tensor, encoding):
+  """Convert a tensor into a dict of parts in a given reduced precision.
+
+  Supported encodings:
+    * "fp16" and "bf16": simple casts to half precision types,
+    * "int8": symmetric 8-bit quantization with a separate scale for each
+      channel (slice along the first dimension) - parts are the quantized
+      values ("data") and the float32 scales ("scale").
+  Returns None for no encoding, and for tensors that are not floating point or
+  have no elements (these are always stored as they are).
+  """
+  if encoding is None or not tensor.is_floating_point() or tensor.numel() == 0:
+    return None
+  if encoding == 'fp16':
+    return {'data': tensor.to(torch.float16)}
+  if encoding == 'bf16':
+    return {'data': tensor.to(torch.bfloat16)}
+  if encoding == 'int8':
+    values = tensor.to(torch.float32)
+    if values.dim() > 1:
+      absmax = values.abs().amax(dim=tuple(range(1, values.dim())), keepdim=True)
+    else:
+      absmax = values.abs().max().reshape([1] * values.dim())
+    scale = (absmax / 127).clamp(min=torch.finfo(torch.float32).tiny)
+    data = torch.round(values / scale).clamp(-127, 127).to(torch.int8)
+    return {'data': data, 'scale': scale}
+  raise KeyError("Unknown encoding: \"{}\"!".format(encoding))
+
+def decode_tensor(parts, entry):
+  """Restore a tensor of the original dtype from its encoded parts."""
+  data = parts['data']
+  if entry.get('encoding') == 'int8':
+    data = data.to(torch.float32) * parts['scale']
+  return data.to(getattr(torch, entry['dtype'])).view(entry['shape'])
+
+def benchmark_encodings(state_dict, encodings=ENCODINGS, compressions=COMPRESSIONS):
+  """Measure size and speed of saving and loading a state dict in each encoding.
+
+  Every combination of the given encodings and compressions is saved to and
+  loaded from a temporary file (in the "mmap" format). Loading includes making
+  a copy of every tensor, as loading it into a model would. Returns a dict of
+  results for each combination (named e.g. "int8+zlib"): file size in bytes,
+  save and load times in seconds, throughput in MB of the original tensors per
+  second, and the largest absolute error introduced by the encoding.
+  """
+  raw_bytes = sum(t.numel() * t.element_size() for t in state_dict.values())
+  results = {}
+  with tempfile.TemporaryDirectory() as temp_dir:
+    for encoding in encodings:
+      for compression in compressions:
+        name = '+'.join(str(item) for item in (encoding, compression) if item) or 'raw'
+        path = os.path.join(temp_dir, name)
+        start = time.perf_counter()
+        write_tensors(state_dict, path, encoding, compression)
+        save_time = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = {key: val.clone() for key, val in read_tensors(path).items()}
+        load_time = time.perf_counter() - start
+        error = 0.0
+        for key, val in state_dict.items():
+          if val.is_floating_point() and val.numel():
+            diff = (loaded[key].float() - val.detach().cpu().float()).abs().max()
+            error = max(error, diff.item())
+        results[name] = {
+          'size': os.path.getsize(path),
+          'save_time': save_time,
+          'load_time': load_time,
+          'save_throughput': raw_bytes / 1e6 / save_time if save_time else None,
+          'load_throughput': raw_bytes / 1e6 / load_time if load_time else None,
+          'max_error': error,
+        }
+  return results
+
+def write_manifest(state_dict, path, store):
+  """Put each tensor in a BlobStore and write a manifest of them to the path.
+
+  The manifest is JSON that maps each tensor name to its dtype, shape and the
+  hash of its blob; it also holds the path to the store relative to itself, so
+  the manifest can be read knowing only its own path. If the file already held
+  a manifest, blobs referenced by it are released (after acquiring the new
+  ones, so that blobs shared by both versions are never deleted in between).
+  """
+  tensors = {name: tensor.detach().cpu().contiguous() for name, tensor in state_dict.items()}
+  keys = store.put_many([tensor_buffer(tensor) for tensor in tensors.values()])
+  index = {}
+  for (name, tensor), key in zip(tensors.items(), keys):
+    index[name] = {
+      'dtype': str(tensor.dtype).replace('torch.', ''),
+      'shape': list(tensor.shape),
+      'blob': key,
+    }
+  manifest = {
+    'format': 'blobs',
+    'store': os.path.relpath(store.path, os.path.dirname(os.path.abspath(path))),
+    'tensors': index,
+  }
+  release_manifest(path)
+  write_atomic(path, json.dumps(manifest))
+
+def read_manifest_tensors(path, manifest, prefix=None):
+  """Map tensors listed in a manifest from their blobs in the store."""
+  store = manifest_store(path, manifest)
+  state_dict = {}
+  for name, entry in manifest['tensors'].items():
+    if prefix and not name.startswith(prefix):
+      continue
+    dtype = getattr(torch, entry['dtype'])
+    with open(store.blob_path(entry['blob']), 'rb') as file:
+      if os.fstat(file.fileno()).st_size == 0:
+        state_dict[name] = torch.empty(entry['shape'], dtype=dtype)
+        continue
+      buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    state_dict[name] = torch.frombuffer(buffer, dtype=dtype).view(entry['shape'])
+  return state_dict
+
+def tensor_buffer(tensor):
+  """Expose the memory of a contiguous CPU tensor as a (zero-copy) buffer."""
+  nbytes = tensor.numel() * tensor.element_size()
+  return (ctypes.c_char * nbytes).from_address(tensor.data_ptr())
+
+def align(offset):
+  """Round the offset up to the nearest multiple of ALIGNMENT."""
+  return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -0,0 +1,64 @@
+import copy
+
+import torch
+import torch.func
+
+REDUCTIONS = ('mean', 'vote', 'all')
+
+class EnsembleModule(torch.nn.Module):
+  """Runs several models of the same architecture as one, vectorized.
+
+  Parameters and buffers of all the member models are stacked along a new, first
+  dimension, and a single forward pass is vectorized over it (torch.func.vmap),
+  instead of running each model in turn. Outputs are combined according to the
+  "reduction":
+    * "mean": average of the outputs,
+    * "vote": the most common class (argmax over the last dimension) chosen by
+      the members,
+    * "all": outputs of all the members, stacked along the second dimension
+      (that is, batch-first).
+  The ensemble is meant for inference only.
+  """
+  def __init__(self, models, reduction='mean'):
+    super(EnsembleModule, self).__init__()
+    if reduction not in REDUCTIONS:
+      raise ValueError("Unknown reduction \"{}\", must be one of: {}.".format(reduction, REDUCTIONS))
+    if not models:
+      raise ValueError("An ensemble needs at least one model!")
+    shapes = [
+      {name: tensor.shape for name, tensor in model.state_dict().items()}
+      for model in models
+    ]
+    if any(shape != shapes[0] for shape in shapes[1:]):
+      raise ValueError("All models of an ensemble must share the same architecture!")
+    self.reduction = reduction
+    self.size = len(models)
+    params, buffers = torch.func.stack_module_state(models)
+    self.params = torch.nn.ParameterDict({
+      name.replace('.', ':'): torch.nn.Parameter(value, requires_grad=False)
+      for name, value in params.items()
+    })
+    for name, value in buffers.items():
+      self.register_buffer('buffer:' + name.replace('.', ':'), value)
+    self.buffer_names = list(buffers.keys())
+    # Stateless copy of the architecture, only used to call functionally
+    self.base = [copy.deepcopy(models[0]).to('meta').eval()]
+
+  def stacked_state(self):
+    params = {name.replace(':', '.'): value for name, value in self.params.items()}
+    buffers = {
+      name: getattr(self, 'buffer:' + name.replace('.', ':'))
+      for name in self.buffer_names
+    }
+    return params, buffers
+
+  def forward(self, data):
+    params, buffers = self.stacked_state()
+    def call(params, buffers, data):
+      return torch.func.functional_call(self.base[0], (params, buffers), (data,))
+    outputs = torch.func.vmap(call, in_dims=(0, 0, None))(params, buffers, data)
+    if self.reduction == 'mean':
+      return outputs.mean(dim=0)
+    if self.reduction == 'vote':
+      return outputs.argmax(dim=-1).mode(dim=0).values
+    return outputs.movedim(0, 1)
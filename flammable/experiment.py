@@ -7,6 +7,8 @@ import time
 
 import git
 
+from .archive import pack_snapshot, unpack_snapshot
+from .retention import RetentionPolicy
 from .snapshot import Snapshot
 
 class Experiment():
@@ -19,6 +21,9 @@ class Experiment():
         20190926-123819-ebyjb/
         20190926-124033-xvznd/
         ...
+      blobs/      # deduplicated model data shared by the snapshots (optional)
+      cache/      # training data recorded for replay (optional)
+      retention.json  # default retention policy for model files (optional)
 
   This object controls the global repository of the experiment, as well as the
   snapshot storage in the form of individual folders. It does not manage data
@@ -26,6 +31,11 @@ class Experiment():
   Additionally, if given a path to the local repository, it can handle commits
   and pushes between local and global repositories. This allows creating Snap-
   shots.
+
+  Snapshots can also be moved between Experiments (e.g. on different machines)
+  by packing them into archives, together with their code ("pack", "unpack").
+  Commits of unpacked Snapshots are kept in the global repository under refs/
+  snapshots/<uid>.
   """
 
   GIT_EXCLUDE = ['.git', '__pycache__']
@@ -51,6 +61,7 @@ class Experiment():
     self.repo_path = os.path.join(path, 'repo')
     self.repo = git.Repo(self.repo_path)
     self.global_repo = self.repo
+    self.path = path
     self.snap_path = os.path.join(path, 'snapshots')
     self.local_path = None
     self.local_file = None
@@ -94,6 +105,47 @@ class Experiment():
     name = self.snapshot_names[-1]
     return self.get_snapshot(name)
 
+  def lineage(self, name_or_id):
+    """Return the chain of Snapshots the given one was warm-started from.
+
+    Starts with the given Snapshot, then the one it was initialized from, then
+    that one's source etc. (see PytorchTask.warm_start_from). The chain ends at
+    a Snapshot trained from scratch, or one that is no longer available.
+    """
+    chain = []
+    snapshot = self.get_snapshot(name_or_id)
+    while snapshot is not None and snapshot.uid not in [s.uid for s in chain]:
+      chain.append(snapshot)
+      source = snapshot.custom_data.get('warm_start')
+      snapshot = self.get_snapshot(source['uid']) if source else None
+    return chain
+
+  def pack(self, name_or_id, path, compression=None):
+    """Write a Snapshot, along with its code, to a single portable archive.
+
+    See archive.pack_snapshot for the contents and the "compression" options.
+    Returns the description of the archive contents.
+    """
+    snapshot = self.get_snapshot(name_or_id)
+    if snapshot is None:
+      raise KeyError(name_or_id)
+    return pack_snapshot(self, snapshot, path, compression)
+
+  def unpack(self, path):
+    """Restore a Snapshot from an archive made by "pack" (by any Experiment).
+
+    The Snapshot can then be imported like any other. Returns the Snapshot.
+    """
+    return unpack_snapshot(self, path)
+
+  def get_retention(self):
+    """Return the default RetentionPolicy of the experiment, or None."""
+    return RetentionPolicy.load(self.path)
+
+  def set_retention(self, policy:RetentionPolicy):
+    """Set the default RetentionPolicy for all the snapshots' model files."""
+    policy.save(self.path)
+
   def import_snapshot(self, snapshot:Snapshot):
     """Retrieve the Task that was executed at the given snapshot.
 
@@ -110,8 +162,11 @@ class Experiment():
     backup_path = sys.path
     sys.path = [self.repo_path]
     module_name, _ = os.path.splitext(snapshot.filename)
-    # the imported module triggers the other end of the mechanism
+    # the imported module triggers the other end of the mechanism - but only if
+    # it actually executes, so forget any version imported previously
+    sys.modules.pop(module_name, None)
     importlib.import_module(module_name)
+    sys.modules.pop(module_name, None)
     # return to the original master head
     self.repo.head.reference = self.repo.heads[0]
     self.repo.head.reset(index=True, working_tree=True)
@@ -205,6 +260,9 @@ class Experiment():
       # pull from the global side
       remote = self.global_repo.remotes[0]
       remote.pull('master')
+      # changes are committed now, further snapshots refer to the same commit
+      self.changed_files = []
+      self.removed_files = []
 
     # Create the snapshot
     # generate a unique ID for the snapshot
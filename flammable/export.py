@@ -0,0 +1,37 @@
+import copy
+
+import torch
+
+# Module types that dynamic quantization can replace with int8 counterparts
+QUANTIZABLE = {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU, torch.nn.LSTMCell, torch.nn.GRUCell}
+
+def export_model(model, quantize=True, example=None):
+  """Build an optimized CPU inference version of a model.
+
+  Works on a copy, leaving the original model intact. With "quantize", weights
+  of the supported layers (see QUANTIZABLE) are converted to int8, and their
+  activations are quantized dynamically at runtime. Given an "example" input,
+  the model is also traced into a TorchScript graph, which removes the Python
+  overhead of running it.
+  """
+  exported = copy.deepcopy(model).cpu().eval()
+  if quantize:
+    exported = torch.ao.quantization.quantize_dynamic(exported, QUANTIZABLE, dtype=torch.qint8)
+  if example is not None:
+    with torch.no_grad():
+      exported = torch.jit.trace(exported, example.cpu())
+  return exported
+
+def save_exported(model, path):
+  """Save a model produced by export_model."""
+  if isinstance(model, torch.jit.ScriptModule):
+    torch.jit.save(model, path)
+  else:
+    torch.save(model, path)
+
+def load_exported(path, traced):
+  """Load a model saved by save_exported."""
+  if traced:
+    return torch.jit.load(path, map_location='cpu')
+  # A pickled module, not just a state dict
+  return torch.load(path, map_location='cpu', weights_only=False)
@@ -0,0 +1,172 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import time
+
+from .snapshot import Snapshot
+
+class SnapshotFollower():
+  """Incrementally follows metric updates of a (possibly running) Snapshot.
+
+  Instead of repeatedly loading and parsing the whole data file, the follower
+  tails the Snapshot's journal: every poll reads only the bytes appended since
+  the previous one and decodes them into individual updates. Each update is a
+  4-tuple (section, mode, name, value), e.g. ("train_data", "append", "loss",
+  0.25), where mode is one of "append", "store" or "clear" (the last one comes
+  with name and value set to None).
+
+  Two interfaces are available:
+    * "poll" returns the updates available right now, without blocking - use it
+      to watch many runs at once (e.g. from a dashboard loop),
+    * "follow" is a generator that blocks waiting for new updates, using inotify
+      where available (Linux) and falling back to periodic polling elsewhere.
+
+  If the journal is recreated - because the Snapshot has been reset, or the
+  journal compacted (see Snapshot.compact_journal) - the follower notices its
+  new generation and starts over from its beginning. A compacted journal clears
+  each section and stores all of its entries, so applying the updates in order
+  still gives the current state. By default the follower starts from the
+  beginning, replaying the history first; pass "from_start=False" to only
+  receive the new updates.
+  """
+
+  def __init__(self, snapshot, from_start=True, sections=None):
+    """Pass a Snapshot instance or a path to its folder.
+
+    "sections" can restrict the updates to the given section names (e.g. only
+    ["train_data", "val_data"]).
+    """
+    root_path = snapshot.root_path if isinstance(snapshot, Snapshot) else snapshot
+    self.root_path = root_path
+    self.path = os.path.join(root_path, Snapshot._journal_file)
+    self.sections = sections
+    self.offset = 0
+    self.pending = b''
+    self.generation = None
+    if not from_start and os.path.isfile(self.path):
+      with open(self.path, 'rb') as file:
+        self.generation = read_generation(file)
+        self.offset = os.fstat(file.fileno()).st_size
+
+  def poll(self):
+    """Return a list of all updates that arrived since the last poll."""
+    try:
+      file = open(self.path, 'rb')
+    except FileNotFoundError:
+      # Journal has been removed - start from scratch once it is back
+      self.offset = 0
+      self.pending = b''
+      self.generation = None
+      return []
+    with file:
+      # Stat and read the same file, even if it is being replaced meanwhile
+      size = os.fstat(file.fileno()).st_size
+      generation = read_generation(file)
+      if size < self.offset or generation != self.generation:
+        # Journal has been recreated - start from scratch
+        self.offset = 0
+        self.pending = b''
+        self.generation = generation
+      if size == self.offset:
+        return []
+      file.seek(self.offset)
+      chunk = file.read(size - self.offset)
+    self.offset += len(chunk)
+    # The last line might still be in the middle of being written
+    lines = (self.pending + chunk).split(b'\n')
+    self.pending = lines.pop()
+    updates = []
+    for line in lines:
+      if not line:
+        continue
+      record = json.loads(line)
+      if 'section' not in record:
+        continue  # the generation header
+      section = record['section']
+      if self.sections is not None and section not in self.sections:
+        continue
+      for mode, name, value in record['ops']:
+        updates.append((section, mode, name, value))
+    return updates
+
+  def follow(self, timeout=None, poll_interval=1.0):
+    """Yield updates as they come, blocking in between.
+
+    Stops after "timeout" seconds without any new updates, or never if None.
+    "poll_interval" is only used when inotify is not available.
+    """
+    watcher = _InotifyWatcher.create(self.root_path)
+    try:
+      last_update = time.monotonic()
+      while True:
+        updates = self.poll()
+        if updates:
+          last_update = time.monotonic()
+          yield from updates
+          continue
+        if timeout is None:
+          wait = poll_interval
+        else:
+          wait = timeout - (time.monotonic() - last_update)
+          if wait <= 0:
+            return
+          wait = min(wait, poll_interval)
+        if watcher:
+          watcher.wait(wait)
+        else:
+          time.sleep(wait)
+    finally:
+      if watcher:
+        watcher.close()
+
+
+def read_generation(file):
+  """Return the generation ID from the header of an open journal, or None."""
+  file.seek(0)
+  head = file.read(128)
+  if not head.startswith(b'{"generation": ') or b'\n' not in head:
+    return None
+  return json.loads(head.split(b'\n', 1)[0])['generation']
+
+
+class _InotifyWatcher():
+  """Minimal ctypes binding to Linux inotify, watching a single directory."""
+  IN_MODIFY = 0x00000002
+  IN_CREATE = 0x00000100
+  IN_DELETE = 0x00000200
+  IN_MOVED_TO = 0x00000080
+
+  @classmethod
+  def create(cls, path):
+    """Return a watcher on the given directory, or None if unavailable."""
+    try:
+      libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+      fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+      return None
+    if fd < 0:
+      return None
+    mask = cls.IN_MODIFY | cls.IN_CREATE | cls.IN_DELETE | cls.IN_MOVED_TO
+    if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+      os.close(fd)
+      return None
+    return cls(fd)
+
+  def __init__(self, fd):
+    self.fd = fd
+
+  def wait(self, timeout):
+    """Block until something happens in the directory, or timeout passes."""
+    readable, _, _ = select.select([self.fd], [], [], timeout)
+    if readable:
+      # Drain the events - we do not care what they were exactly
+      try:
+        while os.read(self.fd, 4096):
+          pass
+      except BlockingIOError:
+        pass
+
+  def close(self):
+    os.close(self.fd)
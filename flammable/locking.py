@@ -0,0 +1,42 @@
+import contextlib
+import fcntl
+import os
+import threading
+
+@contextlib.contextmanager
+def file_lock(path):
+  """Hold an exclusive, inter-process lock on the given file while in context.
+
+  The file is created if it does not exist. The lock is advisory (flock), i.e.
+  it only works between processes that all use this function.
+  """
+  with open(path, 'a') as file:
+    fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+@contextlib.contextmanager
+def atomic_file(path, mode='wb'):
+  """Open a file for writing so that readers never see it half-written.
+
+  Data goes to a temporary file in the same folder, which replaces the target
+  once the context exits (or is removed, if it exits with an exception). Its
+  name is unique to the process and thread, so concurrent writers never share
+  it. Replacing, instead of rewriting in place, also keeps intact any memory
+  maps of the previous version of the file.
+  """
+  temp_path = '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+  try:
+    with open(temp_path, mode) as file:
+      yield file
+    os.replace(temp_path, path)
+  finally:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+
+def write_atomic(path, data, mode='w'):
+  """Write data to a file at once, atomically (see atomic_file)."""
+  with atomic_file(path, mode) as file:
+    file.write(data)
@@ -1,3 +1,5 @@
+import time
+
 class Logger():
   """Store sequentially incoming data with (almost) no layout assumptions.
 
@@ -17,6 +19,7 @@ class Logger():
 
   def __init__(self, mode='average'):
     self.values = {}
+    self.flushed = {}  # how many values of each name went out with store_progress
     self.has_post_fun = (mode != 'all')
     if mode in self.post_funs.keys():
       self.postprocess = self.post_funs[mode]
@@ -45,6 +48,40 @@ class Logger():
         for key, val in custom.items():
           transaction.append(key, val)
 
+  def store_progress(self, snapshot, epoch_i, iter_i, **custom):
+    """Postprocess values logged since the last call, dump into iter_data.
+
+    Meant for flushing metrics in the middle of a long epoch. Only the values
+    that came in since the previous flush are aggregated, so each entry covers
+    a window of iterations ending at "iter_i". Entries from previous epochs are
+    dropped (store_train has summarized them already), which keeps the size of
+    iter_data bounded by the number of flushes in a single epoch.
+
+    All the lists in iter_data are kept aligned with "iter_i": a name without
+    any new values since the previous flush gets a None entry instead, and so
+    do the earlier flushes of a name that shows up for the first time.
+    """
+    with snapshot.iter_storage() as transaction:
+      if transaction.data.get('epoch_i', [epoch_i])[-1] != epoch_i:
+        transaction.clear()
+      flushes = len(transaction.data.get('epoch_i', []))
+      def append(key, value):
+        for _ in range(flushes - len(transaction.data.get(key, []))):
+          transaction.append(key, None)
+        transaction.append(key, value)
+      for key, val in self.values.items():
+        start = self.flushed.get(key, 0)
+        if len(val) > start:
+          append(key, self.postprocess(val[start:]))
+          self.flushed[key] = len(val)
+        else:
+          append(key, None)
+      append('epoch_i', epoch_i)
+      append('iter_i', iter_i)
+      if custom:
+        for key, val in custom.items():
+          append(key, val)
+
   def store_test(self, snapshot, store_raw=True, **custom):
     """Postprocess and dump current values into a given Snapshot's test_data.
 
@@ -56,13 +93,17 @@ class Logger():
     not apply any postprocessing to them, regardless of "store_raw" setting.
     """
     with snapshot.test_storage() as transaction:
-      for key, val in self.values.items():
-        transaction.store(key, self.postprocess(val))
-        if self.has_post_fun and store_raw:
-          transaction.store(key + "_data", val)
-      if custom:
-        for key, val in custom.items():
-          transaction.store(key, val)
+      self.write_test(transaction, store_raw, **custom)
+
+  def write_test(self, transaction, store_raw=True, **custom):
+    """Same as "store_test", but within an already open test_data transaction."""
+    for key, val in self.values.items():
+      transaction.store(key, self.postprocess(val))
+      if self.has_post_fun and store_raw:
+        transaction.store(key + "_data", val)
+    if custom:
+      for key, val in custom.items():
+        transaction.store(key, val)
 
   def return_final(self):
     """Simply postprocess all the value lists and return them without storing."""
@@ -70,3 +111,35 @@ class Logger():
       key: self.postprocess(val) for key, val in self.values.items()
     }
     return results
+
+
+class Throttle():
+  """Rate limiter deciding whether some periodic action (e.g. a flush) is due.
+
+  The action is due every "every_n" calls to "ready" or every "every_t" seconds
+  since it was last due, whichever comes first. Either can be None to disable
+  that condition; with both None the action is never due. Calling "ready" is
+  cheap enough to do on every iteration.
+  """
+  def __init__(self, every_n=None, every_t=None):
+    self.every_n = every_n
+    self.every_t = every_t
+    self.count = 0
+    self.last_time = time.monotonic()
+
+  def ready(self):
+    """Count a call and return True if the action should be performed now."""
+    if self.every_n is None and self.every_t is None:
+      return False
+    self.count += 1
+    if self.every_n is not None and self.count >= self.every_n:
+      return self.reset()
+    if self.every_t is not None and time.monotonic() - self.last_time >= self.every_t:
+      return self.reset()
+    return False
+
+  def reset(self):
+    """Start counting anew, as if the action had just been performed."""
+    self.count = 0
+    self.last_time = time.monotonic()
+    return True
@@ -0,0 +1,149 @@
+import collections
+import concurrent.futures
+import glob
+import os
+import queue
+import threading
+import time
+
+def bounded_map(function, iterable, workers, depth=None):
+  """Map function over iterable on a thread pool, yielding results in order.
+
+  At most "depth" (by default: twice the number of workers) calls are in flight
+  at any time, so the input is only consumed as fast as the output is. This is
+  what keeps the memory bounded when chaining several such stages: each of them
+  acts as a bounded queue between the previous stage and the next.
+  """
+  if depth is None:
+    depth = 2 * workers
+  with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+    pending = collections.deque()
+    for item in iterable:
+      pending.append(pool.submit(function, item))
+      if len(pending) >= depth:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+
+def batched(iterable, size, timeout=None):
+  """Group items from the iterable into lists of at most "size" elements.
+
+  Without a "timeout", a batch is only yielded once it is full, or once the
+  iterable ends. Otherwise the iterable is read on a background thread (at most
+  "size" items ahead), and a batch is also yielded incomplete once "timeout"
+  seconds have passed since its first item arrived - with 0, as soon as no more
+  items are ready. Then a slow input never holds back the items already read.
+  """
+  if timeout is not None:
+    yield from timed_batches(iterable, size, timeout)
+    return
+  batch = []
+  for item in iterable:
+    batch.append(item)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+def timed_batches(iterable, size, timeout):
+  """Implementation of "batched" with a timeout (see there)."""
+  items = queue.Queue(size)
+  stop = threading.Event()
+  end = object()
+  def put(entry):
+    # Give up once the batches are no longer wanted
+    while not stop.is_set():
+      try:
+        items.put(entry, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+  def read():
+    try:
+      for item in iterable:
+        if not put((item, None)):
+          return
+      put((end, None))
+    except BaseException as error:
+      put((end, error))
+  threading.Thread(target=read, daemon=True).start()
+  try:
+    finished = False
+    while not finished:
+      item, error = items.get()
+      batch = []
+      deadline = time.monotonic() + timeout
+      while item is not end:
+        batch.append(item)
+        if len(batch) == size:
+          break
+        try:
+          item, error = items.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+          break
+      finished = item is end
+      if batch:
+        yield batch
+    if error is not None:
+      raise error
+  finally:
+    stop.set()
+
+def find_inputs(spec, output_dir):
+  """Resolve an input specification into a list of (input, output) path pairs.
+
+  "spec" can be:
+    * a directory: every file inside it is an input,
+    * a manifest file: each line holds an input path, optionally followed by a
+      tab and an output path; empty lines and lines starting with # are skipped,
+      relative inputs are resolved against the manifest's folder,
+    * a glob pattern.
+  Unless given explicitly in the manifest, each output is named the same as its
+  input, but placed in "output_dir". Relative outputs from the manifest are also
+  placed there. Outputs of a glob keep their paths relative to the folder where
+  the pattern starts (e.g. "data/*/x.pt" gives "a/x.pt", "b/x.pt"). Raises
+  RuntimeError if two inputs would be written to the same output.
+  """
+  pairs = []
+  if os.path.isdir(spec):
+    for item in sorted(os.scandir(spec), key=lambda item: item.name):
+      if item.is_file():
+        pairs.append((item.path, os.path.join(output_dir, item.name)))
+  elif os.path.isfile(spec):
+    base_dir, _ = os.path.split(os.path.abspath(spec))
+    with open(spec, 'r') as manifest:
+      for line in manifest:
+        line = line.strip()
+        if not line or line.startswith('#'):
+          continue
+        input_path, _, output_path = line.partition('\t')
+        input_path = os.path.join(base_dir, input_path)
+        if not output_path:
+          _, output_path = os.path.split(input_path)
+        pairs.append((input_path, os.path.join(output_dir, output_path)))
+  else:
+    base_dir = glob_base(spec)
+    for input_path in sorted(glob.glob(spec)):
+      if os.path.isfile(input_path):
+        name = os.path.relpath(input_path, base_dir)
+        pairs.append((input_path, os.path.join(output_dir, name)))
+  inputs = {}
+  for input_path, output_path in pairs:
+    output_path = os.path.normpath(output_path)
+    if output_path in inputs:
+      raise RuntimeError("Inputs {} and {} would both be written to {}!".format(
+        inputs[output_path], input_path, output_path
+      ))
+    inputs[output_path] = input_path
+  return pairs
+
+def glob_base(pattern):
+  """Return the folder of a glob pattern up to its first wildcard component."""
+  parts = []
+  for part in os.path.dirname(pattern).split(os.sep):
+    if any(char in part for char in '*?['):
+      break
+    parts.append(part)
+  return os.sep.join(parts) or os.curdir
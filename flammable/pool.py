@@ -0,0 +1,194 @@
+import collections
+import math
+import os
+import threading
+
+import torch
+
+from .blobstore import read_manifest
+from .server import InferenceServer
+
+class ModelPool():
+  """Keeps Tasks of many Snapshots of one Experiment imported and ready to use.
+
+  Importing a Snapshot (Experiment.import_snapshot) and loading its weights is
+  slow, so the pool does it once per Snapshot and keeps the resulting Task
+  resident. When "memory_budget" (in bytes of model parameters and buffers) is
+  set and a new model would not fit, the least recently used ones are evicted -
+  before it is loaded (judging by the size of its model file), so that the
+  budget is not exceeded even temporarily.
+
+  Snapshots are referred to by their names or IDs, just like in the Experiment.
+  Evaluation requests can be routed by these directly ("eval", "eval_batch"),
+  or via an inference server ("server"), under /eval/<name or ID>. Requests for
+  resident models are never blocked by a model being loaded in the meantime.
+  """
+  def __init__(self, experiment, memory_budget=None):
+    self.experiment = experiment
+    self.memory_budget = memory_budget
+    self.tasks = collections.OrderedDict()  # uid -> Task, least recent first
+    self.sizes = {}                         # uid -> model size in bytes
+    self.uids = {}                          # name or ID -> uid
+    self.load_locks = {}                    # uid -> [lock held while loading, users]
+    # Guards the above - only ever held for a moment
+    self.lock = threading.Lock()
+    # Importing alters the global repository and sys.path - one at a time only
+    self.import_lock = threading.Lock()
+
+  def resolve(self, name_or_id):
+    """Return the Snapshot of the given name or ID, raise KeyError if none."""
+    snapshot = self.experiment.get_snapshot(name_or_id)
+    if snapshot is None:
+      raise KeyError(name_or_id)
+    with self.lock:
+      self.uids[name_or_id] = snapshot.uid
+    return snapshot
+
+  def resolve_uid(self, name_or_id):
+    """Return the ID of the Snapshot of the given name or ID, raise KeyError if none.
+
+    Unlike "resolve", does not read the Snapshot, once it has been seen.
+    """
+    with self.lock:
+      uid = self.uids.get(name_or_id)
+    if uid is None:
+      uid = self.resolve(name_or_id).uid
+    return uid
+
+  def get(self, name_or_id):
+    """Return a Task of the given Snapshot, importing it if not resident."""
+    uid = self.resolve_uid(name_or_id)
+    with self.lock:
+      if uid in self.tasks.keys():
+        self.tasks.move_to_end(uid)
+        return self.tasks[uid]
+      entry = self.load_locks.setdefault(uid, [threading.Lock(), 0])
+      entry[1] += 1
+    # Only requests for this very Snapshot wait for it to load
+    try:
+      with entry[0]:
+        with self.lock:
+          if uid in self.tasks.keys():
+            return self.tasks[uid]
+        return self.load(self.resolve(name_or_id))
+    finally:
+      # The last one out removes the lock, so that they do not pile up
+      with self.lock:
+        entry[1] -= 1
+        if entry[1] == 0:
+          del self.load_locks[uid]
+
+  def load(self, snapshot):
+    """Make room for a Snapshot in the pool, import it and load its model."""
+    if self.memory_budget is not None:
+      self.make_room(model_file_memory(snapshot))
+    with self.import_lock:
+      task = self.experiment.import_snapshot(snapshot)
+    task.load_eval_model()
+    task.model.to(task.device)
+    task.model.eval()
+    size = model_memory(task.model)
+    if self.memory_budget is not None:
+      # In case the model turned out bigger than its file
+      self.make_room(size)
+    with self.lock:
+      self.tasks[snapshot.uid] = task
+      self.sizes[snapshot.uid] = size
+    return task
+
+  def make_room(self, size):
+    """Evict the least recently used Tasks until "size" more bytes fit the budget."""
+    with self.lock:
+      while self.tasks and self.used_memory() + size > self.memory_budget:
+        uid, _ = self.tasks.popitem(last=False)
+        self.sizes.pop(uid)
+
+  def evict(self, name_or_id=None):
+    """Remove the given, or the least recently used, Task from the pool.
+
+    Does nothing if there is no such Task (or none at all) in the pool.
+    """
+    uid = None if name_or_id is None else self.resolve_uid(name_or_id)
+    with self.lock:
+      if uid is None:
+        if not self.tasks:
+          return
+        uid, _ = self.tasks.popitem(last=False)
+      elif self.tasks.pop(uid, None) is None:
+        return
+      self.sizes.pop(uid)
+
+  def used_memory(self):
+    """Total size of all resident models, in bytes."""
+    return sum(self.sizes.values())
+
+  def preload(self, *names_or_ids, background=True):
+    """Import the given Snapshots ahead of time (hint that they'll be needed).
+
+    By default this happens in a background thread, which is returned.
+    """
+    def run():
+      for name_or_id in names_or_ids:
+        self.get(name_or_id)
+    if not background:
+      return run()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+  def eval(self, name_or_id, sample):
+    """Evaluate a single sample with the model of the given Snapshot."""
+    return self.get(name_or_id).eval(sample)
+
+  def eval_batch(self, name_or_id, samples):
+    """Evaluate a list of samples with the model of the given Snapshot."""
+    return self.get(name_or_id).eval_batch(samples)
+
+  def route(self, name):
+    """Map a server route name to a Task (empty name: the last Snapshot).
+
+    Returns None if there is no such Snapshot. Errors of importing and loading
+    an existing one are raised as they are.
+    """
+    if name == '':
+      if not self.experiment.snapshot_names:
+        return None
+      name = self.experiment.snapshot_names[-1]
+    try:
+      self.resolve_uid(name)
+    except KeyError:
+      return None
+    return self.get(name)
+
+  def server(self, host='127.0.0.1', port=8000, max_batch=16, max_latency=0.005):
+    """Serve all the Snapshots of the Experiment, until interrupted."""
+    server = InferenceServer(
+      route=self.route,
+      host=host,
+      port=port,
+      max_batch=max_batch,
+      max_latency=max_latency,
+    )
+    server.serve_forever()
+
+
+def model_file_memory(snapshot):
+  """Estimate the memory that the last model file of a Snapshot will take, in bytes.
+
+  Exact for the "blobs" format, otherwise the size of the file itself.
+  """
+  path = snapshot.fetch_last_model_file()
+  if path is None or not os.path.isfile(path):
+    return 0
+  manifest = read_manifest(path)
+  if manifest is None:
+    return os.path.getsize(path)
+  return sum(
+    math.prod(entry['shape']) * getattr(torch, entry['dtype']).itemsize
+    for entry in manifest['tensors'].values()
+  )
+
+def model_memory(model):
+  """Size of all parameters and buffers of a torch module, in bytes."""
+  tensors = list(model.parameters()) + list(model.buffers())
+  return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
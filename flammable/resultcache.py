@@ -0,0 +1,91 @@
+import hashlib
+import os
+import threading
+
+from .locking import write_atomic
+
+class ResultCache():
+  """Persistent cache of evaluation results, bounded in size on disk.
+
+  Results are kept as files in a folder, one per key. A key identifies both the
+  input (by the hash of its raw contents, e.g. file bytes or a request body)
+  and the model (by "model_key", e.g. the hash of the model file), so results
+  of different models never mix. Values are opaque bytes - serializing results
+  is up to the user of the cache.
+
+  Once the total size of the cache exceeds "max_bytes", the least recently used
+  entries (by file modification time, which every hit refreshes) are removed.
+  Hits and misses are counted, see "stats".
+  """
+  def __init__(self, path, model_key, max_bytes):
+    self.path = path
+    self.model_key = model_key
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    os.makedirs(path, exist_ok=True)
+    self.sizes = {
+      entry.name: entry.stat().st_size
+      for entry in os.scandir(path)
+      if entry.is_file() and not entry.name.endswith('.tmp')
+    }
+
+  def key(self, data, kind=''):
+    """Return the key of an input given as raw bytes, of some kind (namespace)."""
+    digest = hashlib.sha256()
+    digest.update(self.model_key.encode())
+    digest.update(kind.encode())
+    digest.update(data)
+    return digest.hexdigest()
+
+  def get(self, key):
+    """Return the cached value under the key, or None."""
+    path = os.path.join(self.path, key)
+    try:
+      with open(path, 'rb') as file:
+        value = file.read()
+      os.utime(path)
+    except FileNotFoundError:
+      with self.lock:
+        self.misses += 1
+      return None
+    with self.lock:
+      self.hits += 1
+    return value
+
+  def put(self, key, value):
+    """Store a value (bytes) under the key, evicting old entries if needed."""
+    write_atomic(os.path.join(self.path, key), value, 'wb')
+    with self.lock:
+      self.sizes[key] = len(value)
+      if sum(self.sizes.values()) > self.max_bytes:
+        self.evict()
+
+  def evict(self):
+    """Remove the least recently used entries until the cache fits its size."""
+    entries = []
+    for name in list(self.sizes.keys()):
+      try:
+        entries.append((os.stat(os.path.join(self.path, name)).st_mtime, name))
+      except FileNotFoundError:
+        self.sizes.pop(name)  # removed by another process
+    total = sum(self.sizes.values())
+    for _, name in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      try:
+        os.remove(os.path.join(self.path, name))
+      except FileNotFoundError:
+        pass
+      total -= self.sizes.pop(name)
+
+  def stats(self):
+    """Return hit and miss counts, and the current number and size of entries."""
+    with self.lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'entries': len(self.sizes),
+        'bytes': sum(self.sizes.values()),
+      }
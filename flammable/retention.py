@@ -0,0 +1,102 @@
+import json
+import os
+
+from .locking import write_atomic
+
+class RetentionPolicy():
+  """Declarative rules deciding which model files of a Snapshot to keep.
+
+  Available rules:
+    * "keep_last": keep the K most recently saved files,
+    * "keep_best": keep the N files with the best value of a validation metric
+      (named by "metric", "mode" being "min" or "max"),
+    * "keep_every": keep files saved at every M-th epoch.
+  A file is kept if any of the rules keeps it; the most recent file is always
+  kept, whatever the rules say. With no rules at all, everything is kept.
+
+  Rules rely on the metadata registered along with each model file: the order
+  of saving, and the epoch ("epoch_i") at which the file was saved. The metric
+  value for a file is the one from the last validation at or before its epoch
+  (see Snapshot's val_data). Files of unknown epoch never match the last two
+  rules.
+
+  A policy can be set per Task (as its "retention" attribute) or for the whole
+  Experiment (Experiment.set_retention), the former taking precedence.
+  """
+  FILENAME = 'retention.json'
+
+  def __init__(self, keep_last=None, keep_best=None, metric=None, mode='min', keep_every=None):
+    if keep_best and not metric:
+      raise ValueError("keep_best requires a metric name!")
+    if mode not in ('min', 'max'):
+      raise ValueError("Mode must be either \"min\" or \"max\"!")
+    self.keep_last = keep_last
+    self.keep_best = keep_best
+    self.metric = metric
+    self.mode = mode
+    self.keep_every = keep_every
+
+  def select(self, snapshot):
+    """Return the set of model files of a Snapshot that should be kept."""
+    files = snapshot.model_files
+    if not files:
+      return set()
+    if not any((self.keep_last, self.keep_best, self.keep_every)):
+      return set(files)
+    keep = {files[-1]}
+    if self.keep_last:
+      keep.update(files[-self.keep_last:])
+    epochs = {
+      filename: snapshot.model_info.get(filename, {}).get('epoch_i')
+      for filename in files
+    }
+    if self.keep_every:
+      keep.update(
+        filename for filename, epoch_i in epochs.items()
+        if epoch_i is not None and epoch_i % self.keep_every == 0
+      )
+    if self.keep_best:
+      scores = {}
+      for filename, epoch_i in epochs.items():
+        score = self.score(snapshot.val_data, epoch_i)
+        if score is not None:
+          scores[filename] = score
+      ranking = sorted(scores.keys(), key=scores.get, reverse=(self.mode == 'max'))
+      keep.update(ranking[:self.keep_best])
+    return keep
+
+  def score(self, val_data, epoch_i):
+    """Find the metric value of the last validation at or before an epoch."""
+    if epoch_i is None:
+      return None
+    values = val_data.get(self.metric, [])
+    epochs = val_data.get('epoch_i', [])
+    score = None
+    for value, val_epoch in zip(values, epochs):
+      if val_epoch <= epoch_i:
+        score = value
+    return score
+
+  def to_dict(self):
+    return {
+      'keep_last': self.keep_last,
+      'keep_best': self.keep_best,
+      'metric': self.metric,
+      'mode': self.mode,
+      'keep_every': self.keep_every,
+    }
+
+  def save(self, experiment_path):
+    """Store the policy as the default for a given Experiment folder."""
+    write_atomic(os.path.join(experiment_path, self.FILENAME), json.dumps(self.to_dict()))
+
+  @classmethod
+  def load(cls, experiment_path):
+    """Load the default policy of an Experiment folder, None if there is none."""
+    if experiment_path is None:
+      return None
+    try:
+      with open(os.path.join(experiment_path, cls.FILENAME), 'r') as file:
+        return cls(**json.load(file))
+    except FileNotFoundError:
+      return None
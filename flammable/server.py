@@ -0,0 +1,193 @@
+import concurrent.futures
+import http.server
+import json
+import queue
+import threading
+import time
+
+from .timing import Histogram, RateMeter
+
+LATENCY_BOUNDS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+BATCH_BOUNDS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+RATE_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+class NoSuchModel(KeyError):
+  """Raised for requests naming a model that the server's route does not know."""
+
+class MicroBatcher():
+  """Groups individually submitted samples into batches for a single call.
+
+  A background thread waits for the first sample to arrive, then keeps
+  collecting more for at most "max_latency" seconds, or until "max_batch" of
+  them have been gathered, whichever happens first. The whole group is then
+  passed to "function", which should accept a list of samples and return a list
+  of results in the same order. Each submission gets a Future for its result.
+  """
+  def __init__(self, function, max_batch, max_latency, batch_histogram=None):
+    self.function = function
+    self.max_batch = max_batch
+    self.max_latency = max_latency
+    self.batch_histogram = batch_histogram
+    self.queue = queue.Queue()
+    self.thread = threading.Thread(target=self.loop, daemon=True)
+    self.thread.start()
+
+  def submit(self, sample):
+    """Schedule a sample for processing and return a Future of its result."""
+    future = concurrent.futures.Future()
+    self.queue.put((sample, future))
+    return future
+
+  def collect(self):
+    """Block until there is something to do, then gather a single batch."""
+    batch = [self.queue.get()]
+    deadline = time.monotonic() + self.max_latency
+    while len(batch) < self.max_batch:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        break
+      try:
+        batch.append(self.queue.get(timeout=remaining))
+      except queue.Empty:
+        break
+    return batch
+
+  def loop(self):
+    while True:
+      batch = self.collect()
+      samples, futures = zip(*batch)
+      if self.batch_histogram:
+        self.batch_histogram.observe(len(batch))
+      try:
+        results = list(self.function(list(samples)))
+        if len(results) != len(futures):
+          raise RuntimeError("Expected {} results of the batch, got {}!".format(len(futures), len(results)))
+      except Exception as error:
+        for future in futures:
+          future.set_exception(error)
+      else:
+        for future, result in zip(futures, results):
+          future.set_result(result)
+
+
+class InferenceServer():
+  """Local HTTP server exposing evaluation of one or many models.
+
+  Endpoints:
+    * POST /eval          - evaluate the default model on the request body,
+    * POST /eval/<name>   - evaluate the model registered under "name",
+    * GET  /stats         - JSON with request rate, batch size and latency
+                            histograms (and result cache counters).
+  Models are given by "route": a callable mapping a name (empty string for the
+  default) to an evaluable object, or returning None if there is no such model
+  (404 Not Found - any exception raised by the route itself is a 500 error).
+  An evaluable must implement "decode_request" (request body -> sample), "eval_
+  batch" (list of samples -> list of results) and "encode_response" (result ->
+  response body), as PytorchEvaluable does. Concurrent requests to the same
+  name are dynamically batched together (see MicroBatcher).
+
+  If an evaluable has a "result_cache" (resultcache.ResultCache), responses are
+  cached by the request body, and repeated requests skip evaluation entirely.
+  """
+  def __init__(self, route, host='127.0.0.1', port=8000, max_batch=16, max_latency=0.005):
+    self.route = route
+    self.max_batch = max_batch
+    self.max_latency = max_latency
+    self.batchers = {}
+    self.caches = {}
+    self.lock = threading.Lock()
+    self.request_rate = RateMeter(RATE_BOUNDS)
+    self.batch_sizes = Histogram(BATCH_BOUNDS)
+    self.latencies = Histogram(LATENCY_BOUNDS)
+    self.httpd = http.server.ThreadingHTTPServer((host, port), self.make_handler())
+    self.httpd.daemon_threads = True
+
+  def get_batcher(self, name):
+    """Return the batcher for the given model name, creating it if necessary."""
+    with self.lock:
+      if name not in self.batchers.keys():
+        # Resolve the model anew for every batch, so that it can be replaced
+        function = lambda samples: self.route(name).eval_batch(samples)
+        self.batchers[name] = MicroBatcher(
+          function, self.max_batch, self.max_latency, self.batch_sizes
+        )
+      return self.batchers[name]
+
+  def evaluate(self, name, payload):
+    """Process a single request body, returning the response body."""
+    evaluable = self.route(name)
+    if evaluable is None:
+      raise NoSuchModel(name)
+    cache = getattr(evaluable, 'result_cache', None)
+    if cache is not None:
+      self.caches[name] = cache
+      key = cache.key(payload, 'request')
+      body = cache.get(key)
+      if body is not None:
+        return body
+    sample = evaluable.decode_request(payload)
+    result = self.get_batcher(name).submit(sample).result()
+    body = evaluable.encode_response(result)
+    if cache is not None:
+      cache.put(key, body)
+    return body
+
+  def stats(self):
+    """Return all the statistics in a plain (JSON-ready) dict."""
+    return {
+      'request_rate': self.request_rate.summary(),
+      'batch_size': self.batch_sizes.summary(),
+      'latency': self.latencies.summary(),
+      'result_cache': {name: cache.stats() for name, cache in list(self.caches.items())},
+    }
+
+  def make_handler(self):
+    server = self
+    class Handler(http.server.BaseHTTPRequestHandler):
+      def respond(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+          self.respond(200, json.dumps(server.stats()).encode())
+        else:
+          self.respond(404, b'{"error": "not found"}')
+
+      def do_POST(self):
+        path = self.path.strip('/').split('/', 1)
+        if path[0] != 'eval':
+          self.respond(404, b'{"error": "not found"}')
+          return
+        name = path[1] if len(path) > 1 else ''
+        start = time.perf_counter()
+        server.request_rate.tick()
+        payload = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+          body = server.evaluate(name, payload)
+        except NoSuchModel:
+          self.respond(404, json.dumps({'error': 'no model: ' + name}).encode())
+          return
+        except Exception as error:
+          self.respond(500, json.dumps({'error': repr(error)}).encode())
+          return
+        server.latencies.observe(time.perf_counter() - start)
+        self.respond(200, body)
+
+      def log_message(self, *args):
+        # Do not spam the console with every single request
+        pass
+    return Handler
+
+  def serve_forever(self):
+    host, port = self.httpd.server_address[:2]
+    print("Serving on http://{}:{}/ (Ctrl+C to stop)".format(host, port))
+    try:
+      self.httpd.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.httpd.server_close()
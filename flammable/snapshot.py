@@ -1,5 +1,13 @@
+import atexit
+import contextlib
 import json
 import os
+import shutil
+import time
+import uuid
+
+from .blobstore import BlobStore, release_manifest
+from .locking import file_lock, write_atomic
 
 class Snapshot():
   """Data and metadata of a single version of an experiment.
@@ -24,11 +32,22 @@ class Snapshot():
   writing data after the other has written as well results in race conditions.
   Therefore, a Snapshot will always reload its state (overwriting the instance
   data) before performing any writes, to ensure that a write will not corrupt
-  the previously written data.
+  the previously written data. The reload, the modification and the (atomic)
+  write all happen under an inter-process lock on the Snapshot folder.
+
+  Writers that update the Snapshot very often (e.g. flushing metrics every few
+  iterations) can trade latency for throughput with "coalesce_writes": their
+  transactions are then applied in memory only, and written in batches.
   """
 
   _create_flag = False
   _data_file = 'snapshot.json'
+  _journal_file = 'journal.jsonl'
+  _lock_file = 'snapshot.lock'
+  # Sections written through SnapshotView (and thus journaled)
+  _sections = ['train_data', 'iter_data', 'val_data', 'test_data', 'custom_data']
+  # The journal is compacted once it outgrows twice the data file by this much
+  _journal_slack = 2 ** 16
 
   @classmethod
   def create(cls, root_path, uid, commit_sha, timestamp, filename, comment):
@@ -58,10 +77,17 @@ class Snapshot():
     self.comment = None
     # Mutable data entries
     self.train_data = {}  # anything produced during training, epoch by epoch
+    self.iter_data = {}   # intermediate training results, flushed within epochs
     self.val_data = {}    # results of intermediate tests during training
     self.test_data = {}   # results of a test
     self.model_files = [] # saved model parameters
+    self.model_info = {}  # metadata of each model file (e.g. epoch of saving)
+    self.artifacts = {}   # derived files (e.g. exported models), by kind
     self.custom_data = {} # whatever the user might like to save
+    # Write coalescing (see coalesce_writes) - local to this instance
+    self.write_interval = None
+    self.pending = []     # transactions not written yet, as (section, ops)
+    self.last_write = 0.0
     # Load everything from the data file
     if not self._create_flag:
       self.deserialize()
@@ -73,6 +99,33 @@ class Snapshot():
     """
     return os.path.join(self.root_path, filename)
 
+  def experiment_path(self):
+    """Return the path to the folder of the Experiment owning this Snapshot."""
+    snapshots_path = os.path.dirname(os.path.abspath(self.root_path))
+    return os.path.dirname(snapshots_path)
+
+  def find_sibling_data(self, key):
+    """Look for custom_data[key] stored by other Snapshots of the same commit.
+
+    Useful to reuse results that depend only on the code (and the machine),
+    like tuned settings. Returns the value from the most recent such Snapshot,
+    or None if there is none.
+    """
+    snapshots_path = os.path.dirname(os.path.abspath(self.root_path))
+    for name in sorted(os.listdir(snapshots_path), reverse=True):
+      path = os.path.join(snapshots_path, name, self._data_file)
+      if name == os.path.basename(os.path.abspath(self.root_path)) or not os.path.isfile(path):
+        continue
+      with open(path, 'r') as file:
+        data = json.load(file)
+      if data.get('commit_sha') == self.commit_sha and key in data.get('custom_data', {}):
+        return data['custom_data'][key]
+    return None
+
+  def blob_store(self):
+    """Return the BlobStore shared by all Snapshots of the parent Experiment."""
+    return BlobStore(os.path.join(self.experiment_path(), 'blobs'))
+
   def deserialize(self):
     """Load from the associated data file, overwriting the current state."""
     with open(os.path.join(self.root_path, self._data_file), 'r') as file:
@@ -89,50 +142,237 @@ class Snapshot():
       'filename',
       'comment',
       'train_data',
+      'iter_data',
       'val_data',
       'test_data',
       'model_files',
+      'model_info',
+      'artifacts',
       'custom_data',
     ]
     data = {key: self.__dict__[key] for key in keys}
-    with open(os.path.join(self.root_path, self._data_file), 'w') as file:
-      json.dump(data, file)
+    write_atomic(os.path.join(self.root_path, self._data_file), json.dumps(data))
+
+  def lock(self):
+    """Return a context manager holding the inter-process lock of the Snapshot.
+
+    Not reentrant: never nest it (nor transactions, which take it as well).
+    """
+    return file_lock(os.path.join(self.root_path, self._lock_file))
+
+  def reload(self):
+    """Load the current state from the data file and merge the pending writes.
+
+    Transactions which have not been written yet (see "coalesce_writes") are
+    replayed on top of the loaded data, so nothing written by other processes
+    in the meantime gets lost, and neither do the local changes.
+    """
+    self.deserialize()
+    for section, ops in self.pending:
+      replay_ops(self.__dict__[section], ops)
+
+  def write(self):
+    """Serialize and journal all the pending transactions. Hold the lock!"""
+    self.serialize()
+    if self.pending:
+      self.journal_many(self.pending)
+      self.pending = []
+    self.last_write = time.monotonic()
+
+  def commit(self, section, ops):
+    """Write a transaction, or queue it if writes are coalesced and not due.
+
+    Called by SnapshotView with the lock held if (and only if) writes are not
+    coalesced, in which case the data has already been reloaded.
+    """
+    if ops:
+      self.pending.append((section, ops))
+    if self.write_interval is None:
+      self.write()
+    elif time.monotonic() - self.last_write >= self.write_interval:
+      self.flush()
+
+  def flush(self):
+    """Merge the pending transactions with the current state and write them."""
+    if not self.pending:
+      return
+    with self.lock():
+      self.reload()
+      self.write()
+
+  def coalesce_writes(self, interval):
+    """Write transactions at most every "interval" seconds (None to disable).
+
+    In between, transactions only update the instance (so it sees its own
+    writes, but not those of other processes) and are queued. Each write then
+    merges the whole queue with the current state of the data file at once.
+    Any write of the registry (e.g. saving a model file) writes the queue as
+    well, and so does the end of the process. Transactions done before that
+    are not visible to other processes (or followers of the journal).
+    """
+    if interval is not None and self.write_interval is None:
+      atexit.register(self.flush)
+    elif interval is None and self.write_interval is not None:
+      atexit.unregister(self.flush)
+      self.flush()
+    self.write_interval = interval
 
   def reset(self):
     """Remove all data, reverting the snapshot to the zero state."""
+    # Release blobs of deduplicated model files before they are gone
+    for filename in set(self.model_files):
+      release_manifest(self.make_path(filename))
     # Clear mutable data, but leave the immutables intact
     self.train_data = {}
+    self.iter_data = {}
     self.val_data = {}
     self.test_data = {}
     self.model_files = []
+    self.model_info = {}
+    self.artifacts = {}
     self.custom_data = {}
-    # Remove all the physical assets
-    for item in os.scandir(self.root_path):
-      os.remove(item.path)
-    # Reserialize
-    self.serialize()
+    self.pending = []
+    # Remove all the physical assets (but the lock, others might be waiting)
+    with self.lock():
+      for item in os.scandir(self.root_path):
+        if item.is_dir():
+          shutil.rmtree(item.path)
+        elif item.name != self._lock_file:
+          os.remove(item.path)
+      # Reserialize
+      self.serialize()
 
   def train_storage(self):
     """Get a handle to train_data that writes there safely."""
-    return SnapshotView(self, self.train_data)
+    return SnapshotView(self, self.train_data, 'train_data')
+
+  def iter_storage(self):
+    """Get a handle to iter_data that writes there safely."""
+    return SnapshotView(self, self.iter_data, 'iter_data')
 
   def val_storage(self):
     """Get a handle to val_data that writes there safely."""
-    return SnapshotView(self, self.val_data)
+    return SnapshotView(self, self.val_data, 'val_data')
 
   def test_storage(self):
     """Get a handle to test_data that writes there safely."""
-    return SnapshotView(self, self.test_data)
+    return SnapshotView(self, self.test_data, 'test_data')
 
   def custom_storage(self):
     """Get a handle to custom_data that writes there safely."""
-    return SnapshotView(self, self.custom_data)
+    return SnapshotView(self, self.custom_data, 'custom_data')
 
-  def register_model_file(self, filename):
-    """Add a given model file to the internal registry."""
-    # TODO: remember about locking&reading when doing the atomic stuff
-    self.model_files.append(filename)
-    self.serialize()
+  def journal(self, section, ops):
+    """Append a record of a single transaction to the journal file.
+
+    Unlike the data file, which is rewritten as a whole on every write, journal
+    only grows between compactions, allowing other processes to follow updates
+    by reading just the new bytes (see follower.SnapshotFollower). Each record
+    is a single line of JSON: the name of the updated section and a list of the
+    [mode, name, value] operations performed on it. The first line is a header
+    with a "generation" ID, which changes whenever the journal is recreated.
+    """
+    self.journal_many([(section, ops)])
+
+  def journal_many(self, transactions):
+    """Append records of many (section, ops) transactions in a single write.
+
+    Compacts the journal if it has grown too big (see "compact_journal").
+    """
+    path = os.path.join(self.root_path, self._journal_file)
+    records = ''.join(
+      json.dumps({'section': section, 'ops': ops}) + '\n' for section, ops in transactions
+    )
+    if not os.path.isfile(path):
+      records = journal_header() + records
+    with open(path, 'a') as file:
+      file.write(records)
+      journal_size = file.tell()
+    data_size = os.path.getsize(os.path.join(self.root_path, self._data_file))
+    if journal_size > 2 * data_size + self._journal_slack:
+      self.compact_journal()
+
+  def compact_journal(self):
+    """Replace the journal with a single record per section. Hold the lock!
+
+    Each record clears the section and stores all of its current entries, so
+    replaying the compacted journal gives the same state as the full history.
+    This keeps the journal proportional to the data, instead of to the number
+    of writes ever made. The journal gets a new generation, so followers know
+    to start over.
+    """
+    records = [journal_header()]
+    for section in self._sections:
+      ops = [['clear', None, None]]
+      ops.extend(['store', name, value] for name, value in self.__dict__[section].items())
+      records.append(json.dumps({'section': section, 'ops': ops}) + '\n')
+    write_atomic(os.path.join(self.root_path, self._journal_file), ''.join(records))
+
+  def register_model_file(self, filename, **info):
+    """Add a given model file to the internal registry.
+
+    Any keyword arguments are stored as the metadata of this file. If the file
+    had already been registered (i.e. it has just been overwritten), it is moved
+    to the end of the registry, as the most recent one.
+    """
+    with self.lock():
+      self.reload()
+      if filename in self.model_files:
+        self.model_files.remove(filename)
+      self.model_files.append(filename)
+      self.model_info[filename] = info
+      self.write()
+
+  def register_artifact(self, kind, filename, **info):
+    """Add a file derived from the model (e.g. an export) to the registry.
+
+    There is at most one artifact of each kind - a new one replaces the old
+    entry. Any keyword arguments are stored as its metadata.
+    """
+    with self.lock():
+      self.reload()
+      self.artifacts[kind] = dict(info, filename=filename)
+      self.write()
+
+  def fetch_artifact(self, kind):
+    """Return the metadata of an artifact of a given kind, or None.
+
+    The "path" field of the returned dict holds the full path to the file.
+    """
+    if kind not in self.artifacts.keys():
+      return None
+    artifact = dict(self.artifacts[kind])
+    artifact['path'] = self.make_path(artifact['filename'])
+    return artifact
+
+  def apply_retention(self, policy):
+    """Delete all the model files that the given RetentionPolicy does not keep.
+
+    The registry is updated (and serialized) before the files are deleted, so
+    it never refers to missing files. Returns the list of deleted filenames.
+    """
+    with self.lock():
+      self.reload()
+      keep = policy.select(self)
+      removed = [filename for filename in self.model_files if filename not in keep]
+      if not removed:
+        return removed
+      self.model_files = [filename for filename in self.model_files if filename in keep]
+      for filename in removed:
+        self.model_info.pop(filename, None)
+      self.write()
+    for filename in removed:
+      self.delete_model_file(filename)
+    return removed
+
+  def delete_model_file(self, filename):
+    """Physically remove a model file, releasing its blobs if deduplicated."""
+    path = self.make_path(filename)
+    release_manifest(path)
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
 
   def fetch_last_model_file(self):
     """Return the full path to the last saved model file."""
@@ -143,12 +383,41 @@ class Snapshot():
       return None
 
 
+def journal_header():
+  """Return the first line of a new journal, with a unique generation ID."""
+  return json.dumps({'generation': uuid.uuid4().hex}) + '\n'
+
+def replay_ops(data, ops):
+  """Apply a list of [mode, name, value] operations of a transaction to a dict."""
+  for mode, name, value in ops:
+    if mode == 'store':
+      data[name] = value
+    elif mode == 'append':
+      data.setdefault(name, []).append(value)
+    elif mode == 'clear':
+      data.clear()
+    else:
+      raise KeyError("Unknown transaction operation: \"{}\"!".format(mode))
+
+
 class SnapshotView():
-  """Context manager that allows atomic writes to the Snapshot."""
-  def __init__(self, parent:Snapshot, target:dict):
+  """Context manager that allows atomic writes to the Snapshot.
+
+  Entering the context locks the Snapshot and reloads its data, so the view
+  works on the current state, however many processes write to it; exiting
+  writes the result and releases the lock. If the Snapshot coalesces writes,
+  the view works on the in-memory state instead, without locking.
+
+  Every operation is also recorded, so that once the context is exited it can
+  be journaled under the given section name (and replayed on a fresh state).
+  """
+  def __init__(self, parent:Snapshot, target:dict, section:str):
     self.parent = parent
     self.data = target
+    self.section = section
+    self.ops = []
     self.ready = False
+    self.lock = None
 
   def store(self, name, value):
     """Store a value directly under the given name."""
@@ -157,6 +426,7 @@ class SnapshotView():
       raise RuntimeError("SnapshotView is a context manager. Never use it directly!")
     # Do not ask for permission - overwrite the old entry if necessary
     self.data[name] = value
+    self.ops.append(['store', name, value])
 
   def append(self, name, value):
     """Append a single data value to the list under a given name."""
@@ -170,16 +440,39 @@ class SnapshotView():
       target = []
       self.data[name] = target
     target.append(value)
+    self.ops.append(['append', name, value])
+
+  def clear(self):
+    """Remove all entries from the viewed data."""
+    if not self.ready:
+      raise RuntimeError("SnapshotView is a context manager. Never use it directly!")
+    self.data.clear()
+    self.ops.append(['clear', None, None])
 
   def __enter__(self):
-    # Currently does nothing, but later will do locks&reads for atomic writes
+    if self.parent.write_interval is None:
+      self.lock = self.parent.lock()
+      self.lock.__enter__()
+      try:
+        self.parent.reload()
+      except BaseException:
+        self.lock.__exit__(None, None, None)
+        self.lock = None
+        raise
+    # Reloading has replaced the data, do not write to the old dict
+    self.data = self.parent.__dict__[self.section]
     self.ready = True
     return self
 
   def __exit__(self, *args, **kwargs):
-    # Ensure the Snapshot serializes, later will also release locks
-    self.parent.serialize()
-    self.ready = False
+    try:
+      self.parent.commit(self.section, self.ops)
+    finally:
+      self.ops = []
+      self.ready = False
+      if self.lock:
+        self.lock.__exit__(None, None, None)
+        self.lock = None
 
 
 class DummySnapshot(Snapshot):
@@ -207,10 +500,35 @@ class DummySnapshot(Snapshot):
   def deserialize(self):
     pass
 
+  def journal_many(self, transactions):
+    pass
+
+  def compact_journal(self):
+    pass
+
+  def lock(self):
+    return contextlib.nullcontext()
+
+  def coalesce_writes(self, interval):
+    pass
+
+  # Not bound to any Experiment, so there is nowhere to keep the blobs
+  def experiment_path(self):
+    return None
+
+  def find_sibling_data(self, key):
+    return None
+
+  def blob_store(self):
+    raise RuntimeError("A DummySnapshot cannot store deduplicated model files!")
+
   # The original reset deletes data
   def reset(self):
     self.train_data = {}
+    self.iter_data = {}
     self.val_data = {}
     self.test_data = {}
     self.model_files = []
+    self.model_info = {}
+    self.artifacts = {}
     self.custom_data = {}
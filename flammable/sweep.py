@@ -0,0 +1,151 @@
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import time
+import traceback
+
+import torch
+
+from .snapshot import Snapshot
+
+def expand_grid(space):
+  """Return all combinations of values of a parameter space (dict of lists)."""
+  names = sorted(space.keys())
+  for name in names:
+    if not isinstance(space[name], list):
+      raise ValueError("Grid values must be lists (parameter \"{}\").".format(name))
+  return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+def sample_space(space, samples, seed=None):
+  """Draw random configurations from a parameter space.
+
+  Each value of the "space" dict defines how its parameter is drawn:
+    * a list: one of its elements, uniformly,
+    * {"uniform": [low, high]}: a float in the given range,
+    * {"log_uniform": [low, high]}: a float, uniformly in the log space,
+    * {"int": [low, high]}: an integer, both ends inclusive.
+  The whole space is JSON-serializable, so it can be given in a file.
+  """
+  rng = random.Random(seed)
+  def draw(name, spec):
+    if isinstance(spec, list):
+      return rng.choice(spec)
+    if isinstance(spec, dict) and len(spec) == 1:
+      (kind, (low, high)), = spec.items()
+      if kind == 'uniform':
+        return rng.uniform(low, high)
+      if kind == 'log_uniform':
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+      if kind == 'int':
+        return rng.randint(low, high)
+    raise ValueError("Unknown specification of parameter \"{}\": {}".format(name, spec))
+  return [
+    {name: draw(name, spec) for name, spec in sorted(space.items())}
+    for _ in range(samples)
+  ]
+
+def available_cores():
+  """Return the sorted list of the cores this process may run on."""
+  if hasattr(os, 'sched_getaffinity'):
+    return sorted(os.sched_getaffinity(0))
+  return list(range(os.cpu_count()))
+
+def partition_cores(workers):
+  """Split the cores available to this process into "workers" disjoint sets."""
+  cores = available_cores()
+  if workers > len(cores):
+    # More workers than cores: let them share
+    return [cores[i % len(cores):i % len(cores) + 1] for i in range(workers)]
+  share = len(cores) // workers
+  return [cores[i * share:(i + 1) * share] for i in range(workers)]
+
+
+# The Task to run, the core sets and the queue of free ones - inherited by forking
+_task = None
+_slots = None
+_slot_queue = None
+
+def _run_job(job):
+  # Every job runs in a fresh worker, forked from the untouched Task
+  index, snapshot_path, config = job
+  slot = _slot_queue.get()
+  start = time.perf_counter()
+  try:
+    cores = _slots[slot]
+    if hasattr(os, 'sched_setaffinity'):
+      os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    _task.snapshot = Snapshot(snapshot_path)
+    _task.configure(config)
+    _task.train()
+    error = None
+  except Exception:
+    error = traceback.format_exc()
+  finally:
+    _slot_queue.put(slot)
+  return index, error, time.perf_counter() - start
+
+def run_sweep(task, configs, workers=None, message=None):
+  """Train the Task once for each configuration, in parallel, one Snapshot each.
+
+  Snapshots are created up front (against the current commit, committing any
+  code changes first), each with its configuration stored in custom_data under
+  "sweep". Then they are trained on a pool of forked worker processes, each of
+  which is pinned to a separate share of the CPU cores and uses as many threads
+  as it has cores. By default there are as many workers as available cores (but
+  no more than configurations). Each configuration is trained in a new process,
+  forked from the original Task, so every run starts from the same initial
+  weights and settings. Before training, the configuration is applied to the
+  Task (see BaseTask.configure). A failing configuration does not stop others.
+
+  Progress is printed as the runs complete. Returns a list of results, one per
+  configuration: the Snapshot name, the configuration, status ("done" or
+  "failed"), the error traceback if any, and the time taken. The status is also
+  recorded in each Snapshot.
+  """
+  global _task, _slots, _slot_queue
+  if not configs:
+    raise ValueError("Nothing to sweep over!")
+  workers = min(workers or len(available_cores()), len(configs))
+  sweep_id = time.strftime('%Y%m%d-%H%M%S')
+  snapshots = []
+  for index, config in enumerate(configs):
+    snapshot = task.experiment.make_snapshot(message=message)
+    with snapshot.custom_storage() as transaction:
+      transaction.store('sweep', {'id': sweep_id, 'index': index, 'config': config})
+    snapshots.append(snapshot)
+  jobs = [(index, snapshot.root_path, config) for index, (snapshot, config) in enumerate(zip(snapshots, configs))]
+  context = multiprocessing.get_context('fork')
+  slot_queue = context.SimpleQueue()
+  for slot in range(workers):
+    slot_queue.put(slot)
+  _task, _slots, _slot_queue = task, partition_cores(workers), slot_queue
+  results = [None] * len(configs)
+  try:
+    with context.Pool(workers, maxtasksperchild=1) as pool:
+      for done, (index, error, elapsed) in enumerate(pool.imap_unordered(_run_job, jobs), 1):
+        snapshot = snapshots[index]
+        status = 'failed' if error else 'done'
+        results[index] = {
+          'snapshot': os.path.basename(snapshot.root_path),
+          'config': configs[index],
+          'status': status,
+          'error': error,
+          'time': elapsed,
+        }
+        # The worker has written to the Snapshot in the meantime - the
+        # transaction reloads it first, so that none of that is overwritten
+        with snapshot.custom_storage() as transaction:
+          transaction.store('sweep', dict(transaction.data['sweep'], status=status, error=error))
+        print("[{}/{}] {} {} in {:.1f}s: {}".format(
+          done, len(configs), results[index]['snapshot'], status, elapsed, configs[index]
+        ))
+        if error:
+          print(error)
+  finally:
+    _task, _slots, _slot_queue = None, None, None
+  failed = sum(result['status'] == 'failed' for result in results)
+  print("Sweep {} complete: {} done, {} failed.".format(sweep_id, len(configs) - failed, failed))
+  return results
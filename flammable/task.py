@@ -1,9 +1,12 @@
 import argparse
+import json
 import os
 
+from .follower import SnapshotFollower
 from .identify import get_caller, is_imported
 from .library import library
 from .snapshot import DummySnapshot
+from .sweep import expand_grid, run_sweep, sample_space
 
 class BaseTask():
   """Base class for running and archiving any machine learning model.
@@ -44,15 +47,54 @@ class BaseTask():
   def train(self):
     raise NotImplementedError
 
-  def test(self):
+  def test(self, retest=False):
+    raise NotImplementedError
+
+  def test_many(self, models, memory_budget=None):
     raise NotImplementedError
 
   def eval_path(self, input_path, output_path):
     raise NotImplementedError
 
-  def server(self):
+  def eval_many(self, input_spec, output_dir, batch_size=None, workers=None):
+    raise NotImplementedError
+
+  def server(self, host='127.0.0.1', port=8000, max_batch=None, max_latency=None):
+    raise NotImplementedError
+
+  def ensemble(self, tasks, reduction='mean'):
+    raise NotImplementedError
+
+  def export(self):
     raise NotImplementedError
 
+  def benchmark_model_files(self):
+    raise NotImplementedError
+
+  def configure(self, config):
+    """Apply a configuration (dict) to the task, e.g. for a sweep.
+
+    By default sets each entry as an attribute, so that e.g. {"epochs": 5} sets
+    "self.epochs". Override to interpret the configuration differently.
+    """
+    for name, value in config.items():
+      setattr(self, name, value)
+
+  def sweep(self, space, samples=None, workers=None, seed=None, message=None):
+    """Train a Snapshot for every configuration from a parameter space, in parallel.
+
+    Without "samples", "space" is a grid: a dict of lists of values to try, and
+    every combination of them is trained. Otherwise this many configurations are
+    drawn at random (see sweep.sample_space for how the space is then given).
+    Requires a linked local repository (as from the CLI). See sweep.run_sweep
+    for details of the execution, and the returned results.
+    """
+    if samples:
+      configs = sample_space(space, samples, seed)
+    else:
+      configs = expand_grid(space)
+    return run_sweep(self, configs, workers, message)
+
   # Interface
 
   def main(self, message=None):
@@ -85,16 +127,28 @@ class BaseTask():
                   snapshot, and start training; otherwise exit, unless some
                   special flag (--retrain, --force) was passed,
       * "test":   if there were no changes in task code, or a special --ignore
-                  flag was passed, get the last snapshot and test it; otherwise
-                  exit,
+                  flag was passed, get the last snapshot and test it (unless it
+                  has been tested with the same code, model file and data, and
+                  no --retest flag was passed); otherwise exit,
                   TODO: keep task state (e.g. initialized, trained, tested, not
                   tested etc.) to ensure we're not testing an untrained model;
-                  TODO: reintroduce --retest flag;
       * "eval":   logic is the same as in "test",
-                  TODO: rework after completing the above 2 todos;
-      * "server": TBD
+                  TODO: rework after completing the above todo;
+      * "batch":  same as "eval", but for a whole directory, glob or manifest
+                  of inputs at once,
+      * "server": logic is the same as in "eval", but instead of processing a
+                  single input, starts a local inference server,
+      + "export": logic is the same as in "test", but builds an optimized model
+                  for CPU inference instead,
+      + "multitest": logic is the same as in "test", but tests all the model
+                  files of the last snapshot (or the given snapshots) at once,
+      + "benchmark": logic is the same as in "test", but measures the size and
+                  speed of model files in each encoding instead,
       + "amend":  only commits changes (if any) onto an existing snapshot,
       + "status": checks the status of the repository/snapshot,
+      + "watch":  follows metric updates of the last (or given) snapshot live,
+      + "sweep":  commits changes (if any), then trains a new snapshot for each
+                  configuration from a parameter space given in a JSON file,
     """
     # Get the complete path to a file from which "main" was called
     this_path = get_caller(delta=1)
@@ -114,29 +168,61 @@ class BaseTask():
     args = self.cli_parse()
     if args.command == 'train':
       return self.cli_train(args=args, message=message)
-    elif args.command == 'test':
+    elif args.command in ('test', 'export', 'multitest', 'benchmark'):
       return self.cli_test(args=args)
-    elif args.command == 'eval':
+    elif args.command in ('eval', 'batch', 'server'):
       return self.cli_eval(args=args)
-    elif args.command == 'server':
-      raise NotImplementedError("This is not ready yet, TODO!")
+    elif args.command == 'watch':
+      return self.cli_watch(args=args)
+    elif args.command == 'sweep':
+      return self.cli_sweep(args=args, message=message)
 
   def cli_parse(self):
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(prog='FLAMMABLE')
-    parser.add_argument('command', choices=['train', 'test', 'eval'])
+    parser.add_argument('command', choices=['train', 'test', 'eval', 'batch', 'server', 'export', 'watch', 'sweep', 'multitest', 'benchmark'])
     parser.add_argument('infile', nargs='?', help="[Evaluation only]\
-      Path to the input file.")
+      Path to the input file. [Batch only] Input directory, manifest or glob.\
+      [Watch only] Name or ID of the snapshot. [Sweep only] JSON file with\
+      the parameter space. [Multitest only] Names or IDs of the snapshots.")
     parser.add_argument('outfile', nargs='?', help="[Evaluation only]\
-      Path to the output file.")
+      Path to the output file. [Batch only] Output directory.")
     parser.add_argument('other', nargs='*', help='(unused)')
     tflags = parser.add_mutually_exclusive_group(required=False)
     tflags.add_argument('--retrain', action='store_true', help="[Training only]\
       Reset the existing snapshot and train it from scratch.")
     tflags.add_argument('--force', action='store_true', help="[Training only]\
       Create a new snapshot even if there were no changes in the code.")
+    parser.add_argument('--warm-start', metavar='SNAPSHOT[:FILE]', help="[Training\
+      only] Initialize the model from a model file (by default the last one) of\
+      the given snapshot.")
     parser.add_argument('--ignore', action='store_true', help="[Testing only]\
       Ignore that the code was changed since the training, test anyway.")
+    parser.add_argument('--retest', action='store_true', help="[Testing only]\
+      Test again, even if the results for this model and data are stored.")
+    parser.add_argument('--batch-size', type=int, help="[Batch only]\
+      Number of samples processed by the model at once.")
+    parser.add_argument('--workers', type=int, help="[Batch only]\
+      Number of threads loading samples and storing results. [Sweep only]\
+      Number of trainings running in parallel.")
+    parser.add_argument('--samples', type=int, help="[Sweep only]\
+      Number of random configurations to draw (default: the whole grid).")
+    parser.add_argument('--seed', type=int, help="[Sweep only]\
+      Seed for drawing random configurations.")
+    parser.add_argument('--memory-budget', type=float, help="[Multitest only]\
+      Largest total size of models (in MB) to keep in memory at once.")
+    parser.add_argument('--ensemble', nargs='+', help="[Evaluation, batch and\
+      server only] Names or IDs of the snapshots to evaluate as an ensemble.")
+    parser.add_argument('--reduction', default='mean', choices=['mean', 'vote', 'all'],
+      help="[Ensemble only] How to combine the outputs of the models.")
+    parser.add_argument('--use-export', action='store_true', help="[Evaluation,\
+      batch and server only] Evaluate with the exported model, if up to date.")
+    parser.add_argument('--port', type=int, default=8000, help="[Server only]\
+      Port to listen on (localhost only).")
+    parser.add_argument('--max-batch', type=int, help="[Server only]\
+      Largest number of requests evaluated at once.")
+    parser.add_argument('--max-latency', type=float, help="[Server only]\
+      Longest time (in seconds) to wait for more requests to batch together.")
     return parser.parse_args()
 
   def cli_train(self, args, message):
@@ -153,7 +239,12 @@ class BaseTask():
         Snapshot, reset it, and run "train" on it again,
       * if there were no changes but --force was given: create a new Snapshot
         referring to the most recent commit, and run "train".
+    In any case, --warm-start sets the Snapshot (and model file) to initialize
+    the model from (see the "warm_start" of the backend).
     """
+    if args.warm_start:
+      name, _, filename = args.warm_start.partition(':')
+      self.warm_start = dict(getattr(self, 'warm_start', None) or {}, snapshot=name, filename=filename or None)
     # Check for changes in the repository
     is_changed = self.experiment.check_changes()
     if is_changed:
@@ -177,7 +268,7 @@ class BaseTask():
       return
 
   def cli_test(self, args):
-    """Testing command logic.
+    """Testing command logic (also used for exporting, multitest and benchmark).
 
     As with the "cli_train", logic is bound with the current state of the repo.
     Usually, a model is first trained and later tested - code is not expected
@@ -190,37 +281,144 @@ class BaseTask():
       * if there were no changes in the code: get the last Snapshot, run "test",
       * if there were changes but --ignore was given: get the last Snapshot, run
         "test".
+    Either way, "test" itself skips testing if the Snapshot holds the results
+    for the same code, model file and data already, unless --retest was given.
     """
     # Check for changes in the repository
     is_changed = self.experiment.check_changes()
     if not is_changed or args.ignore:
-      # Test the last Snapshot
+      # Test (or export) the last Snapshot
       self.snapshot = self.experiment.get_last_snapshot()
-      self.test()
+      if args.command == 'export':
+        self.export()
+      elif args.command == 'multitest':
+        self.cli_multitest(args)
+      elif args.command == 'benchmark':
+        self.load_model()
+        print(json.dumps(self.benchmark_model_files(), indent=2))
+      else:
+        self.test(retest=args.retest)
     else:
       print("Changes detected. Which snapshot do you wish to test?",
             "If you wish to test the last snapshot, run with --ignore.",
             "If you wish to test some other snapshot, use the python API to",
             "select and import it, and call its test() method.")
 
+  def cli_multitest(self, args):
+    """Multi-model testing command logic.
+
+    Tests all the model files of the last Snapshot, or the last model files of
+    all the Snapshots given by name or ID, in a single pass (see "test_many").
+    Snapshots are only imported when their turn comes.
+    """
+    names = [name for name in [args.infile, args.outfile] + args.other if name]
+    if names:
+      models = []
+      for name in names:
+        snapshot = self.experiment.get_snapshot(name)
+        if not snapshot:
+          print("No such snapshot: \"{}\".".format(name))
+          return
+        models.append(snapshot)
+    else:
+      models = [(self, filename) for filename in self.snapshot.model_files]
+    memory_budget = None
+    if args.memory_budget is not None:
+      memory_budget = int(args.memory_budget * 2 ** 20)
+    self.test_many(models, memory_budget=memory_budget)
+
   def cli_eval(self, args):
-    """Evaluation command logic.
+    """Evaluation command logic, for single ("eval"), batch ("batch") and server.
 
     Logic is bound with the repo state in exactly the same way as in "cli_test".
+    With --ensemble, the given snapshots are evaluated together (see "ensemble"),
+    using the data processing of the last one. With --use-export, the exported
+    model is evaluated instead of the model file, if it is up to date.
     """
     # Check for changes in the repository
     is_changed = self.experiment.check_changes()
     if not is_changed or args.ignore:
       # Load the last Snapshot
       self.snapshot = self.experiment.get_last_snapshot()
+      if args.use_export:
+        self.use_export = True
+      # Optionally, replace its model with an ensemble of other Snapshots'
+      target = self
+      if args.ensemble:
+        tasks = []
+        for name in args.ensemble:
+          snapshot = self.experiment.get_snapshot(name)
+          if not snapshot:
+            print("No such snapshot: \"{}\".".format(name))
+            return
+          tasks.append(self.experiment.import_snapshot(snapshot))
+        target = self.ensemble(tasks, reduction=args.reduction)
       # Evaluate the model on given arguments
-      self.eval_path(input_path=args.infile, output_path=args.outfile)
+      if args.command == 'batch':
+        target.eval_many(
+          input_spec=args.infile,
+          output_dir=args.outfile,
+          batch_size=args.batch_size,
+          workers=args.workers,
+        )
+      elif args.command == 'server':
+        target.server(
+          port=args.port,
+          max_batch=args.max_batch,
+          max_latency=args.max_latency,
+        )
+      else:
+        target.eval_path(input_path=args.infile, output_path=args.outfile)
     else:
       print("Changes detected. Which snapshot do you wish to evaluate?",
             "If you wish to eval the last snapshot, run with --ignore.",
             "If you wish to eval some other snapshot, use the python API to",
             "select and import it, and call its eval() or eval_path() method.")
 
+  def cli_watch(self, args):
+    """Watching command logic.
+
+    Prints updates of the snapshot's data as they are written, until the user
+    interrupts. Follows the last snapshot, unless a name or ID was given. This
+    does not depend on the repo state, as it does not run any of the code.
+    """
+    if args.infile:
+      snapshot = self.experiment.get_snapshot(args.infile)
+      if not snapshot:
+        print("No such snapshot: \"{}\".".format(args.infile))
+        return
+    else:
+      snapshot = self.experiment.get_last_snapshot()
+    follower = SnapshotFollower(snapshot)
+    try:
+      for section, mode, name, value in follower.follow():
+        if mode == 'clear':
+          print("[{}] (cleared)".format(section))
+        else:
+          print("[{}] {}: {}".format(section, name, value))
+    except KeyboardInterrupt:
+      pass
+
+  def cli_sweep(self, args, message):
+    """Sweep command logic.
+
+    Changes in the code (if any) are committed once, then all the Snapshots of
+    the sweep refer to that commit. The parameter space is read from a JSON file
+    (see "sweep" for its meaning).
+    """
+    if not args.infile:
+      print("Give the path to a JSON file with the parameter space to sweep.")
+      return
+    with open(args.infile, 'r') as file:
+      space = json.load(file)
+    return self.sweep(
+      space,
+      samples=args.samples,
+      workers=args.workers,
+      seed=args.seed,
+      message=message,
+    )
+
   def api_main(self):
     """Export the instance for external use through the library."""
     self.register_instance(self)
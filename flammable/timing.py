@@ -0,0 +1,196 @@
+import bisect
+import os
+import threading
+import time
+
+import torch
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+class StageStats():
+  """Thread-safe collector of per-stage timings of some processing pipeline.
+
+  Each stage (e.g. "load", "eval", "store") accumulates the number of calls,
+  the number of items processed and the latency of each call. Additionally the
+  total number of items that went through the whole pipeline is counted, which
+  together with the wall time since construction gives the throughput.
+  """
+  def __init__(self):
+    self.stages = {}
+    self.items = 0
+    self.lock = threading.Lock()
+    self.start = time.perf_counter()
+
+  def record(self, stage, seconds, count=1):
+    """Account a single call of a stage, which took "seconds" for "count" items."""
+    with self.lock:
+      if stage not in self.stages.keys():
+        self.stages[stage] = {'calls': 0, 'items': 0, 'total': 0.0, 'min': seconds, 'max': seconds}
+      entry = self.stages[stage]
+      entry['calls'] += 1
+      entry['items'] += count
+      entry['total'] += seconds
+      entry['min'] = min(entry['min'], seconds)
+      entry['max'] = max(entry['max'], seconds)
+
+  def timed(self, stage, function):
+    """Wrap a single-argument function so that each call is recorded."""
+    def wrapper(arg):
+      start = time.perf_counter()
+      result = function(arg)
+      self.record(stage, time.perf_counter() - start)
+      return result
+    return wrapper
+
+  def count(self, items=1):
+    """Account items that have completed the whole pipeline."""
+    with self.lock:
+      self.items += items
+
+  def summary(self):
+    """Return all the statistics in a plain (JSON-ready) dict."""
+    elapsed = time.perf_counter() - self.start
+    with self.lock:
+      stages = {
+        name: dict(entry, mean=entry['total'] / entry['calls'])
+        for name, entry in self.stages.items()
+      }
+      items = self.items
+    return {
+      'items': items,
+      'elapsed': elapsed,
+      'throughput': items / elapsed if elapsed > 0 else 0.0,
+      'stages': stages,
+    }
+
+  def report(self):
+    """Format the summary into a human-readable string."""
+    summary = self.summary()
+    lines = ['{} items in {:.2f}s ({:.2f} items/s)'.format(
+      summary['items'], summary['elapsed'], summary['throughput']
+    )]
+    for name, entry in summary['stages'].items():
+      lines.append('  {}: {} calls, mean {:.2f}ms, min {:.2f}ms, max {:.2f}ms'.format(
+        name, entry['calls'], 1000 * entry['mean'], 1000 * entry['min'], 1000 * entry['max']
+      ))
+    return '\n'.join(lines)
+
+
+class Histogram():
+  """Thread-safe histogram of observed values over fixed bucket bounds.
+
+  Bucket i counts the values not greater than bounds[i] (but greater than the
+  previous bound); one last bucket counts everything above the last bound.
+  """
+  def __init__(self, bounds):
+    self.bounds = sorted(bounds)
+    self.counts = [0] * (len(self.bounds) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.lock = threading.Lock()
+
+  def observe(self, value):
+    """Account a single value."""
+    with self.lock:
+      self.counts[bisect.bisect_left(self.bounds, value)] += 1
+      self.count += 1
+      self.total += value
+
+  def summary(self):
+    """Return the counts in a plain (JSON-ready) dict."""
+    with self.lock:
+      buckets = [[bound, count] for bound, count in zip(self.bounds, self.counts)]
+      buckets.append(['inf', self.counts[-1]])
+      return {
+        'count': self.count,
+        'sum': self.total,
+        'mean': self.total / self.count if self.count else 0.0,
+        'buckets': buckets,
+      }
+
+
+class RateMeter():
+  """Counts events per second, keeping a histogram of the per-second rates.
+
+  A second is only accounted in the histogram when it is over and at least one
+  event has happened after it, so idle periods do not skew the distribution.
+  """
+  def __init__(self, bounds):
+    self.histogram = Histogram(bounds)
+    self.events = 0
+    self.current = None
+    self.current_count = 0
+    self.lock = threading.Lock()
+    self.start = time.monotonic()
+
+  def tick(self):
+    """Account a single event."""
+    second = int(time.monotonic())
+    with self.lock:
+      self.events += 1
+      if second != self.current:
+        if self.current is not None:
+          self.histogram.observe(self.current_count)
+        self.current = second
+        self.current_count = 0
+      self.current_count += 1
+
+  def summary(self):
+    """Return the overall rate and the histogram in a plain dict."""
+    elapsed = time.monotonic() - self.start
+    summary = self.histogram.summary()
+    summary['events'] = self.events
+    summary['rate'] = self.events / elapsed if elapsed > 0 else 0.0
+    return summary
+
+
+class MemoryMonitor():
+  """Context manager measuring the peak memory used while in context.
+
+  On CUDA devices this is the peak of memory allocated by torch. On CPU it is
+  the peak resident set size of the process (sampled by a background thread,
+  Linux only), above the level at the time of entering. The result, in bytes,
+  is available as "peak" after exiting.
+  """
+  def __init__(self, device=None, interval=0.001):
+    self.device = torch.device(device or 'cpu')
+    self.interval = interval
+    self.peak = None
+    self.baseline = 0
+    self.stop = threading.Event()
+    self.thread = None
+
+  def __enter__(self):
+    if self.device.type == 'cuda':
+      torch.cuda.synchronize(self.device)
+      torch.cuda.reset_peak_memory_stats(self.device)
+      self.baseline = torch.cuda.memory_allocated(self.device)
+    else:
+      self.baseline = resident_memory()
+      self.peak = self.baseline
+      self.stop.clear()
+      self.thread = threading.Thread(target=self.sample, daemon=True)
+      self.thread.start()
+    return self
+
+  def sample(self):
+    while not self.stop.wait(self.interval):
+      self.peak = max(self.peak, resident_memory())
+
+  def __exit__(self, *args):
+    if self.device.type == 'cuda':
+      torch.cuda.synchronize(self.device)
+      self.peak = torch.cuda.max_memory_allocated(self.device) - self.baseline
+    else:
+      self.stop.set()
+      self.thread.join()
+      self.peak = max(self.peak, resident_memory()) - self.baseline
+
+
+def resident_memory():
+  """Current resident set size of this process in bytes (0 if unknown)."""
+  try:
+    with open('/proc/self/statm', 'r') as file:
+      return int(file.read().split()[1]) * PAGE_SIZE
+  except (OSError, IndexError, ValueError):
+    return 0
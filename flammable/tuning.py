@@ -0,0 +1,182 @@
+import copy
+import os
+import time
+
+import torch
+
+from .timing import MemoryMonitor
+
+def rebuild_loader(loader, num_workers=0, prefetch_factor=2, pin_memory=False):
+  """Create a copy of a DataLoader with different performance settings.
+
+  Everything that defines the data (dataset, sampling, batching, collation) is
+  kept the same. Returns None if the given object is not a DataLoader.
+  """
+  if not isinstance(loader, torch.utils.data.DataLoader):
+    return None
+  kwargs = {
+    'collate_fn': loader.collate_fn,
+    'worker_init_fn': loader.worker_init_fn,
+    'num_workers': num_workers,
+    'pin_memory': pin_memory,
+  }
+  if loader.batch_size is None:
+    kwargs['batch_sampler'] = loader.batch_sampler
+  else:
+    kwargs['batch_size'] = loader.batch_size
+    kwargs['sampler'] = loader.sampler
+    kwargs['drop_last'] = loader.drop_last
+  if num_workers > 0:
+    kwargs['prefetch_factor'] = prefetch_factor
+    kwargs['persistent_workers'] = True
+  return torch.utils.data.DataLoader(loader.dataset, **kwargs)
+
+def batch_length(batch):
+  """Number of samples in a batch (tensor or tuple/list of tensors)."""
+  if isinstance(batch, (tuple, list)):
+    batch = batch[0]
+  return len(batch)
+
+def endless(loader):
+  """Iterate over the loader over and over again."""
+  while True:
+    empty = True
+    for batch in loader:
+      empty = False
+      yield batch
+    if empty:
+      raise RuntimeError("Cannot iterate over an empty loader!")
+
+def measure(function, loader, iterations, warmup=2):
+  """Run function over batches from the loader, timing data wait and compute.
+
+  The first "warmup" batches are not accounted (worker startup etc.). The loader
+  is restarted if it runs out before enough iterations have been made. Returns
+  a dict with samples per second, and the mean data wait and compute time per
+  iteration.
+  """
+  data_wait = 0.0
+  compute = 0.0
+  samples = 0
+  batches = endless(loader)
+  for i in range(warmup + iterations):
+    start = time.perf_counter()
+    batch = next(batches)
+    ready = time.perf_counter()
+    function(batch)
+    end = time.perf_counter()
+    if i >= warmup:
+      data_wait += ready - start
+      compute += end - ready
+      samples += batch_length(batch)
+  return {
+    'samples_per_second': samples / (data_wait + compute),
+    'data_wait': data_wait / iterations,
+    'compute': compute / iterations,
+  }
+
+def autotune_loader(task, loader, worker_counts=None, prefetch_factors=(2, 4), thread_counts=None, iterations=20):
+  """Search for loader and threading settings that maximize training speed.
+
+  Runs short calibration passes of "task.iteration" (which needs the model,
+  criterion and optimizer to be ready) for each candidate configuration. The
+  search goes one setting at a time: first the number of loader workers, then
+  the prefetch factor (for the best worker count) and finally the number of
+  intra-op threads. Model and optimizer state are restored afterwards, so the
+  calibration leaves no trace in the training. Returns the best configuration
+  and the list of all measurements.
+  """
+  cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+  if worker_counts is None:
+    worker_counts = sorted({0, 1, 2, 4, cores // 2, cores})
+  if thread_counts is None:
+    thread_counts = sorted({1, max(1, cores // 4), max(1, cores // 2), cores})
+  pin_memory = torch.device(task.device or 'cpu').type == 'cuda'
+  model_state = copy.deepcopy(task.model.state_dict())
+  optimizer_state = copy.deepcopy(task.optimizer.state_dict())
+  original_threads = torch.get_num_threads()
+  results = []
+  def run(config):
+    torch.set_num_threads(config['threads'])
+    candidate = rebuild_loader(
+      loader, config['num_workers'], config['prefetch_factor'], config['pin_memory']
+    )
+    result = dict(config, **measure(task.iteration, candidate, iterations))
+    results.append(result)
+    return result
+  best = lambda candidates: max(candidates, key=lambda r: r['samples_per_second'])
+  try:
+    config = {
+      'num_workers': 0,
+      'prefetch_factor': prefetch_factors[0],
+      'pin_memory': pin_memory,
+      'threads': original_threads,
+    }
+    config = best([run(dict(config, num_workers=count)) for count in worker_counts])
+    if config['num_workers'] > 0:
+      config = best([run(dict(config, prefetch_factor=factor)) for factor in prefetch_factors])
+    config = best([run(dict(config, threads=count)) for count in thread_counts])
+  finally:
+    task.model.load_state_dict(model_state)
+    task.optimizer.load_state_dict(optimizer_state)
+    torch.set_num_threads(original_threads)
+  config = {key: config[key] for key in ('num_workers', 'prefetch_factor', 'pin_memory', 'threads')}
+  return config, results
+
+def replicate_batch(batch, size, synthetic=False):
+  """Build a batch of a given size out of the first sample of another batch.
+
+  With "synthetic", floating point fields are filled with random values instead
+  (other fields, like integer labels, are still replicated).
+  """
+  fields = batch if isinstance(batch, (tuple, list)) else [batch]
+  new_fields = []
+  for field in fields:
+    field = field[:1].expand(size, *field.shape[1:]).contiguous()
+    if synthetic and field.is_floating_point():
+      field = torch.randn_like(field)
+    new_fields.append(field)
+  return type(batch)(new_fields) if isinstance(batch, (tuple, list)) else new_fields[0]
+
+# How allocation failures are reported by torch (CUDA, and CPU on Linux/Windows)
+OOM_MESSAGES = ('out of memory', "can't allocate memory", 'not enough memory')
+
+def is_out_of_memory(error):
+  """Check whether an exception means that the device (or host) ran out of memory."""
+  if isinstance(error, (MemoryError, torch.cuda.OutOfMemoryError)):
+    return True
+  return isinstance(error, RuntimeError) and any(message in str(error).lower() for message in OOM_MESSAGES)
+
+def probe_batch_sizes(step, batch, sizes, device=None, memory_limit=None, iterations=3, synthetic=False):
+  """Measure speed and memory of a step function over increasing batch sizes.
+
+  "step" is called "iterations" times (after one warmup call) with a batch of
+  each size, built from the given one (see replicate_batch). Probing stops at
+  the first size that runs out of memory or exceeds "memory_limit" (in bytes,
+  see timing.MemoryMonitor for what is measured). Returns a list of results for
+  each size that fit: batch size, samples per second and peak memory.
+  """
+  results = []
+  for size in sizes:
+    probe = replicate_batch(batch, size, synthetic)
+    try:
+      step(probe)
+      with MemoryMonitor(device) as monitor:
+        start = time.perf_counter()
+        for _ in range(iterations):
+          step(probe)
+        elapsed = time.perf_counter() - start
+    except (RuntimeError, MemoryError) as error:
+      if not is_out_of_memory(error):
+        raise
+      break
+    finally:
+      del probe
+    if memory_limit is not None and monitor.peak > memory_limit:
+      break
+    results.append({
+      'batch_size': size,
+      'samples_per_second': size * iterations / elapsed,
+      'peak_memory': monitor.peak,
+    })
+  return results
@@ -0,0 +1,59 @@
+"""Tests for activation checkpointing."""
+
+import copy
+import unittest
+
+import torch
+
+from flammable.activations import ActivationCheckpointing
+
+def make_model():
+  return torch.nn.Sequential(
+    torch.nn.Linear(8, 32),
+    torch.nn.BatchNorm1d(32),
+    torch.nn.ReLU(),
+    torch.nn.Linear(32, 32),
+    torch.nn.ReLU(),
+    torch.nn.Linear(32, 2),
+  )
+
+def gradients(model, inputs):
+  model.train()
+  model.zero_grad()
+  model(inputs).pow(2).sum().backward()
+  return {name: param.grad.clone() for name, param in model.named_parameters()}
+
+class TestCheckpointing(unittest.TestCase):
+  def setUp(self):
+    self.model = make_model()
+    self.inputs = torch.randn(16, 8)
+
+  def test_same_model(self):
+    """Checkpointing changes neither the parameters, nor the gradients."""
+    reference = copy.deepcopy(self.model)
+    keys = list(self.model.state_dict().keys())
+    checkpointing = ActivationCheckpointing(self.model, modules=['3'], every=2)
+    checkpointing.enable()
+    self.assertListEqual(list(self.model.state_dict().keys()), keys)
+    expected = gradients(reference, self.inputs)
+    actual = gradients(self.model, self.inputs)
+    for name, grad in expected.items():
+      self.assertTrue(torch.allclose(actual[name], grad, atol=1e-6), name)
+    self.assertGreater(checkpointing.reset_time(), 0.0)
+    checkpointing.disable()
+    self.assertFalse([module for module in self.model.modules() if 'forward' in module.__dict__])
+
+  def test_probe(self):
+    """Probing measures the memory saved, leaving the buffers as they were."""
+    buffers = {name: buffer.clone() for name, buffer in self.model.named_buffers()}
+    checkpointing = ActivationCheckpointing(self.model, every=3)
+    results = checkpointing.probe(lambda: gradients(self.model, self.inputs))
+    self.assertGreater(results['memory_saved'], 0)
+    for name, buffer in self.model.named_buffers():
+      self.assertTrue(torch.equal(buffer, buffers[name]), name)
+    # Left enabled
+    self.assertIn('forward', self.model.__dict__)
+
+
+if __name__ == '__main__':
+  unittest.main()
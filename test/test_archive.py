@@ -0,0 +1,121 @@
+"""Tests for moving Snapshots between Experiments as archives."""
+
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+
+import torch
+
+from flammable.blobstore import BlobStore, read_manifest
+from flammable.checkpoint import load_state, save_state
+from flammable.experiment import Experiment
+
+def make_experiment(temp_dir, name):
+  """Create an Experiment with a local repository holding one script."""
+  experiment = Experiment.new(os.path.join(temp_dir, name))
+  local_path = os.path.join(temp_dir, name + '-local')
+  os.mkdir(local_path)
+  script_path = os.path.join(local_path, 'task.py')
+  with open(script_path, 'w') as file:
+    file.write('print("task")\n')
+  experiment.link_local_repo(script_path)
+  return experiment
+
+def rewrite_archive(source, target, edit):
+  """Copy an archive, passing the contents of each file through "edit"."""
+  with tarfile.open(source, 'r') as reader, tarfile.open(target, 'w') as writer:
+    for member in reader:
+      data = edit(member.name, reader.extractfile(member).read())
+      member.size = len(data)
+      writer.addfile(member, io.BytesIO(data))
+
+class TestArchive(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.source = make_experiment(self.sandbox.name, 'source')
+    self.snapshot = self.source.make_snapshot('initial')
+    store = BlobStore(os.path.join(self.source.path, 'blobs'))
+    self.state = torch.nn.Linear(4, 2).state_dict()
+    for filename in ['model.pt', os.path.join('nested', 'model.pt')]:
+      path = self.snapshot.make_path(filename)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      save_state(self.state, path, 'blobs', store=store)
+      self.snapshot.register_model_file(filename)
+    self.archive_path = os.path.join(self.sandbox.name, 'snapshot.tar')
+    self.meta = self.source.pack(self.snapshot.uid, self.archive_path)
+    self.target = Experiment.new(os.path.join(self.sandbox.name, 'target'))
+    self.store = BlobStore(os.path.join(self.target.path, 'blobs'))
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def assertNothingUnpacked(self):
+    self.assertListEqual(os.listdir(self.target.snap_path), [])
+    self.assertDictEqual(self.store.load_refs(), {})
+    self.assertEqual(self.store.disk_usage(), 0)
+    refs = self.target.repo.git.for_each_ref('refs/snapshots')
+    self.assertEqual(refs, '')
+
+  def test_roundtrip(self):
+    snapshot = self.target.unpack(self.archive_path)
+    self.assertEqual(snapshot.uid, self.snapshot.uid)
+    self.assertListEqual(snapshot.model_files, ['model.pt', os.path.join('nested', 'model.pt')])
+    for filename in snapshot.model_files:
+      path = snapshot.make_path(filename)
+      manifest = read_manifest(path)
+      self.assertEqual(os.path.normpath(os.path.join(os.path.dirname(path), manifest['store'])), self.store.path)
+      state = load_state(path)
+      for name, tensor in self.state.items():
+        self.assertTrue(torch.equal(state[name], tensor))
+    # Both files refer to each blob
+    self.assertDictEqual(self.store.load_refs(), {key: 2 for key in self.meta['blobs']})
+
+  def test_store_rewritten(self):
+    """The store named by a manifest in the archive is not trusted."""
+    outside = os.path.join(self.sandbox.name, 'outside')
+    def edit(name, data):
+      if name == 'snapshot/model.pt':
+        manifest = json.loads(data)
+        manifest['store'] = os.path.relpath(outside, self.target.snap_path)
+        data = json.dumps(manifest).encode()
+      return data
+    tampered_path = os.path.join(self.sandbox.name, 'tampered.tar')
+    rewrite_archive(self.archive_path, tampered_path, edit)
+    snapshot = self.target.unpack(tampered_path)
+    manifest = read_manifest(snapshot.make_path('model.pt'))
+    self.assertEqual(manifest['store'], os.path.join('..', '..', 'blobs'))
+    self.assertFalse(os.path.exists(outside))
+
+  def test_unknown_blob(self):
+    """A manifest listing a blob not in the archive is rejected, undoing the unpacking."""
+    def edit(name, data):
+      if name == 'snapshot/nested/model.pt':
+        manifest = json.loads(data)
+        next(iter(manifest['tensors'].values()))['blob'] = 'f' * 64
+        data = json.dumps(manifest).encode()
+      return data
+    tampered_path = os.path.join(self.sandbox.name, 'tampered.tar')
+    rewrite_archive(self.archive_path, tampered_path, edit)
+    with self.assertRaises(RuntimeError):
+      self.target.unpack(tampered_path)
+    self.assertNothingUnpacked()
+
+  def test_missing_blob(self):
+    """A blob listed by the archive but not in it is rejected as well."""
+    tampered_path = os.path.join(self.sandbox.name, 'tampered.tar')
+    with tarfile.open(self.archive_path, 'r') as reader, tarfile.open(tampered_path, 'w') as writer:
+      for member in reader:
+        if member.name != 'blobs/' + self.meta['blobs'][0]:
+          writer.addfile(member, reader.extractfile(member))
+    with self.assertRaises(RuntimeError):
+      self.target.unpack(tampered_path)
+    self.assertNothingUnpacked()
+    # The archive is fine otherwise
+    self.target.unpack(self.archive_path)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+"""Tests for the deduplicated "blobs" model file format and its BlobStore."""
+
+import os
+import tempfile
+import unittest
+
+import torch
+
+from flammable.blobstore import BlobStore, release_manifest
+from flammable.checkpoint import load_state, save_state
+
+class TestBlobStore(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.store = BlobStore(os.path.join(self.sandbox.name, 'blobs'))
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def path(self, filename):
+    return os.path.join(self.sandbox.name, filename)
+
+  def test_dedupe(self):
+    """Identical data is stored once, with a reference per put."""
+    first = self.store.put(b'data')
+    keys = self.store.put_many([b'data', b'other', b'other'])
+    self.assertEqual(keys[0], first)
+    self.assertEqual(keys[1], keys[2])
+    self.assertDictEqual(self.store.load_refs(), {first: 2, keys[1]: 2})
+    self.assertEqual(self.store.disk_usage(), len(b'data') + len(b'other'))
+
+  def test_release(self):
+    """A blob is deleted with its last reference, and not any sooner."""
+    key = self.store.put(b'data')
+    self.store.put(b'data')
+    self.store.release([key])
+    self.assertTrue(os.path.isfile(self.store.blob_path(key)))
+    self.store.release([key])
+    self.assertFalse(os.path.isfile(self.store.blob_path(key)))
+    self.assertDictEqual(self.store.load_refs(), {})
+
+  def test_manifest_roundtrip(self):
+    state = {'weight': torch.randn(3, 4), 'bias': torch.zeros(3), 'steps': torch.tensor(5)}
+    save_state(state, self.path('model.pt'), 'blobs', self.store)
+    loaded = load_state(self.path('model.pt'))
+    self.assertListEqual(list(loaded.keys()), list(state.keys()))
+    for name, tensor in state.items():
+      self.assertTrue(torch.equal(loaded[name], tensor))
+
+  def test_shared_blobs(self):
+    """Files sharing tensors share blobs, which outlive either one of them."""
+    shared = torch.randn(8)
+    save_state({'a': shared, 'b': torch.randn(8)}, self.path('one.pt'), 'blobs', self.store)
+    save_state({'a': shared, 'b': torch.randn(8)}, self.path('two.pt'), 'blobs', self.store)
+    self.assertEqual(len(self.store.load_refs()), 3)
+    release_manifest(self.path('one.pt'))
+    os.remove(self.path('one.pt'))
+    self.assertEqual(len(self.store.load_refs()), 2)
+    self.assertTrue(torch.equal(load_state(self.path('two.pt'))['a'], shared))
+    release_manifest(self.path('two.pt'))
+    self.assertEqual(self.store.disk_usage(), 0)
+
+  def test_overwrite(self):
+    """Overwriting a manifest releases the blobs only it referred to."""
+    kept = torch.randn(8)
+    save_state({'a': kept, 'b': torch.randn(8)}, self.path('model.pt'), 'blobs', self.store)
+    save_state({'a': kept, 'b': torch.randn(8)}, self.path('model.pt'), 'blobs', self.store)
+    self.assertListEqual(sorted(self.store.load_refs().values()), [1, 1])
+    # Rewriting identical contents keeps the counts as they are
+    state = load_state(self.path('model.pt'))
+    save_state({k: v.clone() for k, v in state.items()}, self.path('model.pt'), 'blobs', self.store)
+    self.assertListEqual(sorted(self.store.load_refs().values()), [1, 1])
+
+  def test_overwrite_other_format(self):
+    """Overwriting a manifest with another format releases all of its blobs."""
+    for fmt in ['torch', 'mmap']:
+      save_state({'a': torch.randn(8)}, self.path('model.pt'), 'blobs', self.store)
+      save_state({'a': torch.randn(8)}, self.path('model.pt'), fmt)
+      self.assertDictEqual(self.store.load_refs(), {})
+      self.assertEqual(self.store.disk_usage(), 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
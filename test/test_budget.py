@@ -0,0 +1,118 @@
+"""Tests for stopping training early: on a compute budget, or a metric plateau."""
+
+import os
+import tempfile
+import unittest
+
+import torch
+
+import flammable
+from flammable.budget import EarlyStopping
+from flammable.snapshot import Snapshot
+
+class BudgetTask(flammable.Task):
+  """5 iterations of 4 samples per epoch, with the given validation losses."""
+  def __init__(self, val_losses=None):
+    super(BudgetTask, self).__init__(torch.nn.Linear(4, 2))
+    self.device = 'cpu'
+    self.epochs = 3
+    self.val_losses = val_losses
+
+  def get_training_data(self):
+    dataset = torch.utils.data.TensorDataset(torch.randn(20, 4), torch.randint(0, 2, (20,)))
+    return torch.utils.data.DataLoader(dataset, batch_size=4)
+
+  def get_criterion(self):
+    return torch.nn.CrossEntropyLoss()
+
+  def get_optimizer(self):
+    return torch.optim.SGD(self.model.parameters(), lr=0.01)
+
+  def epoch(self, dataset):
+    super(BudgetTask, self).epoch(dataset)
+    if self.val_losses:
+      self.log_validation({'loss': self.val_losses[self.epoch_i]})
+
+
+class TestBudget(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def train(self, task):
+    task.snapshot = Snapshot.create(self.sandbox.name, 'budget', None, None, None, None)
+    task.train()
+    snapshot = Snapshot(self.sandbox.name)
+    self.assertListEqual(snapshot.model_files, ['final.pt'])
+    self.assertTrue(os.path.isfile(snapshot.make_path('final.pt')))
+    return snapshot
+
+  def test_completed(self):
+    snapshot = self.train(BudgetTask())
+    stop = snapshot.custom_data['stop']
+    self.assertEqual(stop['reason'], 'completed')
+    self.assertEqual((stop['epoch_i'], stop['iter_i'], stop['iterations']), (2, 4, 15))
+
+  def test_max_iterations(self):
+    """The limit is checked after every iteration, stopping mid-epoch."""
+    task = BudgetTask()
+    task.max_iterations = 7
+    snapshot = self.train(task)
+    stop = snapshot.custom_data['stop']
+    self.assertEqual(stop['reason'], 'max_iterations')
+    self.assertEqual((stop['epoch_i'], stop['iter_i'], stop['iterations']), (1, 1, 7))
+    self.assertIsNone(stop['samples'])
+    # The partial epoch is logged as well
+    self.assertListEqual(snapshot.train_data['epoch_i'], [0, 1])
+
+  def test_max_samples(self):
+    task = BudgetTask()
+    task.max_samples = 10
+    stop = self.train(task).custom_data['stop']
+    self.assertEqual(stop['reason'], 'max_samples')
+    self.assertEqual((stop['epoch_i'], stop['iter_i'], stop['samples']), (0, 2, 12))
+
+  def test_max_time(self):
+    task = BudgetTask()
+    task.max_time = 0
+    stop = self.train(task).custom_data['stop']
+    self.assertEqual(stop['reason'], 'max_time')
+    self.assertEqual(stop['iterations'], 1)
+
+  def test_early_stopping(self):
+    """Improvements smaller than min_delta do not count, "patience" in a row stop."""
+    task = BudgetTask([1.0, 0.95, 0.5, 0.45, 0.48, 0.1, 0.1])
+    task.epochs = 7
+    task.early_stopping = EarlyStopping('loss', patience=2, min_delta=0.1)
+    stop = self.train(task).custom_data['stop']
+    self.assertEqual(stop['reason'], 'early_stopping')
+    self.assertEqual((stop['epoch_i'], stop['iter_i']), (4, 4))
+    self.assertDictEqual(stop['early_stopping'], {'metric': 'loss', 'best': 0.5, 'best_epoch_i': 2})
+
+
+class TestEarlyStopping(unittest.TestCase):
+  def test_max(self):
+    stopping = EarlyStopping('accuracy', patience=1, mode='max')
+    val_data = {'accuracy': [0.5, 0.7], 'epoch_i': [0, 1]}
+    self.assertFalse(stopping.update(val_data))
+    # Results are taken in incrementally, an equal value is no improvement
+    val_data['accuracy'].append(0.7)
+    val_data['epoch_i'].append(2)
+    self.assertTrue(stopping.update(val_data))
+    self.assertDictEqual(stopping.summary(val_data), {'metric': 'accuracy', 'best': 0.7, 'best_epoch_i': 1})
+
+  def test_reset(self):
+    stopping = EarlyStopping('loss', patience=1)
+    self.assertTrue(stopping.update({'loss': [1.0, 2.0]}))
+    stopping.reset()
+    self.assertFalse(stopping.update({'loss': [3.0]}))
+
+  def test_mode(self):
+    with self.assertRaises(ValueError):
+      EarlyStopping('loss', mode='lowest')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,180 @@
+"""Tests for fingerprinting of data, and skipping tests of unchanged data."""
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+import torch
+
+import flammable
+from flammable.cache import SampleCache, fingerprint_loader
+from flammable.snapshot import Snapshot
+
+class FileDataset(torch.utils.data.Dataset):
+  """Samples loaded from a single tensor file."""
+  def __init__(self, path):
+    self.path = pathlib.Path(path)
+    self.data = torch.load(self.path)
+
+  def __len__(self):
+    return len(self.data)
+
+  def __getitem__(self, index):
+    return self.data[index], self.data[index].sum()
+
+
+class FileTask(flammable.Task):
+  def __init__(self, data_path):
+    super(FileTask, self).__init__(torch.nn.Linear(4, 1))
+    self.device = 'cpu'
+    self.data_path = data_path
+    self.tests = 0
+
+  def get_testing_data(self):
+    dataset = torch.utils.data.Subset(FileDataset(self.data_path), range(6))
+    return torch.utils.data.DataLoader(dataset, batch_size=2)
+
+  def get_metric(self):
+    self.tests += 1
+    return torch.nn.MSELoss()
+
+
+class TestFingerprint(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.data_path = os.path.join(self.sandbox.name, 'data.pt')
+    self.write_data(8)
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def write_data(self, samples):
+    torch.save(torch.randn(samples, 4), self.data_path)
+
+  def test_no_files(self):
+    """Data not backed by any files has no fingerprint."""
+    dataset = torch.utils.data.TensorDataset(torch.randn(8, 4))
+    self.assertIsNone(fingerprint_loader(torch.utils.data.DataLoader(dataset)))
+
+  def test_wrapped(self):
+    """Files of wrapped datasets (given as PathLike) are found."""
+    def fingerprint():
+      dataset = torch.utils.data.ConcatDataset([
+        torch.utils.data.Subset(FileDataset(self.data_path), [0, 1]),
+        torch.utils.data.TensorDataset(torch.randn(2, 4)),
+      ])
+      return fingerprint_loader(torch.utils.data.DataLoader(dataset))
+    before = fingerprint()
+    self.assertIsNotNone(before)
+    self.assertEqual(fingerprint(), before)
+    self.write_data(9)
+    self.assertNotEqual(fingerprint(), before)
+
+  def test_retest_changed_data(self):
+    """A test is skipped while the data is the same, and rerun once it changes."""
+    task = FileTask(self.data_path)
+    root_path = os.path.join(self.sandbox.name, 'snapshot')
+    os.mkdir(root_path)
+    task.snapshot = Snapshot.create(root_path, 'test', None, None, None, None)
+    task.save_model('model.pt')
+    task.test()
+    task.test()
+    self.assertEqual(task.tests, 1)
+    self.write_data(9)
+    task.test()
+    self.assertEqual(task.tests, 2)
+
+  def test_many_clears_fingerprint(self):
+    """Results of "test_many", on another Task's data, are not skipped over."""
+    task = FileTask(self.data_path)
+    root_path = os.path.join(self.sandbox.name, 'snapshot')
+    os.mkdir(root_path)
+    task.snapshot = Snapshot.create(root_path, 'test', None, None, None, None)
+    task.save_model('model.pt')
+    task.test()
+    own_loss = task.snapshot.test_data['loss']
+    other_path = os.path.join(self.sandbox.name, 'other.pt')
+    torch.save(torch.randn(8, 4) * 100, other_path)
+    other = FileTask(other_path)
+    results = other.test_many([task])
+    snapshot = Snapshot(root_path)
+    self.assertEqual(snapshot.test_data['loss'], results[0]['loss'])
+    self.assertDictEqual(snapshot.test_data['model_files'], {'model.pt': results[0]})
+    self.assertIsNone(snapshot.test_data['fingerprint'])
+    task.test()
+    self.assertEqual(task.tests, 2)
+    self.assertEqual(task.snapshot.test_data['loss'], own_loss)
+
+
+class TestSampleCache(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.path = os.path.join(self.sandbox.name, 'cache')
+    self.dataset = torch.utils.data.TensorDataset(torch.randn(10, 3), torch.arange(10))
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def assertSameBatches(self, replayed, recorded):
+    self.assertEqual(len(replayed), len(recorded))
+    for replayed_batch, recorded_batch in zip(replayed, recorded):
+      for replayed_field, recorded_field in zip(replayed_batch, recorded_batch):
+        self.assertTrue(torch.equal(replayed_field, recorded_field))
+
+  def test_record_replay(self):
+    """The first pass is recorded and sealed, later ones replay it."""
+    cache = SampleCache(torch.utils.data.DataLoader(self.dataset, batch_size=4), self.path)
+    self.assertFalse(cache.is_complete())
+    recorded = list(cache)
+    self.assertTrue(cache.is_complete())
+    self.assertListEqual(os.listdir(self.sandbox.name), ['cache'])
+    # Not shuffled, as the loader is not - the same batches exactly
+    self.assertSameBatches(list(cache), recorded)
+    self.assertListEqual([len(batch[0]) for batch in cache], [4, 4, 2])
+
+  def test_shuffled_replay(self):
+    loader = torch.utils.data.DataLoader(self.dataset, batch_size=4, shuffle=True)
+    cache = SampleCache(loader, self.path)
+    list(cache)
+    labels = torch.cat([labels for _, labels in cache])
+    self.assertListEqual(sorted(labels.tolist()), list(range(10)))
+
+  def test_drop_last(self):
+    """Replays drop the last batch like the loader, also given a batch sampler."""
+    sampler = torch.utils.data.BatchSampler(
+      torch.utils.data.SequentialSampler(self.dataset), batch_size=3, drop_last=True
+    )
+    cache = SampleCache(torch.utils.data.DataLoader(self.dataset, batch_sampler=sampler), self.path)
+    recorded = list(cache)
+    self.assertSameBatches(list(cache), recorded)
+    self.assertListEqual([len(batch[0]) for batch in cache], [3, 3, 3])
+
+  def test_interrupted(self):
+    """An incomplete first pass leaves nothing behind, the next one records again."""
+    cache = SampleCache(torch.utils.data.DataLoader(self.dataset, batch_size=4), self.path)
+    for _ in cache:
+      break
+    self.assertFalse(cache.is_complete())
+    self.assertListEqual(os.listdir(self.sandbox.name), [])
+    iterator = iter(cache)
+    next(iterator)
+    del iterator
+    self.assertListEqual(os.listdir(self.sandbox.name), [])
+    self.assertEqual(len(list(cache)), 3)
+    self.assertTrue(cache.is_complete())
+
+  def test_not_cacheable(self):
+    """Batches that cannot be cached are passed through as they are."""
+    dataset = [{'data': torch.randn(3)} for _ in range(4)]
+    cache = SampleCache(torch.utils.data.DataLoader(dataset, batch_size=2), self.path)
+    for _ in range(2):
+      batches = list(cache)
+      self.assertEqual(len(batches), 2)
+      self.assertIsInstance(batches[0], dict)
+    self.assertFalse(cache.is_complete())
+    self.assertListEqual(os.listdir(self.sandbox.name), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,151 @@
+"""Tests for the model file formats."""
+
+import os
+import tempfile
+import unittest
+
+import torch
+
+from flammable.checkpoint import COMPRESSIONS, load_state, remap_state, save_state
+
+def make_state():
+  return {
+    'encoder.weight': torch.randn(8, 4),
+    'encoder.bias': torch.randn(8),
+    'head.weight': torch.randn(2, 8),
+    'steps': torch.tensor(7),
+    'temperature': torch.tensor(0.5),
+    'empty': torch.zeros(0, 3),
+    'no_columns': torch.zeros(3, 0),
+  }
+
+class TestMmapFormat(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.path = os.path.join(self.sandbox.name, 'model.pt')
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def assertStateEqual(self, loaded, state):
+    self.assertListEqual(list(loaded.keys()), list(state.keys()))
+    for name, tensor in state.items():
+      self.assertEqual(loaded[name].dtype, tensor.dtype)
+      self.assertTrue(torch.equal(loaded[name], tensor), name)
+
+  def test_roundtrip(self):
+    state = make_state()
+    save_state(state, self.path, 'mmap')
+    self.assertStateEqual(load_state(self.path), state)
+
+  def test_prefix(self):
+    """A partial load returns only the entries under the prefix."""
+    state = make_state()
+    save_state(state, self.path, 'mmap')
+    loaded = load_state(self.path, prefix='encoder.')
+    self.assertStateEqual(loaded, {k: v for k, v in state.items() if k.startswith('encoder.')})
+
+  def test_overwrite_mapped(self):
+    """Saving over a file that is mapped (and assigned) does not affect readers."""
+    model = torch.nn.Linear(4, 2)
+    save_state(model.state_dict(), self.path, 'mmap')
+    reader = torch.nn.Linear(4, 2)
+    reader.load_state_dict(load_state(self.path), assign=True)
+    expected = {k: v.clone() for k, v in model.state_dict().items()}
+    for fmt in ['mmap', 'torch', 'mmap']:
+      with torch.no_grad():
+        model.weight.add_(1.0)
+      save_state(model.state_dict(), self.path, fmt)
+      # Touching the mapped parameters would crash (SIGBUS) if truncated
+      self.assertStateEqual(reader.state_dict(), expected)
+      self.assertStateEqual(load_state(self.path), model.state_dict())
+    self.assertListEqual(os.listdir(self.sandbox.name), ['model.pt'])
+
+
+class TestEncodings(unittest.TestCase):
+  """Reduced precision encodings and compression of the "mmap" format."""
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.path = os.path.join(self.sandbox.name, 'model.pt')
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def roundtrip(self, encoding, compression):
+    state = make_state()
+    save_state(state, self.path, 'mmap', encoding=encoding, compression=compression)
+    loaded = load_state(self.path)
+    self.assertListEqual(list(loaded.keys()), list(state.keys()))
+    for name, tensor in state.items():
+      self.assertEqual(loaded[name].dtype, tensor.dtype, name)
+      self.assertEqual(loaded[name].shape, tensor.shape, name)
+    return state, loaded
+
+  def check_close(self, encoding, relative):
+    for compression in COMPRESSIONS:
+      state, loaded = self.roundtrip(encoding, compression)
+      for name, tensor in state.items():
+        if tensor.is_floating_point() and tensor.numel():
+          tolerance = relative * tensor.abs().max().item()
+          self.assertLessEqual((loaded[name] - tensor).abs().max().item(), tolerance, name)
+        else:
+          self.assertTrue(torch.equal(loaded[name], tensor), name)
+
+  def test_raw(self):
+    for compression in COMPRESSIONS:
+      state, loaded = self.roundtrip(None, compression)
+      for name, tensor in state.items():
+        self.assertTrue(torch.equal(loaded[name], tensor), name)
+
+  def test_fp16(self):
+    self.check_close('fp16', 2 ** -10)
+
+  def test_bf16(self):
+    self.check_close('bf16', 2 ** -7)
+
+  def test_int8(self):
+    self.check_close('int8', 1 / 127)
+
+  def test_compressed_smaller(self):
+    state = {'zeros': torch.zeros(64, 64)}
+    save_state(state, self.path, 'mmap')
+    raw_size = os.path.getsize(self.path)
+    save_state(state, self.path, 'mmap', compression='zlib')
+    self.assertLess(os.path.getsize(self.path), raw_size / 10)
+    self.assertTrue(torch.equal(load_state(self.path)['zeros'], state['zeros']))
+
+
+class TestRemapState(unittest.TestCase):
+  def setUp(self):
+    self.state = make_state()
+
+  def test_unchanged(self):
+    remapped = remap_state(self.state)
+    self.assertListEqual(list(remapped.keys()), list(self.state.keys()))
+    for name, tensor in self.state.items():
+      self.assertIs(remapped[name], tensor)
+
+  def test_prefixes(self):
+    """Only the first matching prefix is replaced, and only at the start."""
+    remapped = remap_state(self.state, prefixes={'encoder.': 'backbone.', 'enc': 'x', 'weight': 'w'})
+    self.assertListEqual(list(remapped.keys()), [
+      'backbone.weight', 'backbone.bias', 'head.weight', 'steps', 'temperature', 'empty', 'no_columns',
+    ])
+    self.assertIs(remapped['backbone.weight'], self.state['encoder.weight'])
+
+  def test_patterns(self):
+    """Patterns apply in turn, to the names with their prefixes already replaced."""
+    remapped = remap_state(
+      self.state,
+      prefixes={'head.': 'classifier.'},
+      patterns=[(r'^classifier\.', 'fc.'), (r'\.weight$', '.w'), (r'^fc\.w$', 'output.w')],
+    )
+    self.assertIn('output.w', remapped)
+    self.assertIn('encoder.w', remapped)
+    self.assertIn('encoder.bias', remapped)
+    self.assertIs(remapped['output.w'], self.state['head.weight'])
+    self.assertEqual(len(remapped), len(self.state))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,91 @@
+"""Tests for ensembles of models, checked against running each model in turn."""
+
+import os
+import tempfile
+import unittest
+
+import torch
+
+import flammable
+from flammable.ensemble import EnsembleModule
+from flammable.snapshot import Snapshot
+
+def make_model():
+  model = torch.nn.Sequential(
+    torch.nn.Linear(4, 8),
+    torch.nn.BatchNorm1d(8),
+    torch.nn.ReLU(),
+    torch.nn.Linear(8, 3),
+  )
+  # Running statistics of its own, so that the buffers matter as well
+  model[1].running_mean.normal_()
+  model[1].running_var.uniform_(0.5, 2.0)
+  return model.eval()
+
+class TestEnsembleModule(unittest.TestCase):
+  def setUp(self):
+    self.models = [make_model() for _ in range(5)]
+    self.data = torch.randn(16, 4)
+    with torch.no_grad():
+      self.outputs = torch.stack([model(self.data) for model in self.models])
+
+  def ensemble_output(self, reduction):
+    with torch.no_grad():
+      return EnsembleModule(self.models, reduction)(self.data)
+
+  def test_mean(self):
+    output = self.ensemble_output('mean')
+    self.assertTrue(torch.allclose(output, self.outputs.mean(dim=0), atol=1e-6))
+
+  def test_vote(self):
+    output = self.ensemble_output('vote')
+    expected = self.outputs.argmax(dim=-1).mode(dim=0).values
+    self.assertTrue(torch.equal(output, expected))
+
+  def test_all(self):
+    output = self.ensemble_output('all')
+    self.assertEqual(output.shape, (16, 5, 3))
+    for i, model_output in enumerate(self.outputs):
+      self.assertTrue(torch.allclose(output[:, i], model_output, atol=1e-6))
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      EnsembleModule(self.models, 'median')
+    with self.assertRaises(ValueError):
+      EnsembleModule([])
+    with self.assertRaises(ValueError):
+      EnsembleModule([self.models[0], torch.nn.Linear(4, 3)])
+
+
+class TestTaskEnsemble(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def make_task(self, name):
+    task = flammable.Task(make_model())
+    task.device = 'cpu'
+    root_path = os.path.join(self.sandbox.name, name)
+    os.mkdir(root_path)
+    task.snapshot = Snapshot.create(root_path, name, None, None, None, None)
+    task.save_model('model.pt')
+    return task
+
+  def test_eval_batch(self):
+    """A Task's ensemble evaluates like the mean of its members, the Task is intact."""
+    tasks = [self.make_task('member{}'.format(i)) for i in range(3)]
+    main = self.make_task('main')
+    main_model = main.model
+    ensemble = main.ensemble(tasks)
+    self.assertIs(main.model, main_model)
+    samples = [torch.randn(4) for _ in range(6)]
+    results = ensemble.eval_batch(samples)
+    with torch.no_grad():
+      expected = torch.stack([task.model(torch.stack(samples)) for task in tasks]).mean(dim=0)
+    self.assertTrue(torch.allclose(torch.stack(results), expected, atol=1e-6))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,74 @@
+"""Tests for exported models, and their use for evaluation."""
+
+import os
+import tempfile
+import unittest
+
+import torch
+
+import flammable
+from flammable.snapshot import Snapshot
+
+class ExportTask(flammable.Task):
+  def __init__(self):
+    super(ExportTask, self).__init__(torch.nn.Linear(4, 2))
+    self.device = 'cpu'
+
+  def get_testing_data(self):
+    dataset = torch.utils.data.TensorDataset(torch.randn(16, 4), torch.randn(16, 2))
+    return torch.utils.data.DataLoader(dataset, batch_size=8)
+
+  def get_metric(self):
+    return torch.nn.MSELoss()
+
+
+class TestExport(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.task = ExportTask()
+    self.task.snapshot = Snapshot.create(self.sandbox.name, 'export', None, None, None, None)
+    self.task.save_model('model.pt')
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def test_export(self):
+    artifact = self.task.export()
+    self.assertEqual(artifact['source'], 'model.pt')
+    path = self.task.snapshot.fetch_artifact('export')['path']
+    self.assertTrue(os.path.isfile(path))
+    self.assertSetEqual(set(artifact['drift'].keys()), {'loss'})
+    self.assertTrue(self.task.export_is_current(artifact))
+
+  def test_float_by_default(self):
+    """Unless asked to, evaluation ignores the export, so any input still works."""
+    self.task.export()
+    self.task.load_eval_model()
+    self.assertNotIsInstance(self.task.model, torch.jit.ScriptModule)
+    sample = torch.randn(4)  # not shaped like the traced example
+    with torch.no_grad():
+      self.assertTrue(torch.equal(self.task.eval(sample), self.task.model(sample)))
+
+  def test_use_export(self):
+    self.task.export()
+    self.task.use_export = True
+    float_model = self.task.model
+    self.task.load_eval_model()
+    self.assertIsInstance(self.task.model, torch.jit.ScriptModule)
+    samples = [torch.randn(4) for _ in range(8)]
+    results = self.task.eval_batch(samples)
+    with torch.no_grad():
+      expected = float_model(torch.stack(samples))
+    self.assertTrue(torch.allclose(torch.stack(results), expected, atol=0.1))
+    # Once the model is saved again (changed), the export is out of date
+    self.task.load_model()
+    self.assertIs(self.task.model, float_model)
+    with torch.no_grad():
+      float_model.weight.add_(1.0)
+    self.task.save_model('model.pt')
+    self.task.load_eval_model()
+    self.assertIs(self.task.model, float_model)
+
+
+if __name__ == '__main__':
+  unittest.main()
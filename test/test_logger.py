@@ -0,0 +1,111 @@
+"""Tests for flushing metrics within an epoch, to the Snapshot's iter_data."""
+
+import tempfile
+import time
+import unittest
+
+import torch
+
+import flammable
+from flammable.logger import Logger, Throttle
+from flammable.snapshot import Snapshot
+
+class FlushingTask(flammable.Task):
+  """5 iterations of 4 samples per epoch."""
+  def __init__(self):
+    super(FlushingTask, self).__init__(torch.nn.Linear(4, 2))
+    self.device = 'cpu'
+    self.epochs = 2
+
+  def get_training_data(self):
+    dataset = torch.utils.data.TensorDataset(torch.randn(20, 4), torch.randint(0, 2, (20,)))
+    return torch.utils.data.DataLoader(dataset, batch_size=4)
+
+  def get_criterion(self):
+    return torch.nn.CrossEntropyLoss()
+
+  def get_optimizer(self):
+    return torch.optim.SGD(self.model.parameters(), lr=0.01)
+
+
+class TestThrottle(unittest.TestCase):
+  def test_every_n(self):
+    throttle = Throttle(every_n=3)
+    self.assertListEqual([throttle.ready() for _ in range(7)], [False, False, True] * 2 + [False])
+
+  def test_every_t(self):
+    throttle = Throttle(every_t=0.05)
+    self.assertFalse(throttle.ready())
+    time.sleep(0.06)
+    self.assertTrue(throttle.ready())
+    self.assertFalse(throttle.ready())
+
+  def test_disabled(self):
+    throttle = Throttle()
+    self.assertFalse(any(throttle.ready() for _ in range(100)))
+
+
+class TestProgress(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.snapshot = Snapshot.create(self.sandbox.name, 'progress', None, None, None, None)
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def test_windows(self):
+    """Each flush aggregates only the values logged since the previous one."""
+    logger = Logger('average')
+    logger.log({'loss': 1.0})
+    logger.log({'loss': 3.0})
+    logger.store_progress(self.snapshot, epoch_i=0, iter_i=1)
+    logger.log({'loss': 5.0})
+    logger.store_progress(self.snapshot, epoch_i=0, iter_i=2)
+    self.assertDictEqual(Snapshot(self.sandbox.name).iter_data, {
+      'loss': [2.0, 5.0], 'epoch_i': [0, 0], 'iter_i': [1, 2],
+    })
+    # The epoch summary still covers all of the values
+    logger.store_train(self.snapshot, epoch_i=0)
+    self.assertListEqual(Snapshot(self.sandbox.name).train_data['loss'], [3.0])
+
+  def test_aligned(self):
+    """Names missing from a window are padded with None, so all lists align."""
+    logger = Logger('average')
+    logger.log({'loss': 1.0})
+    logger.store_progress(self.snapshot, epoch_i=0, iter_i=0)
+    logger.store_progress(self.snapshot, epoch_i=0, iter_i=1)
+    logger.log({'loss': 2.0, 'accuracy': 0.5})
+    logger.store_progress(self.snapshot, epoch_i=0, iter_i=2, lr=0.1)
+    self.assertDictEqual(Snapshot(self.sandbox.name).iter_data, {
+      'loss': [1.0, None, 2.0],
+      'accuracy': [None, None, 0.5],
+      'lr': [None, None, 0.1],
+      'epoch_i': [0, 0, 0],
+      'iter_i': [0, 1, 2],
+    })
+
+  def test_new_epoch(self):
+    """Flushes of the previous epochs are dropped."""
+    for epoch_i in range(3):
+      logger = Logger('average')
+      for iter_i in range(4):
+        logger.log({'loss': float(epoch_i)})
+        logger.store_progress(self.snapshot, epoch_i=epoch_i, iter_i=iter_i)
+    self.assertDictEqual(Snapshot(self.sandbox.name).iter_data, {
+      'loss': [2.0] * 4, 'epoch_i': [2] * 4, 'iter_i': [0, 1, 2, 3],
+    })
+
+  def test_training(self):
+    task = FlushingTask()
+    task.snapshot = self.snapshot
+    task.flush_every = 2
+    task.train()
+    snapshot = Snapshot(self.sandbox.name)
+    self.assertListEqual(snapshot.iter_data['epoch_i'], [1, 1])
+    self.assertListEqual(snapshot.iter_data['iter_i'], [1, 3])
+    self.assertEqual(len(snapshot.iter_data['loss']), 2)
+    self.assertListEqual(snapshot.train_data['epoch_i'], [0, 1])
+
+
+if __name__ == '__main__':
+  unittest.main()
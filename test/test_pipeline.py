@@ -0,0 +1,178 @@
+"""Tests for the building blocks of batch evaluation."""
+
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+
+import torch
+
+import flammable
+from flammable.pipeline import batched, bounded_map, find_inputs
+
+class TestBoundedMap(unittest.TestCase):
+  def test_order(self):
+    """Results come in the order of the inputs, however long each call takes."""
+    def slow_square(x):
+      time.sleep(random.random() * 0.01)
+      return x * x
+    self.assertListEqual(list(bounded_map(slow_square, range(50), 4)), [x * x for x in range(50)])
+
+  def test_bounded(self):
+    """The input is consumed at most "depth" items ahead of the output."""
+    consumed = []
+    running = [0, 0]  # now, most at once
+    lock = threading.Lock()
+    def source():
+      for i in range(40):
+        consumed.append(i)
+        yield i
+    def work(x):
+      with lock:
+        running[0] += 1
+        running[1] = max(running)
+      time.sleep(0.002)
+      with lock:
+        running[0] -= 1
+      return x
+    for i, result in enumerate(bounded_map(work, source(), 2, depth=3)):
+      self.assertEqual(result, i)
+      self.assertLessEqual(len(consumed), i + 3)
+      time.sleep(0.002)  # slow consumer
+    self.assertLessEqual(running[1], 2)
+
+  def test_batched(self):
+    self.assertListEqual(list(batched(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+    self.assertListEqual(list(batched([], 3)), [])
+    self.assertListEqual(list(batched(range(7), 3, timeout=1.0)), [[0, 1, 2], [3, 4, 5], [6]])
+    self.assertListEqual(list(batched([], 3, timeout=0)), [])
+
+  def test_batched_timeout(self):
+    """With a timeout, items of a slow input are not held back until a batch fills."""
+    def slow():
+      for i in range(4):
+        time.sleep(0.05)
+        yield i
+    self.assertListEqual(list(batched(slow(), 4, timeout=0.001)), [[0], [1], [2], [3]])
+    self.assertListEqual(list(batched(slow(), 4)), [[0, 1, 2, 3]])
+
+  def test_batched_error(self):
+    """Errors of the input are raised after the items read before them."""
+    def failing():
+      yield 1
+      yield 2
+      raise ValueError("input failed")
+    batches = batched(failing(), 4, timeout=0.5)
+    self.assertListEqual(next(batches), [1, 2])
+    with self.assertRaises(ValueError):
+      next(batches)
+
+
+class TestEvalStream(unittest.TestCase):
+  def setUp(self):
+    self.task = flammable.Task(torch.nn.Linear(4, 2))
+    self.task.device = 'cpu'
+    self.task.eval_batch_size = 4
+    self.task.model.eval()
+
+  def expected(self, sample):
+    with torch.no_grad():
+      return self.task.model(sample)
+
+  def test_order(self):
+    samples = [torch.randn(4) for _ in range(10)]
+    results = list(self.task.eval_stream(samples, workers=3))
+    self.assertEqual(len(results), 10)
+    for sample, result in zip(samples, results):
+      self.assertTrue(torch.allclose(result, self.expected(sample)))
+
+  def test_interactive(self):
+    """An input waiting for the result of its last sample is not deadlocked."""
+    results = []
+    def requests():
+      for i in range(6):
+        yield torch.full((4,), float(i))
+        while len(results) <= i:
+          time.sleep(0.001)
+    def run():
+      for result in self.task.eval_stream(requests()):
+        results.append(result)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(10)
+    self.assertFalse(thread.is_alive())
+    self.assertEqual(len(results), 6)
+    self.assertTrue(torch.allclose(results[5], self.expected(torch.full((4,), 5.0))))
+
+  def test_bounded(self):
+    """An endless input is only read a few batches ahead of the results."""
+    consumed = [0]
+    def endless():
+      while True:
+        consumed[0] += 1
+        yield torch.randn(4)
+    stream = self.task.eval_stream(endless())
+    for i, _ in enumerate(stream):
+      self.assertLessEqual(consumed[0], i + 1 + 4 * self.task.eval_batch_size)
+      if i == 50:
+        break
+    stream.close()
+
+
+class TestFindInputs(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.data = os.path.join(self.sandbox.name, 'data')
+    for folder, name in [('a', 'x.pt'), ('a', 'y.pt'), ('b', 'x.pt')]:
+      os.makedirs(os.path.join(self.data, folder), exist_ok=True)
+      with open(os.path.join(self.data, folder, name), 'w') as file:
+        file.write(folder + name)
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def input(self, *parts):
+    return os.path.join(self.data, *parts)
+
+  def test_directory(self):
+    pairs = find_inputs(self.input('a'), 'out')
+    self.assertListEqual(pairs, [
+      (self.input('a', 'x.pt'), os.path.join('out', 'x.pt')),
+      (self.input('a', 'y.pt'), os.path.join('out', 'y.pt')),
+    ])
+
+  def test_manifest(self):
+    manifest = os.path.join(self.data, 'inputs.txt')
+    with open(manifest, 'w') as file:
+      file.write('# comment\n\na/x.pt\tfirst.pt\nb/x.pt\n')
+    pairs = find_inputs(manifest, 'out')
+    self.assertListEqual(pairs, [
+      (self.input('a', 'x.pt'), os.path.join('out', 'first.pt')),
+      (self.input('b', 'x.pt'), os.path.join('out', 'x.pt')),
+    ])
+    # Without the explicit output, both inputs would be written to x.pt
+    with open(manifest, 'w') as file:
+      file.write('a/x.pt\nb/x.pt\n')
+    with self.assertRaises(RuntimeError):
+      find_inputs(manifest, 'out')
+
+  def test_glob(self):
+    """Outputs of a glob keep the paths of their inputs, so they do not collide."""
+    pairs = find_inputs(os.path.join(self.data, '*', 'x.pt'), 'out')
+    self.assertListEqual(pairs, [
+      (self.input('a', 'x.pt'), os.path.join('out', 'a', 'x.pt')),
+      (self.input('b', 'x.pt'), os.path.join('out', 'b', 'x.pt')),
+    ])
+    pairs = find_inputs(os.path.join(self.data, 'a', '*.pt'), 'out')
+    self.assertListEqual([output for _, output in pairs], [os.path.join('out', 'x.pt'), os.path.join('out', 'y.pt')])
+
+  def test_no_output_dir(self):
+    task = flammable.Task(torch.nn.Linear(4, 1))
+    with self.assertRaises(ValueError):
+      task.eval_many(self.input('a'), None)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,119 @@
+"""Tests for the pool of resident models of many Snapshots."""
+
+import threading
+import time
+import types
+import unittest
+
+import torch
+
+from flammable.pool import ModelPool
+
+class FakeTask():
+  """What the pool needs of an imported Task."""
+  def __init__(self):
+    self.model = torch.nn.Linear(4, 1)  # 20 bytes
+    self.device = 'cpu'
+
+  def load_eval_model(self):
+    pass
+
+
+class FakeExperiment():
+  """Experiment of the given Snapshot names (their IDs are the same, upper case).
+
+  Imports of the Snapshots named in "blocked" wait until released, and those
+  in "broken" fail.
+  """
+  def __init__(self, names):
+    self.snapshot_names = names
+    self.imports = []
+    self.started = threading.Event()
+    self.release = threading.Event()
+    self.blocked = set()
+    self.broken = set()
+
+  def get_snapshot(self, name_or_id):
+    if name_or_id.lower() not in self.snapshot_names:
+      return None
+    return types.SimpleNamespace(uid=name_or_id.upper(), fetch_last_model_file=lambda: None)
+
+  def import_snapshot(self, snapshot):
+    self.imports.append(snapshot.uid)
+    if snapshot.uid.lower() in self.blocked:
+      self.started.set()
+      self.release.wait(10)
+    if snapshot.uid.lower() in self.broken:
+      raise RuntimeError("Broken Snapshot")
+    return FakeTask()
+
+
+class TestModelPool(unittest.TestCase):
+  def setUp(self):
+    self.experiment = FakeExperiment(['a', 'b', 'c'])
+
+  def test_resident(self):
+    pool = ModelPool(self.experiment)
+    task = pool.get('a')
+    self.assertIs(pool.get('A'), task)
+    self.assertListEqual(self.experiment.imports, ['A'])
+    self.assertEqual(pool.used_memory(), 20)
+    self.assertDictEqual(pool.load_locks, {})
+    with self.assertRaises(KeyError):
+      pool.get('missing')
+
+  def test_budget(self):
+    """The least recently used models are evicted to stay within the budget."""
+    pool = ModelPool(self.experiment, memory_budget=45)
+    first = pool.get('a')
+    pool.get('b')
+    self.assertIs(pool.get('a'), first)
+    pool.get('c')
+    self.assertListEqual(list(pool.tasks.keys()), ['A', 'C'])
+    self.assertLessEqual(pool.used_memory(), 45)
+
+  def test_evict(self):
+    pool = ModelPool(self.experiment)
+    pool.evict()  # nothing to evict yet
+    pool.get('a')
+    pool.get('b')
+    pool.evict('c')  # not resident
+    pool.evict('b')
+    self.assertListEqual(list(pool.tasks.keys()), ['A'])
+    pool.evict()
+    pool.evict()
+    self.assertListEqual(list(pool.tasks.keys()), [])
+    self.assertEqual(pool.used_memory(), 0)
+
+  def test_load_not_blocking(self):
+    """Resident models are served while another one is being loaded."""
+    pool = ModelPool(self.experiment)
+    resident = pool.get('a')
+    self.experiment.blocked.add('b')
+    loaders = [threading.Thread(target=pool.get, args=('b',)) for _ in range(3)]
+    for loader in loaders:
+      loader.start()
+    self.assertTrue(self.experiment.started.wait(10))
+    start = time.monotonic()
+    self.assertIs(pool.get('a'), resident)
+    self.assertLess(time.monotonic() - start, 1.0)
+    self.assertTrue(all(loader.is_alive() for loader in loaders))
+    self.experiment.release.set()
+    for loader in loaders:
+      loader.join()
+    # Loaded once for all the requests, and no locks left behind
+    self.assertListEqual(self.experiment.imports, ['A', 'B'])
+    self.assertDictEqual(pool.load_locks, {})
+
+  def test_failed_load(self):
+    pool = ModelPool(self.experiment)
+    self.experiment.broken.add('a')
+    for _ in range(2):
+      with self.assertRaises(RuntimeError):
+        pool.get('a')
+    self.assertDictEqual(pool.load_locks, {})
+    self.assertEqual(len(pool.tasks), 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
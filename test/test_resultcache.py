@@ -0,0 +1,53 @@
+"""Tests for the persistent evaluation result cache."""
+
+import os
+import tempfile
+import threading
+import unittest
+
+from flammable.resultcache import ResultCache
+
+class TestResultCache(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def test_concurrent_puts(self):
+    """Threads storing the same key at once (as the server does) all succeed."""
+    cache = ResultCache(self.sandbox.name, 'model', 2 ** 20)
+    key = cache.key(b'request')
+    errors = []
+    def put():
+      for _ in range(200):
+        try:
+          cache.put(key, b'response')
+        except Exception as error:
+          errors.append(error)
+    threads = [threading.Thread(target=put) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertListEqual(errors, [])
+    self.assertEqual(cache.get(key), b'response')
+    self.assertListEqual(os.listdir(self.sandbox.name), [key])
+
+  def test_eviction(self):
+    """The least recently used entries go first once the cache is full."""
+    cache = ResultCache(self.sandbox.name, 'model', 25)
+    keys = [cache.key(str(i).encode()) for i in range(3)]
+    cache.put(keys[0], b'0' * 10)
+    cache.put(keys[1], b'1' * 10)
+    os.utime(os.path.join(self.sandbox.name, keys[0]), (0, 0))
+    os.utime(os.path.join(self.sandbox.name, keys[1]), (1, 1))
+    self.assertEqual(cache.get(keys[0]), b'0' * 10)  # refreshes it
+    cache.put(keys[2], b'2' * 10)
+    self.assertIsNone(cache.get(keys[1]))
+    self.assertEqual(cache.get(keys[0]), b'0' * 10)
+    self.assertEqual(cache.stats()['entries'], 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
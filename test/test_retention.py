@@ -0,0 +1,109 @@
+"""Tests for retention policies, which delete model files of a Snapshot."""
+
+import os
+import tempfile
+import unittest
+
+import torch
+
+import flammable
+from flammable.checkpoint import load_state
+from flammable.retention import RetentionPolicy
+from flammable.snapshot import Snapshot
+
+class SavingTask(flammable.Task):
+  def __init__(self):
+    super(SavingTask, self).__init__(torch.nn.Linear(4, 2))
+
+  def save_epochs(self, losses, filename='epoch{}.pt'):
+    """Validate and save a model file for each epoch, with the given losses."""
+    for self.epoch_i, loss in enumerate(losses):
+      with self.snapshot.val_storage() as transaction:
+        transaction.append('loss', loss)
+        transaction.append('epoch_i', self.epoch_i)
+      self.save_model(filename.format(self.epoch_i))
+
+
+class TestRetention(unittest.TestCase):
+  def setUp(self):
+    # Same layout as in the library: <experiment>/snapshots/<snapshot>
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.experiment_path = os.path.join(self.sandbox.name, 'experiment')
+    root_path = os.path.join(self.experiment_path, 'snapshots', 'snapshot')
+    os.makedirs(root_path)
+    self.task = SavingTask()
+    self.task.snapshot = Snapshot.create(root_path, 'retention', None, None, None, None)
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def assertKept(self, filenames):
+    """Check the registry, its metadata and the files on disk all agree."""
+    snapshot = Snapshot(self.task.snapshot.root_path)
+    self.assertListEqual(snapshot.model_files, filenames)
+    self.assertSetEqual(set(snapshot.model_info.keys()), set(filenames))
+    on_disk = [name for name in os.listdir(snapshot.root_path) if name.endswith('.pt')]
+    self.assertCountEqual(on_disk, filenames)
+
+  def test_keep_last(self):
+    self.task.retention = RetentionPolicy(keep_last=2)
+    self.task.save_epochs([5, 4, 3, 2, 1])
+    self.assertKept(['epoch3.pt', 'epoch4.pt'])
+
+  def test_keep_best(self):
+    self.task.retention = RetentionPolicy(keep_best=2, metric='loss')
+    self.task.save_epochs([5, 1, 3, 2, 6])
+    self.assertKept(['epoch1.pt', 'epoch3.pt', 'epoch4.pt'])
+
+  def test_keep_best_max(self):
+    self.task.retention = RetentionPolicy(keep_best=1, metric='loss', mode='max')
+    self.task.save_epochs([5, 1, 9, 2, 6])
+    self.assertKept(['epoch2.pt', 'epoch4.pt'])
+
+  def test_keep_every(self):
+    self.task.retention = RetentionPolicy(keep_every=2)
+    self.task.save_epochs([5, 4, 3, 2, 1, 0])
+    self.assertKept(['epoch0.pt', 'epoch2.pt', 'epoch4.pt', 'epoch5.pt'])
+
+  def test_most_recent_kept(self):
+    """The last file is kept, even if no rule would keep it."""
+    self.task.retention = RetentionPolicy(keep_best=1, metric='loss')
+    self.task.save_epochs([1, 2, 3])
+    self.assertKept(['epoch0.pt', 'epoch2.pt'])
+    # Even without any validation to score it by
+    self.task.epoch_i = None
+    self.task.save_model('final.pt')
+    self.assertKept(['epoch0.pt', 'final.pt'])
+
+  def test_no_rules(self):
+    self.task.retention = RetentionPolicy()
+    self.task.save_epochs([3, 2, 1])
+    self.assertKept(['epoch0.pt', 'epoch1.pt', 'epoch2.pt'])
+
+  def test_rewrite(self):
+    """Rewriting a file makes it the most recent, and never deletes it."""
+    self.task.retention = RetentionPolicy(keep_last=1)
+    self.task.model_format = 'blobs'
+    for fmt in ['blobs', 'torch', 'blobs']:
+      self.task.save_epochs([3, 2, 1], filename='latest.pt')
+      self.assertKept(['latest.pt'])
+      self.task.save_model('other.pt')
+      self.assertKept(['other.pt'])
+      self.task.save_model('latest.pt', fmt=fmt)
+      self.assertKept(['latest.pt'])
+      state = load_state(self.task.snapshot.make_path('latest.pt'))
+      for name, tensor in self.task.model.state_dict().items():
+        self.assertTrue(torch.equal(state[name], tensor))
+
+  def test_experiment_default(self):
+    """The Experiment's policy applies unless the Task has its own."""
+    RetentionPolicy(keep_last=1).save(self.experiment_path)
+    self.task.save_epochs([3, 2, 1])
+    self.assertKept(['epoch2.pt'])
+    self.task.retention = RetentionPolicy(keep_last=2)
+    self.task.save_epochs([3, 2, 1], filename='again{}.pt')
+    self.assertKept(['again1.pt', 'again2.pt'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,146 @@
+"""Tests for the inference server: batching of requests, errors and statistics."""
+
+import json
+import threading
+import types
+import unittest
+import urllib.error
+import urllib.request
+
+import torch
+
+import flammable
+from flammable.pool import ModelPool
+from flammable.server import InferenceServer
+
+class Doubler():
+  """Evaluable doubling lists of numbers, recording the batches it is given."""
+  def __init__(self):
+    self.batches = []
+
+  def decode_request(self, payload):
+    return json.loads(payload)
+
+  def eval_batch(self, samples):
+    self.batches.append(len(samples))
+    return [[2 * value for value in sample] for sample in samples]
+
+  def encode_response(self, result):
+    return json.dumps(result).encode()
+
+
+class Failing(Doubler):
+  def __init__(self, error=None):
+    super(Failing, self).__init__()
+    self.error = error
+
+  def eval_batch(self, samples):
+    if self.error:
+      raise self.error
+    return super(Failing, self).eval_batch(samples)[1:]
+
+
+class FakeExperiment():
+  """Just enough of an Experiment for a ModelPool whose imports fail."""
+  snapshot_names = ['snapshot']
+
+  def get_snapshot(self, name_or_id):
+    if name_or_id in self.snapshot_names:
+      return types.SimpleNamespace(uid='uid')
+    return None
+
+  def import_snapshot(self, snapshot):
+    raise KeyError('weights')
+
+
+class TestServer(unittest.TestCase):
+  def setUp(self):
+    self.models = {'': Doubler(), 'wrong_count': Failing(), 'key_error': Failing(KeyError('x'))}
+    self.server = self.start(lambda name: self.models.get(name), max_batch=8, max_latency=0.5)
+
+  def start(self, route, **kwargs):
+    server = InferenceServer(route, port=0, **kwargs)
+    thread = threading.Thread(target=server.httpd.serve_forever, daemon=True)
+    thread.start()
+    self.addCleanup(server.httpd.server_close)
+    self.addCleanup(server.httpd.shutdown)
+    return server
+
+  def request(self, path, payload=None, server=None):
+    """Return the status code and the decoded response to a request."""
+    host, port = (server or self.server).httpd.server_address[:2]
+    url = 'http://{}:{}{}'.format(host, port, path)
+    data = None if payload is None else json.dumps(payload).encode()
+    try:
+      with urllib.request.urlopen(url, data=data, timeout=10) as response:
+        return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+      return error.code, json.loads(error.read())
+
+  def test_batching(self):
+    """Concurrent requests are evaluated together, each getting its own result."""
+    responses = [None] * 8
+    def send(i):
+      responses[i] = self.request('/eval', [i, i + 1])
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertListEqual(responses, [(200, [2 * i, 2 * i + 2]) for i in range(8)])
+    self.assertEqual(sum(self.models[''].batches), 8)
+    self.assertLess(len(self.models[''].batches), 8)
+
+  def test_not_found(self):
+    self.assertEqual(self.request('/eval/missing', [1])[0], 404)
+    self.assertEqual(self.request('/other', [1])[0], 404)
+    self.assertEqual(self.request('/missing')[0], 404)
+
+  def test_errors(self):
+    """Errors of the model are server errors, even KeyErrors."""
+    status, response = self.request('/eval/key_error', [1])
+    self.assertEqual(status, 500)
+    self.assertIn('KeyError', response['error'])
+    # Every request of a batch fails if the results do not match the samples
+    responses = [None] * 3
+    def send(i):
+      responses[i] = self.request('/eval/wrong_count', [i])
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(3)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertListEqual([status for status, _ in responses], [500] * 3)
+
+  def test_pool_errors(self):
+    """Only a missing Snapshot is Not Found, failures of loading one are not."""
+    pool = ModelPool(FakeExperiment())
+    server = self.start(pool.route)
+    self.assertEqual(self.request('/eval/missing', [1], server=server)[0], 404)
+    status, response = self.request('/eval', [1], server=server)
+    self.assertEqual(status, 500)
+    self.assertIn('weights', response['error'])
+
+  def test_stats(self):
+    for i in range(3):
+      self.request('/eval', [i])
+    self.request('/eval/missing', [1])
+    status, stats = self.request('/stats')
+    self.assertEqual(status, 200)
+    self.assertEqual(stats['request_rate']['events'], 4)
+    self.assertEqual(stats['batch_size']['sum'], 3)
+    self.assertEqual(stats['latency']['count'], 3)
+    self.assertDictEqual(stats['result_cache'], {})
+
+
+class TestDecoding(unittest.TestCase):
+  def test_integers_as_floats(self):
+    """Default requests are model inputs, floating point even if written as integers."""
+    task = flammable.Task(torch.nn.Linear(2, 1))
+    sample = task.decode_request(b'[1, 2]')
+    self.assertEqual(sample.dtype, torch.get_default_dtype())
+    self.assertEqual(task.model(sample).shape, (1,))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,137 @@
+"""Tests for Snapshot writes: many concurrent processes, and the journal."""
+
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from flammable.follower import SnapshotFollower
+from flammable.snapshot import Snapshot
+
+WRITERS = 8
+WRITES = 50
+
+def append_values(root_path, writer, interval):
+  """Append WRITES values to the Snapshot as a separate process would."""
+  snapshot = Snapshot(root_path)
+  snapshot.coalesce_writes(interval)
+  for i in range(WRITES):
+    with snapshot.train_storage() as transaction:
+      transaction.append('values', [writer, i])
+    if i % 10 == 9:
+      with snapshot.custom_storage() as transaction:
+        transaction.store('writer{}'.format(writer), i)
+  snapshot.register_model_file('model{}.pt'.format(writer), writer=writer)
+  snapshot.flush()
+
+class TestConcurrentWrites(unittest.TestCase):
+  """Many processes writing to one Snapshot at once must not lose anything."""
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.snapshot = Snapshot.create(self.sandbox.name, 'stress', None, None, None, None)
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def run_writers(self, interval):
+    context = multiprocessing.get_context('spawn')
+    processes = [
+      context.Process(target=append_values, args=(self.sandbox.name, writer, interval))
+      for writer in range(WRITERS)
+    ]
+    for process in processes:
+      process.start()
+    for process in processes:
+      process.join()
+      self.assertEqual(process.exitcode, 0)
+
+  def check_complete(self):
+    snapshot = Snapshot(self.sandbox.name)
+    expected = [[writer, i] for writer in range(WRITERS) for i in range(WRITES)]
+    self.assertCountEqual(snapshot.train_data['values'], expected)
+    for writer in range(WRITERS):
+      # Writes of each process are in order
+      own = [value for value in snapshot.train_data['values'] if value[0] == writer]
+      self.assertListEqual(own, [[writer, i] for i in range(WRITES)])
+      self.assertEqual(snapshot.custom_data['writer{}'.format(writer)], WRITES - 1)
+      self.assertEqual(snapshot.model_info['model{}.pt'.format(writer)], {'writer': writer})
+    self.assertEqual(len(snapshot.model_files), WRITERS)
+    # Replaying the journal gives the same state as well
+    state = {}
+    apply_updates(state, SnapshotFollower(snapshot).poll())
+    self.assertCountEqual(state['train_data']['values'], expected)
+    self.assertDictEqual(state['custom_data'], snapshot.custom_data)
+
+  def test_locked(self):
+    """Every transaction is written on its own."""
+    self.run_writers(None)
+    self.check_complete()
+
+  def test_coalesced(self):
+    """Transactions are written in batches."""
+    self.run_writers(0.05)
+    self.check_complete()
+    self.assertFalse([name for name in os.listdir(self.sandbox.name) if name.endswith('.tmp')])
+
+
+def apply_updates(state, updates):
+  """Apply follower updates to a dict of sections, as a consumer would."""
+  for section, mode, name, value in updates:
+    data = state.setdefault(section, {})
+    if mode == 'clear':
+      data.clear()
+    elif mode == 'store':
+      data[name] = value
+    else:
+      data.setdefault(name, []).append(value)
+
+class TestJournal(unittest.TestCase):
+  """The journal stays bounded, and followers keep up with its changes."""
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.snapshot = Snapshot.create(self.sandbox.name, 'journal', None, None, None, None)
+    self.journal_path = self.snapshot.make_path(Snapshot._journal_file)
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def test_compaction(self):
+    """Overwriting the same entries does not grow the journal forever."""
+    follower = SnapshotFollower(self.snapshot)
+    state = {}
+    value = 'x' * 1000
+    for i in range(500):
+      with self.snapshot.iter_storage() as transaction:
+        transaction.clear()
+        transaction.append('value', value)
+        transaction.append('iter_i', i)
+      if i % 7 == 0:
+        apply_updates(state, follower.poll())
+    apply_updates(state, follower.poll())
+    self.assertLess(os.path.getsize(self.journal_path), 2 * 2 ** 16)
+    self.assertDictEqual(state['iter_data'], {'value': [value], 'iter_i': [499]})
+    # Replaying the compacted journal from scratch gives the same state
+    fresh = {}
+    apply_updates(fresh, SnapshotFollower(self.snapshot).poll())
+    self.assertDictEqual(fresh['iter_data'], state['iter_data'])
+
+  def test_follow_reset(self):
+    """A journal recreated by a reset is read from its beginning."""
+    follower = SnapshotFollower(self.snapshot)
+    with self.snapshot.train_storage() as transaction:
+      transaction.append('loss', 1.0)
+    self.assertEqual(len(follower.poll()), 1)
+    self.snapshot.reset()
+    # The new journal outgrows the old one before the next poll
+    with self.snapshot.train_storage() as transaction:
+      transaction.append('loss', 0.5)
+      transaction.append('accuracy', 0.25)
+    updates = follower.poll()
+    self.assertListEqual(updates, [
+      ('train_data', 'append', 'loss', 0.5),
+      ('train_data', 'append', 'accuracy', 0.25),
+    ])
+
+
+if __name__ == '__main__':
+  unittest.main()
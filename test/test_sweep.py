@@ -0,0 +1,63 @@
+"""Tests for parallel training sweeps."""
+
+import os
+import tempfile
+import unittest
+
+import torch
+
+import flammable
+from flammable.snapshot import Snapshot
+from flammable.sweep import run_sweep
+
+class SandboxExperiment():
+  """Stands in for an Experiment, creating Snapshots in a temporary folder."""
+  def __init__(self, path):
+    self.path = path
+    self.count = 0
+
+  def make_snapshot(self, message=None):
+    self.count += 1
+    root_path = os.path.join(self.path, str(self.count))
+    os.mkdir(root_path)
+    return Snapshot.create(root_path, str(self.count), None, None, None, message)
+
+
+class RecordingTask(flammable.Task):
+  """Records the initial weights of each run, then changes them."""
+  def __init__(self):
+    super(RecordingTask, self).__init__(torch.nn.Linear(4, 2))
+    self.step = 0
+
+  def train(self):
+    with self.snapshot.custom_storage() as transaction:
+      transaction.store('initial', [p.tolist() for p in self.model.parameters()])
+      transaction.store('step', self.step)
+    with torch.no_grad():
+      for parameter in self.model.parameters():
+        parameter.add_(1.0)
+
+
+class TestSweep(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.task = RecordingTask()
+    self.task.experiment = SandboxExperiment(self.sandbox.name)
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def test_fresh_start(self):
+    """Configurations trained by one worker all start from the same state."""
+    results = run_sweep(self.task, [{'step': 1}, {'step': 2}, {'step': 3}], workers=1)
+    self.assertListEqual([result['status'] for result in results], ['done'] * 3)
+    initial = [p.tolist() for p in self.task.model.parameters()]
+    for index, result in enumerate(results):
+      snapshot = Snapshot(os.path.join(self.sandbox.name, result['snapshot']))
+      self.assertEqual(snapshot.custom_data['initial'], initial)
+      self.assertEqual(snapshot.custom_data['step'], index + 1)
+      self.assertEqual(snapshot.custom_data['sweep']['status'], 'done')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,136 @@
+"""Tests for probing batch sizes."""
+
+import copy
+import os
+import tempfile
+import time
+import unittest
+
+import torch
+
+import flammable
+from flammable.snapshot import Snapshot
+from flammable.tuning import autotune_loader, probe_batch_sizes
+
+SIZES = [1, 2, 4, 8, 16]
+# Above the largest size glibc may keep in its heap, so that memory is returned
+SAMPLE_BYTES = 40 * 2 ** 20
+
+class TestProbeBatchSizes(unittest.TestCase):
+  def setUp(self):
+    self.batch = torch.randn(4, 3)
+
+  def failing_step(self, error, from_size=8):
+    def step(batch):
+      if len(batch) >= from_size:
+        raise error
+    return step
+
+  def probed_sizes(self, step, **kwargs):
+    return [result['batch_size'] for result in probe_batch_sizes(step, self.batch, SIZES, iterations=1, **kwargs)]
+
+  def test_cpu_allocator(self):
+    """CPU allocation failures are not worded "out of memory"."""
+    error = RuntimeError("[enforce fail at alloc_cpu.cpp:117] data. DefaultCPUAllocator: can't allocate memory: you tried to allocate 1099511627776 bytes.")
+    self.assertListEqual(self.probed_sizes(self.failing_step(error)), [1, 2, 4])
+
+  def test_out_of_memory_types(self):
+    for error in [MemoryError(), torch.cuda.OutOfMemoryError("CUDA out of memory.")]:
+      self.assertListEqual(self.probed_sizes(self.failing_step(error, 4)), [1, 2])
+
+  def test_other_errors(self):
+    """Errors other than running out of memory are not hidden."""
+    with self.assertRaises(RuntimeError):
+      self.probed_sizes(self.failing_step(RuntimeError("shape mismatch")))
+
+  def test_memory_limit(self):
+    """Sizes using more memory than the limit are not returned."""
+    def step(batch):
+      data = torch.ones(len(batch) * SAMPLE_BYTES // 4)
+      time.sleep(0.05)  # let the monitor see it
+      del data
+    results = probe_batch_sizes(step, self.batch, SIZES, iterations=1, memory_limit=3 * SAMPLE_BYTES)
+    self.assertListEqual([result['batch_size'] for result in results], [1, 2])
+    for result in results:
+      self.assertGreaterEqual(result['peak_memory'], result['batch_size'] * SAMPLE_BYTES * 0.9)
+
+
+class TuningTask(flammable.Task):
+  def __init__(self):
+    model = torch.nn.Sequential(torch.nn.Linear(4, 8), torch.nn.BatchNorm1d(8), torch.nn.Linear(8, 2))
+    super(TuningTask, self).__init__(model)
+    self.device = 'cpu'
+    self.iterations = 0
+    self.criterion = torch.nn.CrossEntropyLoss()
+    self.optimizer = torch.optim.Adam(self.model.parameters(), lr=0.1)
+
+  def get_training_data(self):
+    dataset = torch.utils.data.TensorDataset(torch.randn(32, 4), torch.randint(0, 2, (32,)))
+    return torch.utils.data.DataLoader(dataset, batch_size=8)
+
+  def iteration(self, sample):
+    self.iterations += 1
+    return super(TuningTask, self).iteration(sample)
+
+
+class TestAutotune(unittest.TestCase):
+  def setUp(self):
+    self.task = TuningTask()
+    # Give the optimizer some state of its own
+    self.task.iteration(next(iter(self.task.get_training_data())))
+    self.model_state = {k: v.clone() for k, v in self.task.model.state_dict().items()}
+    self.optimizer_state = copy.deepcopy(self.task.optimizer.state_dict()['state'])
+
+  def assertStateRestored(self):
+    for name, tensor in self.task.model.state_dict().items():
+      self.assertTrue(torch.equal(tensor, self.model_state[name]), name)
+    state = self.task.optimizer.state_dict()['state']
+    self.assertSetEqual(set(state.keys()), set(self.optimizer_state.keys()))
+    for key, value in state.items():
+      for name, tensor in value.items():
+        self.assertTrue(torch.equal(torch.as_tensor(tensor), torch.as_tensor(self.optimizer_state[key][name])), name)
+
+  def test_restores_state(self):
+    """Calibration passes leave no trace in the model, optimizer and threads."""
+    threads = torch.get_num_threads()
+    config, results = autotune_loader(
+      self.task, self.task.get_training_data(), worker_counts=[0, 1], prefetch_factors=(2, 4), thread_counts=[1], iterations=3
+    )
+    self.assertGreater(self.task.iterations, 1)
+    self.assertStateRestored()
+    self.assertEqual(torch.get_num_threads(), threads)
+    self.assertSetEqual(set(config.keys()), {'num_workers', 'prefetch_factor', 'pin_memory', 'threads'})
+    self.assertIn(config['num_workers'], [0, 1])
+    # Workers, prefetch factors (only with workers), threads
+    self.assertEqual(len(results), 2 + (2 if config['num_workers'] else 0) + 1)
+
+  def test_restores_on_error(self):
+    original = self.task.iteration
+    def failing(sample):
+      if self.task.iterations == 4:
+        raise RuntimeError("failed")
+      return original(sample)
+    self.task.iteration = failing
+    with self.assertRaises(RuntimeError):
+      autotune_loader(self.task, self.task.get_training_data(), worker_counts=[0], thread_counts=[1], iterations=5)
+    self.assertStateRestored()
+
+  def test_reused(self):
+    """Settings found by one Snapshot are reused by others of the same commit."""
+    with tempfile.TemporaryDirectory(prefix='flm') as sandbox:
+      for name in ['first', 'second']:
+        root_path = os.path.join(sandbox, 'snapshots', name)
+        os.makedirs(root_path)
+        self.task.snapshot = Snapshot.create(root_path, name, 'commit', None, None, None)
+        self.task.iterations = 0
+        self.task.tune_data(self.task.get_training_data())
+        if name == 'first':
+          self.assertGreater(self.task.iterations, 0)
+          found = self.task.snapshot.custom_data['autotune']
+        else:
+          self.assertEqual(self.task.iterations, 0)
+          self.assertDictEqual(self.task.snapshot.custom_data['autotune'], {'config': found['config'], 'results': None})
+
+
+if __name__ == '__main__':
+  unittest.main()
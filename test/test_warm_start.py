@@ -0,0 +1,131 @@
+"""Tests for initializing models from other Snapshots, and tracing that lineage."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+
+import flammable
+from flammable.cache import fingerprint_file
+from flammable.experiment import Experiment
+from flammable.snapshot import Snapshot
+
+class Encoder(torch.nn.Module):
+  """The first layer of the source model, under another name."""
+  def __init__(self):
+    super(Encoder, self).__init__()
+    self.encoder = torch.nn.Linear(4, 8)
+
+
+class TestWarmStart(unittest.TestCase):
+  def setUp(self):
+    self.sandbox = tempfile.TemporaryDirectory(prefix='flm')
+    self.experiment_path = os.path.join(self.sandbox.name, 'experiment')
+    Experiment.new(self.experiment_path)
+    self.source = self.make_task(torch.nn.Sequential(
+      torch.nn.Linear(4, 8), torch.nn.ReLU(), torch.nn.Linear(8, 2)
+    ), 'aaaaa')
+    self.source.save_model('first.pt')
+    with torch.no_grad():
+      self.source.model[0].weight.add_(1.0)
+    self.source.save_model('last.pt')
+
+  def tearDown(self):
+    self.sandbox.cleanup()
+
+  def make_task(self, model, uid):
+    task = flammable.Task(model)
+    task.device = 'cpu'
+    root_path = os.path.join(self.experiment_path, 'snapshots', '20260101-000000-' + uid)
+    os.mkdir(root_path)
+    task.snapshot = Snapshot.create(root_path, uid, 'sha-' + uid, None, None, None)
+    return task
+
+  def assertLoaded(self, model, state):
+    for name, tensor in model.state_dict().items():
+      self.assertTrue(torch.equal(tensor, state[name]), name)
+
+  def test_provenance(self):
+    """The last model file is loaded, its source is stored in custom_data."""
+    task = self.make_task(Encoder(), 'bbbbb')
+    provenance = task.warm_start_from(self.source.snapshot, prefix='0.', prefixes={'0.': 'encoder.'})
+    self.assertLoaded(task.model, {
+      'encoder.weight': self.source.model[0].weight, 'encoder.bias': self.source.model[0].bias,
+    })
+    self.assertDictEqual(provenance, {
+      'snapshot': '20260101-000000-aaaaa',
+      'uid': 'aaaaa',
+      'commit_sha': 'sha-aaaaa',
+      'model_file': 'last.pt',
+      'model_hash': fingerprint_file(self.source.snapshot.make_path('last.pt')),
+      'prefix': '0.',
+      'prefixes': {'0.': 'encoder.'},
+      'patterns': None,
+      'strict': True,
+      'loaded_keys': 2,
+      'missing_keys': [],
+      'unexpected_keys': [],
+    })
+    self.assertDictEqual(Snapshot(task.snapshot.root_path).custom_data['warm_start'], provenance)
+
+  def test_by_name(self):
+    """Sources of the same Experiment can be given by ID, the model file by name."""
+    task = self.make_task(Encoder(), 'bbbbb')
+    task.warm_start_from('aaaaa', 'first.pt', patterns=[(r'^0\.', 'encoder.'), (r'^2\..*', 'head')], strict=False)
+    first = torch.load(self.source.snapshot.make_path('first.pt'))
+    self.assertLoaded(task.model, {'encoder.weight': first['0.weight'], 'encoder.bias': first['0.bias']})
+    provenance = task.snapshot.custom_data['warm_start']
+    self.assertEqual(provenance['model_file'], 'first.pt')
+    self.assertEqual(provenance['loaded_keys'], 2)
+    self.assertListEqual(provenance['unexpected_keys'], ['head'])
+
+  def test_strict(self):
+    """Unless strict, entries of the model that were not loaded are recorded."""
+    model = torch.nn.Sequential(torch.nn.Linear(4, 8), torch.nn.Linear(8, 8))
+    task = self.make_task(model, 'bbbbb')
+    with self.assertRaises(RuntimeError):
+      task.warm_start_from(self.source.snapshot, prefix='0.')
+    self.assertNotIn('warm_start', task.snapshot.custom_data)
+    provenance = task.warm_start_from(self.source.snapshot, prefix='0.', strict=False)
+    self.assertListEqual(provenance['missing_keys'], ['1.weight', '1.bias'])
+    self.assertTrue(torch.equal(task.model[0].weight, self.source.model[0].weight))
+
+  def test_missing(self):
+    task = self.make_task(Encoder(), 'bbbbb')
+    with self.assertRaises(KeyError):
+      task.warm_start_from('zzzzz')
+    with self.assertRaises(RuntimeError):
+      task.warm_start_from(self.source.snapshot, 'missing.pt')
+    # A source that has no model files at all
+    empty = self.make_task(Encoder(), 'ccccc')
+    with self.assertRaises(RuntimeError):
+      task.warm_start_from(empty.snapshot)
+    self.assertNotIn('warm_start', task.snapshot.custom_data)
+
+  def test_outside_experiment(self):
+    """Only a Snapshot can be given if there is no Experiment to look it up in."""
+    task = flammable.Task(Encoder())
+    task.snapshot = Snapshot.create(self.sandbox.name, 'ddddd', None, None, None, None)
+    with self.assertRaises(RuntimeError):
+      task.warm_start_from('aaaaa')
+
+  def test_lineage(self):
+    """Each Snapshot leads to its source, until one trained from scratch or removed."""
+    middle = self.make_task(torch.nn.Sequential(torch.nn.Linear(4, 8)), 'bbbbb')
+    middle.warm_start_from(self.source.snapshot, prefix='0.')
+    middle.save_model('model.pt')
+    last = self.make_task(Encoder(), 'ccccc')
+    last.warm_start_from('bbbbb', prefixes={'0.': 'encoder.'})
+    chain = Experiment(self.experiment_path).lineage('ccccc')
+    self.assertListEqual([snapshot.uid for snapshot in chain], ['ccccc', 'bbbbb', 'aaaaa'])
+    self.assertListEqual(Experiment(self.experiment_path).lineage('aaaaa')[0].model_files, ['first.pt', 'last.pt'])
+    self.assertListEqual(Experiment(self.experiment_path).lineage('zzzzz'), [])
+    shutil.rmtree(self.source.snapshot.root_path)
+    chain = Experiment(self.experiment_path).lineage('20260101-000000-ccccc')
+    self.assertListEqual([snapshot.uid for snapshot in chain], ['ccccc', 'bbbbb'])
+
+
+if __name__ == '__main__':
+  unittest.main()